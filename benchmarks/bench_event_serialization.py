@@ -0,0 +1,85 @@
+"""Encoding cost of chat payloads with the standard library and the orjson backend.
+
+`serialize_event` uses orjson when it is installed and only calls
+`EventSerializer.default` for datetimes, dataclasses and types orjson does not know.
+
+Run with `poetry run python benchmarks/bench_event_serialization.py`.
+"""
+
+import json
+import timeit
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timezone
+
+from langfuse import serializer
+from langfuse.serializer import EventSerializer, serialize_event
+
+REPEAT = 2_000
+
+
+@dataclass
+class ToolCall:
+    name: str
+    arguments: str
+
+
+def make_event(turns: int) -> dict:
+    messages = [{"role": "system", "content": "You are a helpful assistant."}]
+    for i in range(turns):
+        messages.append(
+            {"role": "user", "content": f"Question {i}: what is Langfuse? " * 10}
+        )
+        messages.append(
+            {
+                "role": "assistant",
+                "content": "Langfuse is an open source LLM engineering platform. " * 8,
+                "tool_calls": [ToolCall("search", '{"query": "langfuse"}')],
+            }
+        )
+
+    return {
+        "id": str(uuid.uuid4()),
+        "type": "generation-create",
+        "timestamp": datetime.now(timezone.utc),
+        "body": {
+            "id": uuid.uuid4(),
+            "traceId": str(uuid.uuid4()),
+            "name": "chat",
+            "startTime": datetime.now(timezone.utc),
+            "model": "gpt-4o",
+            "modelParameters": {"temperature": 0.7, "maxTokens": 1000},
+            "input": messages,
+            "output": {"role": "assistant", "content": "Sure. " * 50},
+            "usage": {"input": 1200, "output": 300, "unit": "TOKENS"},
+            "metadata": {"user": "user-1234", "tags": ["a", "b", "c"]},
+        },
+    }
+
+
+def main():
+    if serializer.orjson is None:
+        print("orjson is not installed, pip install orjson")
+        return
+
+    for turns in (1, 10, 50):
+        event = make_event(turns)
+
+        def stdlib():
+            return json.dumps(event, cls=EventSerializer).encode("utf-8")
+
+        baseline = min(timeit.repeat(stdlib, number=REPEAT, repeat=5))
+        fast = min(
+            timeit.repeat(lambda: serialize_event(event), number=REPEAT, repeat=5)
+        )
+
+        print(
+            f"{turns:3d} turns, {len(stdlib()):7d} bytes: "
+            f"json {baseline / REPEAT * 1e6:8.1f} us, "
+            f"orjson {fast / REPEAT * 1e6:8.1f} us, "
+            f"speedup {baseline / fast:.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Per-event encoding cost of the ingestion pipeline.
+
+Compares the previous pipeline, which encoded every event three times (validation
+in `TaskManager.add_task`, size check in `Consumer._next` and the request body in
+`LangfuseClient.post`), with the current one that encodes each event once and
+joins the pre-encoded fragments into the request body.
+
+Run with `poetry run python benchmarks/bench_ingestion_encoding.py`.
+"""
+
+import json
+import timeit
+import uuid
+from datetime import datetime, timezone
+
+from langfuse.request import LangfuseClient
+from langfuse.serializer import EventSerializer
+from langfuse.task_manager import QueuedEvent
+
+BATCH_SIZE = 15
+REPEAT = 20
+
+
+def make_event(i: int) -> dict:
+    paragraph = "Langfuse is an open source LLM engineering platform. " * 40
+    return {
+        "id": str(uuid.uuid4()),
+        "type": "generation-create",
+        "timestamp": datetime.now(timezone.utc),
+        "body": {
+            "id": str(uuid.uuid4()),
+            "traceId": str(uuid.uuid4()),
+            "name": f"generation-{i}",
+            "startTime": datetime.now(timezone.utc),
+            "model": "gpt-3.5-turbo",
+            "modelParameters": {"temperature": 0.7, "maxTokens": 1000},
+            "input": [
+                {"role": "system", "content": "You are a helpful assistant."},
+                {"role": "user", "content": paragraph},
+            ],
+            "output": {"role": "assistant", "content": paragraph},
+            "metadata": {"user": "user-1234", "tags": ["a", "b", "c"]},
+        },
+    }
+
+
+def legacy_pipeline(events):
+    for event in events:
+        json.dumps(event, cls=EventSerializer)  # validation in add_task
+    for event in events:
+        len(json.dumps(event, cls=EventSerializer).encode())  # size in _next
+    json.dumps({"batch": events, "metadata": {}}, cls=EventSerializer)  # post
+
+
+def current_pipeline(client, events):
+    items = [QueuedEvent(event) for event in events]  # add_task
+    for item in items:
+        len(item.data)  # size in _next
+    client._encode_body({"batch": [item.data for item in items], "metadata": {}})
+
+
+def main():
+    client = LangfuseClient("pk", "sk", "http://localhost:3000", "bench", 1, None)
+    events = [make_event(i) for i in range(BATCH_SIZE)]
+    event_size = len(json.dumps(events[0], cls=EventSerializer))
+
+    legacy = min(
+        timeit.repeat(lambda: legacy_pipeline(events), number=REPEAT, repeat=5)
+    )
+    current = min(
+        timeit.repeat(lambda: current_pipeline(client, events), number=REPEAT, repeat=5)
+    )
+
+    per_event = REPEAT * BATCH_SIZE
+    print(f"event size: {event_size} bytes")
+    print(f"legacy:  {legacy / per_event * 1e6:8.1f} us/event")
+    print(f"current: {current / per_event * 1e6:8.1f} us/event")
+    print(f"reduction: {(1 - current / legacy) * 100:.0f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Per-call overhead of `@observe` for sync, async, generator and nested functions.
+
+Events are recorded with an in-memory exporter, so the numbers cover the decorator and
+event creation without network I/O. The overhead is the difference to the same
+function without the decorator.
+
+Run with `poetry run python benchmarks/bench_observe_overhead.py`.
+"""
+
+import asyncio
+import timeit
+
+from langfuse import Langfuse
+from langfuse.decorators import observe
+from langfuse.exporter import InMemoryExporter
+from langfuse.utils.langfuse_singleton import LangfuseSingleton
+
+CALLS = 2_000
+PROMPT = "Summarize the following document. " * 20
+
+
+def plain(prompt: str, temperature: float = 0.7) -> str:
+    return prompt[:10]
+
+
+async def plain_async(prompt: str, temperature: float = 0.7) -> str:
+    return prompt[:10]
+
+
+def plain_generator(prompt: str):
+    yield from prompt.split()[:10]
+
+
+def plain_nested(prompt: str) -> str:
+    return plain(plain(prompt))
+
+
+observed = observe()(plain)
+observed_async = observe()(plain_async)
+observed_generator = observe()(plain_generator)
+
+
+@observe()
+def observed_nested(prompt: str) -> str:
+    return observed(observed(prompt))
+
+
+def run_async(func):
+    async def calls():
+        for _ in range(CALLS):
+            await func(PROMPT)
+
+    return lambda: asyncio.run(calls())
+
+
+def run_sync(func):
+    def calls():
+        for _ in range(CALLS):
+            func(PROMPT)
+
+    return calls
+
+
+def run_generator(func):
+    def calls():
+        for _ in range(CALLS):
+            list(func(PROMPT))
+
+    return calls
+
+
+def measure(run) -> float:
+    return min(timeit.repeat(run, number=1, repeat=5)) / CALLS
+
+
+def main():
+    exporter = InMemoryExporter()
+    LangfuseSingleton()._langfuse = Langfuse(
+        exporter=exporter, flush_at=1_000, debug=False
+    )
+
+    cases = [
+        ("sync", run_sync(plain), run_sync(observed)),
+        ("async", run_async(plain_async), run_async(observed_async)),
+        (
+            "generator",
+            run_generator(plain_generator),
+            run_generator(observed_generator),
+        ),
+        ("nested (3 levels)", run_sync(plain_nested), run_sync(observed_nested)),
+    ]
+
+    for name, baseline, decorated in cases:
+        overhead = measure(decorated) - measure(baseline)
+        print(f"{name:18s} {overhead * 1e6:8.1f} us/call")
+        exporter.clear()
+
+    LangfuseSingleton().reset()
+
+
+if __name__ == "__main__":
+    main()
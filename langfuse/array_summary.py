@@ -0,0 +1,170 @@
+"""Compact summaries of NumPy arrays, PyTorch tensors and pandas objects in traced data.
+
+Arrays passed to or returned from observed functions, e.g. embedding matrices of a RAG
+pipeline, are not serialized element by element. They are recorded as a summary with
+their shape, dtype and the first and last few values:
+
+```python
+{"type": "numpy.ndarray", "shape": [1000, 768], "dtype": "float32", "head": [...], "tail": [...]}
+```
+
+Set `LANGFUSE_ARRAY_STATS=true` to add the minimum, maximum, mean and standard deviation
+of numeric values. Wrap a value in `FullData` to record all of its values instead:
+
+```python
+from langfuse.array_summary import FullData
+
+@observe()
+def rerank(scores):
+    return FullData(scores)
+```
+
+NumPy, PyTorch and pandas are not imported by Langfuse; summaries are selected by the
+class of the value.
+"""
+
+import os
+from typing import Any, Callable, Dict
+
+# number of values in the head and in the tail of a summary
+PREVIEW_ITEMS = 3
+# number of columns of a dataframe that are listed in its summary
+MAX_COLUMNS = 50
+
+compute_stats = os.environ.get("LANGFUSE_ARRAY_STATS", "false").lower() == "true"
+
+
+class FullData(object):
+    """Wraps an array, tensor or dataframe to serialize all of its values instead of a summary."""
+
+    __slots__ = ("value",)
+
+    def __init__(self, value: Any):
+        self.value = value
+
+
+def summarize_ndarray(array) -> dict:
+    summary = {
+        "type": "numpy.ndarray",
+        "shape": list(array.shape),
+        "dtype": str(array.dtype),
+        **_preview(array.size, lambda start, stop: array.flat[start:stop].tolist()),
+    }
+
+    if compute_stats and array.size > 0 and array.dtype.kind in "biuf":
+        import numpy
+
+        summary["stats"] = {
+            "min": numpy.nanmin(array).item(),
+            "max": numpy.nanmax(array).item(),
+            "mean": numpy.nanmean(array).item(),
+            "std": numpy.nanstd(array).item(),
+        }
+
+    return summary
+
+
+def summarize_tensor(tensor) -> dict:
+    tensor = tensor.detach()
+    flat = tensor.flatten()
+    summary = {
+        "type": "torch.Tensor",
+        "shape": list(tensor.shape),
+        "dtype": str(tensor.dtype),
+        "device": str(tensor.device),
+        **_preview(tensor.numel(), lambda start, stop: flat[start:stop].tolist()),
+    }
+
+    if compute_stats and tensor.numel() > 0 and tensor.dtype.is_floating_point:
+        summary["stats"] = {
+            "min": tensor.min().item(),
+            "max": tensor.max().item(),
+            "mean": tensor.mean().item(),
+            "std": tensor.std().item() if tensor.numel() > 1 else 0.0,
+        }
+
+    return summary
+
+
+def summarize_dataframe(frame) -> dict:
+    rows = len(frame)
+    summary = {
+        "type": "pandas.DataFrame",
+        "shape": list(frame.shape),
+        "columns": {
+            str(column): str(dtype)
+            for column, dtype in list(frame.dtypes.items())[:MAX_COLUMNS]
+        },
+        **_preview(
+            rows,
+            lambda start, stop: frame.iloc[start:stop].to_dict(orient="records"),
+        ),
+    }
+
+    if compute_stats and rows > 0:
+        stats = frame.describe()
+        summary["stats"] = {
+            str(column): values for column, values in stats.to_dict().items()
+        }
+
+    return summary
+
+
+def summarize_series(series) -> dict:
+    summary = {
+        "type": "pandas.Series",
+        "name": None if series.name is None else str(series.name),
+        "shape": [len(series)],
+        "dtype": str(series.dtype),
+        **_preview(len(series), lambda start, stop: series.iloc[start:stop].tolist()),
+    }
+
+    if compute_stats and len(series) > 0 and series.dtype.kind in "biuf":
+        summary["stats"] = {
+            "min": series.min(),
+            "max": series.max(),
+            "mean": series.mean(),
+            "std": series.std(),
+        }
+
+    return summary
+
+
+def full_data(wrapper: FullData) -> Any:
+    value = wrapper.value
+    module = type(value).__module__
+
+    if module.startswith("pandas") and hasattr(value, "to_dict"):
+        if hasattr(value, "columns"):
+            return value.to_dict(orient="records")
+        return value.tolist()
+
+    if module.startswith("torch"):
+        return value.detach().cpu().tolist()
+
+    if hasattr(value, "tolist"):
+        return value.tolist()
+
+    return value
+
+
+def _preview(size: int, values: Callable[[int, int], list]) -> dict:
+    """Return the first and last `PREVIEW_ITEMS` values, read through `values(start, stop)`."""
+    if size <= 2 * PREVIEW_ITEMS:
+        return {"head": values(0, size)}
+
+    return {
+        "head": values(0, PREVIEW_ITEMS),
+        "tail": values(size - PREVIEW_ITEMS, size),
+    }
+
+
+# summaries by the qualified name of a class, so the libraries do not have to be imported
+SUMMARY_HANDLERS: Dict[str, Callable[[Any], Any]] = {
+    "numpy.ndarray": summarize_ndarray,
+    "numpy.generic": lambda value: value.item(),
+    "torch.Tensor": summarize_tensor,
+    "pandas.core.frame.DataFrame": summarize_dataframe,
+    "pandas.core.series.Series": summarize_series,
+    "langfuse.array_summary.FullData": full_data,
+}
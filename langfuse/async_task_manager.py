@@ -0,0 +1,411 @@
+"""@private"""
+
+import asyncio
+import atexit
+import logging
+import threading
+from collections import deque
+from datetime import datetime, timezone
+from typing import Deque, List, Optional, Set
+
+from langfuse.exporter import Exporter, HTTPExporter
+from langfuse.request import LangfuseClient
+from langfuse.sampling import TraceBuffers
+from langfuse.task_manager import (
+    BATCH_SIZE_LIMIT,
+    DeadLetterHandler,
+    LangfuseMetadata,
+    QueuedEvent,
+    async_upload_with_retries,
+    coalesce_events,
+    enforce_size_limit,
+    log_dead_letters,
+    upload_with_retries,
+)
+
+
+def _get_running_loop() -> Optional[asyncio.AbstractEventLoop]:
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+class AsyncTaskManager(object):
+    """Ingestion engine that runs on the application's asyncio event loop.
+
+    Counterpart of `TaskManager` for ASGI services: instead of consumer threads, a single
+    worker task batches events from an `asyncio.Queue` and uploads them with
+    `httpx.AsyncClient`, keeping up to `max_concurrent_uploads` batches in flight.
+
+    The manager binds to the event loop on which `add_task` is first called. Events added
+    from other threads are handed over to that loop, events added before any loop is
+    known are kept until it is. Events left over once the loop has been closed are
+    uploaded synchronously by `flush`, `join` and at interpreter exit.
+    """
+
+    _log = logging.getLogger("langfuse")
+    _enabled: bool
+    _max_task_queue_size: int
+    _max_concurrent_uploads: int
+    _client: LangfuseClient
+    _flush_at: int
+    _flush_interval: float
+    _max_retries: int
+    _public_key: str
+    _sdk_name: str
+    _sdk_version: str
+    _sdk_integration: str
+    _loop: Optional[asyncio.AbstractEventLoop]
+    _queue: Optional[asyncio.Queue]
+    _worker: Optional[asyncio.Task]
+    trace_buffers: TraceBuffers
+
+    def __init__(
+        self,
+        client: LangfuseClient,
+        flush_at: int,
+        flush_interval: float,
+        max_retries: int,
+        public_key: str,
+        sdk_name: str,
+        sdk_version: str,
+        sdk_integration: str,
+        enabled: bool = True,
+        max_task_queue_size: int = 100_000,
+        max_concurrent_uploads: int = 4,
+        dead_letter_handler: Optional[DeadLetterHandler] = None,
+        coalesce_events: bool = True,
+        exporter: Optional[Exporter] = None,
+    ):
+        self._max_task_queue_size = max_task_queue_size
+        self._max_concurrent_uploads = max_concurrent_uploads
+        self._client = client
+        self._exporter = exporter or HTTPExporter(client)
+        self._flush_at = flush_at
+        self._flush_interval = flush_interval
+        self._max_retries = max_retries
+        self._public_key = public_key
+        self._sdk_name = sdk_name
+        self._sdk_version = sdk_version
+        self._sdk_integration = sdk_integration
+        self._enabled = enabled
+        self._dead_letter_handler = dead_letter_handler or log_dead_letters
+        self._coalesce_events = coalesce_events
+
+        self._loop = None
+        self._queue = None
+        self._worker = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._uploads: Set[asyncio.Task] = set()
+
+        # events added while no event loop is available to process them
+        self._pending: Deque[QueuedEvent] = deque()
+        self._lock = threading.Lock()
+
+        # events of traces that wait for the tail sampler
+        self.trace_buffers = TraceBuffers(self)
+
+        # uploads events left over on a closed event loop when the interpreter exits
+        atexit.register(self.join)
+
+    def add_task(self, event: dict):
+        if not self._enabled:
+            return
+
+        if self.trace_buffers.hold(event):
+            return
+
+        try:
+            event["timestamp"] = datetime.utcnow().replace(tzinfo=timezone.utc)
+
+            item = QueuedEvent(event)
+        except Exception as e:
+            self._log.exception(f"Exception in adding task {e}")
+
+            return False
+
+        running_loop = _get_running_loop()
+        if running_loop is not None and not self._is_bound_loop_alive():
+            self._bind(running_loop)
+
+        if running_loop is not None and running_loop is self._loop:
+            return self._enqueue(item)
+
+        if self._is_bound_loop_alive():
+            self._loop.call_soon_threadsafe(self._enqueue, item)
+            return
+
+        with self._lock:
+            if len(self._pending) >= self._max_task_queue_size:
+                self._log.warning("analytics-python queue is full")
+                return False
+
+            self._pending.append(item)
+
+    def _is_bound_loop_alive(self) -> bool:
+        return (
+            self._loop is not None
+            and not self._loop.is_closed()
+            and self._loop.is_running()
+        )
+
+    def _enqueue(self, item: QueuedEvent):
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self._log.warning("analytics-python queue is full")
+            return False
+
+    def _bind(self, loop: asyncio.AbstractEventLoop):
+        """Bind the manager to `loop` and start the worker task. Must be called from within `loop`."""
+        self._log.debug("binding async task manager to event loop")
+
+        leftovers = self._drain_queue()
+        if self._loop is not None:
+            # connections of the previous session belong to the old event loop
+            self._client.reset_async_session()
+
+        self._loop = loop
+        self._queue = asyncio.Queue(self._max_task_queue_size)
+        self._semaphore = asyncio.Semaphore(self._max_concurrent_uploads)
+        self._uploads = set()
+
+        with self._lock:
+            leftovers.extend(self._pending)
+            self._pending.clear()
+
+        for item in leftovers:
+            self._enqueue(item)
+
+        self._worker = loop.create_task(self._run())
+
+    def _drain_queue(self) -> List[QueuedEvent]:
+        items = []
+        if self._queue is None:
+            return items
+
+        while True:
+            try:
+                items.append(self._queue.get_nowait())
+                self._queue.task_done()
+            except asyncio.QueueEmpty:
+                return items
+
+    async def _run(self):
+        self._log.debug("async consumer is running...")
+        queue, semaphore = self._queue, self._semaphore
+
+        while True:
+            batch = await self._next(queue)
+            if len(batch) == 0:
+                continue
+
+            await semaphore.acquire()
+            task = asyncio.ensure_future(self._upload(batch, queue, semaphore))
+            self._uploads.add(task)
+            task.add_done_callback(self._uploads.discard)
+
+    async def _next(self, queue: asyncio.Queue) -> List[QueuedEvent]:
+        """Return the next batch of items to upload."""
+        items = []
+        total_size = 0
+
+        # Wait for the first item without a timeout so that an idle worker does not wake up
+        item = await queue.get()
+        start_time = self._loop.time()
+
+        while True:
+            if enforce_size_limit(item, self._log):
+                items.append(item)
+                total_size += len(item.data)
+            else:
+                queue.task_done()
+
+            if len(items) >= self._flush_at:
+                break
+
+            if total_size >= BATCH_SIZE_LIMIT:
+                self._log.debug("hit batch size limit (size: %d)", total_size)
+                break
+
+            remaining = self._flush_interval - (self._loop.time() - start_time)
+            if remaining <= 0:
+                break
+
+            try:
+                item = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                try:
+                    item = await asyncio.wait_for(queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+
+        self._log.debug("~%d items in the Langfuse queue", queue.qsize())
+
+        if self._coalesce_events:
+            batch = coalesce_events(items)
+            # merged events are acknowledged together with the event they were merged into
+            for _ in range(len(items) - len(batch)):
+                queue.task_done()
+
+            return batch
+
+        return items
+
+    async def _upload(
+        self,
+        batch: List[QueuedEvent],
+        queue: asyncio.Queue,
+        semaphore: asyncio.Semaphore,
+    ):
+        try:
+            await self._upload_batch(batch)
+        except Exception as e:
+            self._log.exception("error uploading: %s", e)
+        finally:
+            # mark items as acknowledged from queue
+            for _ in batch:
+                queue.task_done()
+
+            semaphore.release()
+
+    def _metadata(self, batch_size: int) -> dict:
+        return LangfuseMetadata(
+            batch_size=batch_size,
+            sdk_integration=self._sdk_integration,
+            sdk_name=self._sdk_name,
+            sdk_version=self._sdk_version,
+            public_key=self._public_key,
+        ).dict()
+
+    async def _upload_batch(self, batch: List[QueuedEvent]):
+        await async_upload_with_retries(
+            lambda pending: self._exporter.async_export(
+                [item.data for item in pending], self._metadata(len(pending))
+            ),
+            batch,
+            self._max_retries,
+            self._dead_letter,
+            self._log,
+        )
+
+    def _dead_letter(self, items: List[QueuedEvent], error: Exception):
+        if len(items) == 0:
+            return
+
+        try:
+            self._dead_letter_handler([item.decoded() for item in items], error)
+        except Exception as e:
+            self._log.exception("error in dead-letter handler: %s", e)
+
+    def _upload_leftovers(self):
+        """Upload events synchronously when no event loop is left to process them."""
+        with self._lock:
+            items = self._drain_queue() + list(self._pending)
+            self._pending.clear()
+
+        if not items:
+            return
+
+        self._log.debug("uploading %d leftover items synchronously", len(items))
+
+        batch, total_size = [], 0
+        for item in items:
+            if not enforce_size_limit(item, self._log):
+                continue
+
+            batch.append(item)
+            total_size += len(item.data)
+
+            if len(batch) >= self._flush_at or total_size >= BATCH_SIZE_LIMIT:
+                self._upload_batch_sync(batch)
+                batch, total_size = [], 0
+
+        if batch:
+            self._upload_batch_sync(batch)
+
+    def _upload_batch_sync(self, batch: List[QueuedEvent]):
+        upload_with_retries(
+            lambda pending: self._exporter.export(
+                [item.data for item in pending], self._metadata(len(pending))
+            ),
+            coalesce_events(batch) if self._coalesce_events else batch,
+            self._max_retries,
+            self._dead_letter,
+            self._log,
+        )
+
+    async def async_flush(self):
+        """Wait until all queued events have been uploaded without blocking the event loop."""
+        self._log.debug("flushing queue")
+        running_loop = asyncio.get_running_loop()
+
+        if not self._is_bound_loop_alive():
+            self._bind(running_loop)
+
+        if running_loop is not self._loop:
+            future = asyncio.run_coroutine_threadsafe(self._queue.join(), self._loop)
+            await asyncio.wrap_future(future)
+            return
+
+        await self._queue.join()
+        self._log.debug("successfully flushed queue")
+
+    def flush(self):
+        """Forces a flush from the internal queue to the server.
+
+        Blocks until the queue is empty. Must not be called from the event loop the manager
+        is bound to, as that would block the loop; use `async_flush` there instead.
+        """
+        if not self._is_bound_loop_alive():
+            self._upload_leftovers()
+            return
+
+        if _get_running_loop() is self._loop:
+            self._log.warning(
+                "flush() would block the event loop and is skipped, use `await langfuse.async_flush()` instead."
+            )
+            return
+
+        self._log.debug("flushing queue")
+        asyncio.run_coroutine_threadsafe(self._queue.join(), self._loop).result()
+
+    async def _stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+
+        await asyncio.gather(*self._uploads, return_exceptions=True)
+
+    def join(self):
+        """Stops the worker task. Leftover events of a closed event loop are uploaded synchronously."""
+        self._log.debug("joining async consumer")
+
+        if not self._is_bound_loop_alive():
+            self._upload_leftovers()
+        elif _get_running_loop() is self._loop:
+            if self._worker is not None:
+                self._worker.cancel()
+        else:
+            asyncio.run_coroutine_threadsafe(self._stop(), self._loop).result()
+
+        self._exporter.shutdown()
+        self._log.debug("async consumer joined")
+
+    async def async_shutdown(self):
+        """Flush all messages and stop the worker task without blocking the event loop."""
+        self._log.debug("shutdown initiated")
+
+        await self.async_flush()
+        await self._stop()
+
+        self._log.debug("shutdown completed")
+
+    def shutdown(self):
+        """Flush all messages and cleanly shutdown the client"""
+        self._log.debug("shutdown initiated")
+
+        self.flush()
+        self.join()
+
+        self._log.debug("shutdown completed")
@@ -1,3 +1,4 @@
+import asyncio
 import datetime as dt
 import logging
 import os
@@ -7,7 +8,7 @@ import httpx
 from enum import Enum
 import time
 import tracemalloc
-from typing import Any, Dict, Optional, Literal, Union, List, overload
+from typing import Any, Callable, Dict, Optional, Literal, Union, List, overload
 import urllib.parse
 
 
@@ -51,11 +52,14 @@ except ImportError:
     import pydantic  # type: ignore
 
 from langfuse.api.client import FernLangfuse
+from langfuse.async_task_manager import AsyncTaskManager
 from langfuse.environment import get_common_release_envs
+from langfuse.exporter import Exporter
 from langfuse.logging import clean_logger
 from langfuse.model import Dataset, MapValue, Observation, TraceWithFullDetails
-from langfuse.request import LangfuseClient
-from langfuse.task_manager import TaskManager
+from langfuse.request import Compression, LangfuseClient
+from langfuse.sampling import HeadSampler, UnsampledTrace
+from langfuse.task_manager import BackpressurePolicy, DeadLetterHandler, TaskManager
 from langfuse.types import SpanLevel
 from langfuse.utils import _convert_usage_input, _create_prompt_context, _get_timestamp
 
@@ -103,13 +107,31 @@ class Langfuse(object):
         release: Optional[str] = None,
         debug: bool = False,
         threads: Optional[int] = None,
+        max_threads: Optional[int] = None,
+        max_inflight_uploads: int = 1,
+        http2: bool = False,
+        max_requests_per_second: Optional[float] = None,
+        max_bytes_per_second: Optional[float] = None,
+        exporter: Optional[Exporter] = None,
         flush_at: Optional[int] = None,
         flush_interval: Optional[float] = None,
         max_retries: Optional[int] = None,
         timeout: Optional[int] = None,  # seconds
         sdk_integration: Optional[str] = "default",
         httpx_client: Optional[httpx.Client] = None,
+        async_httpx_client_factory: Optional[Callable[[], httpx.AsyncClient]] = None,
         enabled: Optional[bool] = True,
+        compression: Optional[Compression] = None,
+        ingestion_engine: Optional[Literal["threads", "asyncio"]] = None,
+        spill_directory: Optional[str] = None,
+        dead_letter_handler: Optional[DeadLetterHandler] = None,
+        coalesce_events: bool = True,
+        adaptive_batching: bool = False,
+        backpressure_policy: BackpressurePolicy = "drop_newest",
+        max_queue_bytes: Optional[int] = None,
+        deferred_serialization: bool = False,
+        sample_rate: Optional[float] = None,
+        sample_rate_overrides: Optional[Dict[str, float]] = None,
     ):
         """Initialize the Langfuse client.
 
@@ -120,13 +142,31 @@ class Langfuse(object):
             release: Release number/hash of the application to provide analytics grouped by release. Can be set via `LANGFUSE_RELEASE` environment variable.
             debug: Enables debug mode for more verbose logging. Can be set via `LANGFUSE_DEBUG` environment variable.
             threads: Number of consumer threads to execute network requests. Helps scaling the SDK for high load. Only increase this if you run into scaling issues.
+            max_threads: Maximum number of consumer threads. If larger than `threads`, consumer threads are added while events queue up and retired again when idle. Can be set via `LANGFUSE_MAX_THREADS` environment variable. Only supported by the threaded ingestion engine.
+            max_inflight_uploads: Number of batches each consumer thread uploads concurrently. Raises throughput over high-latency connections without adding threads. Events of the same observation are still uploaded in order. Only supported by the threaded ingestion engine.
+            http2: Use HTTP/2 for concurrent uploads (`max_inflight_uploads` and the asyncio ingestion engine), which multiplexes them on a single connection. Requires the `h2` package, `pip install "langfuse[http2]"`.
+            max_requests_per_second: Limits the rate of ingestion requests of all consumer threads. Only supported by the threaded ingestion engine.
+            max_bytes_per_second: Limits the bandwidth of ingestion requests of all consumer threads. Only supported by the threaded ingestion engine.
+            exporter: Destination of the ingestion events, see `langfuse.exporter`. Defaults to the Langfuse API. With another exporter, no API keys are required to record events.
             flush_at: Max batch size that's sent to the API.
             flush_interval: Max delay until a new batch is sent to the API.
             max_retries: Max number of retries in case of API/network errors.
             timeout: Timeout of API requests in seconds.
             httpx_client: Pass your own httpx client for more customizability of requests.
+            async_httpx_client_factory: Creates the `httpx.AsyncClient` of concurrent uploads (`max_inflight_uploads` and the asyncio ingestion engine), e.g. `lambda: httpx.AsyncClient(verify=False)`. Called once per event loop, as async clients cannot be shared between loops. Pass it along with `httpx_client` to apply the same settings to these uploads; `http2` does not apply to the clients it creates.
             sdk_integration: Used by intgerations that wrap the Langfuse SDK to add context for debugging and support. Not to be used directly.
             enabled: Enables or disables the Langfuse client. If disabled, all observability calls to the backend will be no-ops.
+            compression: Compresses ingestion requests with `"gzip"` or `"zstd"` (requires the `zstandard` package). Can be set via `LANGFUSE_COMPRESSION` environment variable. Disabled by default.
+            ingestion_engine: `"threads"` (default) uploads events from background consumer threads. `"asyncio"` uploads them from the running event loop with `httpx.AsyncClient`, which suits ASGI services; use `await langfuse.async_flush()` instead of `flush()` inside the loop. Can be set via `LANGFUSE_INGESTION_ENGINE` environment variable.
+            spill_directory: Directory for a disk-backed queue that keeps events when the in-memory queue is full or the API is unavailable. Spilled events are replayed in order, also by the next process started with the same directory. Each process needs its own directory, spilling is disabled if the directory is in use. Only supported by the threaded ingestion engine. Can be set via `LANGFUSE_SPILL_DIRECTORY` environment variable.
+            dead_letter_handler: Called with the events the API rejected with a non-retryable error (e.g. validation errors) and the error. By default, rejected events are logged and dropped.
+            coalesce_events: Merge create and update events of the same trace or observation that are uploaded in the same batch into a single event. Enabled by default.
+            adaptive_batching: Adapts the batch size to the event rate and upload latency, up to the maximum request size, and lets idle consumers sleep until the next event instead of waking up every `flush_interval`. Only supported by the threaded ingestion engine.
+            backpressure_policy: What to do with new events when the ingestion queue is full: `"drop_newest"` (default) drops them, `"drop_oldest"` drops the oldest queued events instead, `"block"` waits up to a second for room, `"shed"` drops events with increasing probability as the queue fills up, preferring large payloads and keeping scores and traces. Only supported by the threaded ingestion engine.
+            max_queue_bytes: Limits the total size of the queued events in bytes, in addition to the number of events. Only supported by the threaded ingestion engine.
+            deferred_serialization: Encode events on the consumer threads instead of the calling thread, which takes serialization off the request path. The event and the top-level dicts and lists of its input, output and metadata are copied when it is recorded; nested values are encoded as they are at upload time and must not be changed in the meantime. Only supported by the threaded ingestion engine.
+            sample_rate: Share of the traces that are recorded, between 0 and 1. Traces are sampled by a hash of their id, so all observations and scores of a trace are either recorded or skipped, also across processes. Events of traces that are not sampled are not built, encoded or uploaded. Can be set via `LANGFUSE_SAMPLE_RATE` environment variable. Defaults to 1.
+            sample_rate_overrides: Sample rates of traces by their name, e.g. `{"checkout": 1.0}`. Applies to observations and scores created in the same process as the trace.
 
         Raises:
             ValueError: If public_key or secret_key are not set and not found in environment variables.
@@ -150,6 +190,7 @@ class Langfuse(object):
         secret_key = secret_key or os.environ.get("LANGFUSE_SECRET_KEY")
 
         threads = threads or int(os.environ.get("LANGFUSE_THREADS", 1))
+        max_threads = max_threads or int(os.environ.get("LANGFUSE_MAX_THREADS", 0))
         flush_at = flush_at or int(os.environ.get("LANGFUSE_FLUSH_AT", 15))
         flush_interval = flush_interval or float(
             os.environ.get("LANGFUSE_FLUSH_INTERVAL", 0.5)
@@ -157,19 +198,26 @@ class Langfuse(object):
 
         max_retries = max_retries or int(os.environ.get("LANGFUSE_MAX_RETRIES", 3))
         timeout = timeout or int(os.environ.get("LANGFUSE_TIMEOUT", 20))
+        compression = compression or os.environ.get("LANGFUSE_COMPRESSION") or None
+        ingestion_engine = ingestion_engine or os.environ.get(
+            "LANGFUSE_INGESTION_ENGINE", "threads"
+        )
+        spill_directory = spill_directory or os.environ.get("LANGFUSE_SPILL_DIRECTORY")
+        if sample_rate is None and "LANGFUSE_SAMPLE_RATE" in os.environ:
+            sample_rate = float(os.environ["LANGFUSE_SAMPLE_RATE"])
 
         if not self.enabled:
             self.log.warning(
                 "Langfuse client is disabled. No observability data will be sent."
             )
 
-        elif not public_key:
+        elif not public_key and exporter is None:
             self.enabled = False
             self.log.warning(
                 "Langfuse client is disabled since no public_key was provided as a parameter or environment variable 'LANGFUSE_PUBLIC_KEY'. See our docs: https://langfuse.com/docs/sdk/python/low-level-sdk#initialize-client"
             )
 
-        elif not secret_key:
+        elif not secret_key and exporter is None:
             self.enabled = False
             self.log.warning(
                 "Langfuse client is disabled since no secret_key was provided as a parameter or environment variable 'LANGFUSE_SECRET_KEY'. See our docs: https://langfuse.com/docs/sdk/python/low-level-sdk#initialize-client"
@@ -197,6 +245,15 @@ class Langfuse(object):
 
         self.httpx_client = httpx_client or httpx.Client(timeout=timeout)
 
+        if (
+            httpx_client is not None
+            and async_httpx_client_factory is None
+            and (max_inflight_uploads > 1 or ingestion_engine == "asyncio")
+        ):
+            self.log.warning(
+                "Concurrent uploads use an httpx.AsyncClient with default settings, not the settings of httpx_client. Pass async_httpx_client_factory to configure it."
+            )
+
         self.client = FernLangfuse(
             base_url=self.base_url,
             username=public_key,
@@ -214,6 +271,9 @@ class Langfuse(object):
             version=version,
             timeout=timeout,
             session=self.httpx_client,
+            compression=compression,
+            http2=http2,
+            async_session_factory=async_httpx_client_factory,
         )
 
         args = {
@@ -227,12 +287,54 @@ class Langfuse(object):
             "sdk_version": version,
             "sdk_integration": sdk_integration,
             "enabled": self.enabled,
+            "dead_letter_handler": dead_letter_handler,
+            "coalesce_events": coalesce_events,
+            "exporter": exporter,
         }
 
-        self.task_manager = TaskManager(**args)
+        if ingestion_engine == "asyncio":
+            args.pop("threads")
+            unsupported = {
+                "spill_directory": spill_directory,
+                "backpressure_policy": backpressure_policy != "drop_newest",
+                "max_queue_bytes": max_queue_bytes,
+                "adaptive_batching": adaptive_batching,
+                "max_threads": max_threads,
+                "max_inflight_uploads": max_inflight_uploads > 1,
+                "max_requests_per_second": max_requests_per_second,
+                "max_bytes_per_second": max_bytes_per_second,
+                "deferred_serialization": deferred_serialization,
+            }
+            for option, value in unsupported.items():
+                if value:
+                    self.log.warning(
+                        f"{option} is not supported by the asyncio ingestion engine and is ignored."
+                    )
+            self.task_manager = AsyncTaskManager(**args)
+        else:
+            self.task_manager = TaskManager(
+                **args,
+                spill_directory=spill_directory,
+                backpressure_policy=backpressure_policy,
+                max_queue_bytes=max_queue_bytes,
+                adaptive_batching=adaptive_batching,
+                max_threads=max_threads,
+                max_inflight_uploads=max_inflight_uploads,
+                max_requests_per_second=max_requests_per_second,
+                max_bytes_per_second=max_bytes_per_second,
+                deferred_serialization=deferred_serialization,
+            )
 
         self.trace_id = None
 
+        self.sampler = (
+            HeadSampler(
+                1.0 if sample_rate is None else sample_rate, sample_rate_overrides
+            )
+            if sample_rate is not None or sample_rate_overrides
+            else None
+        )
+
         self.release = self._get_release_value(release)
 
         self.prompt_cache = PromptCache()
@@ -808,7 +910,11 @@ class Langfuse(object):
         """
         new_id = id or str(uuid.uuid4())
         self.trace_id = new_id
+        task_manager = self._trace_task_manager(new_id, name)
         try:
+            if isinstance(task_manager, UnsampledTrace):
+                return
+
             new_dict = {
                 "id": new_id,
                 "name": name,
@@ -846,7 +952,7 @@ class Langfuse(object):
             self._log_memory_usage()
 
             return StatefulTraceClient(
-                self.client, new_id, StateType.TRACE, new_id, self.task_manager
+                self.client, new_id, StateType.TRACE, new_id, task_manager
             )
 
     def _log_memory_usage(self):
@@ -944,7 +1050,11 @@ class Langfuse(object):
         """
         trace_id = trace_id or self.trace_id or str(uuid.uuid4())
         new_id = id or str(uuid.uuid4())
+        task_manager = self._trace_task_manager(trace_id)
         try:
+            if isinstance(task_manager, UnsampledTrace):
+                return
+
             new_dict = {
                 "id": new_id,
                 "trace_id": trace_id,
@@ -974,11 +1084,11 @@ class Langfuse(object):
                     observation_id,
                     StateType.OBSERVATION,
                     trace_id,
-                    self.task_manager,
+                    task_manager,
                 )
             else:
                 return StatefulClient(
-                    self.client, new_id, StateType.TRACE, new_id, self.task_manager
+                    self.client, new_id, StateType.TRACE, new_id, task_manager
                 )
 
     def span(
@@ -1041,7 +1151,13 @@ class Langfuse(object):
         new_span_id = id or str(uuid.uuid4())
         new_trace_id = trace_id or str(uuid.uuid4())
         self.trace_id = new_trace_id
+        task_manager = self._trace_task_manager(
+            new_trace_id, name if trace_id is None else None
+        )
         try:
+            if isinstance(task_manager, UnsampledTrace):
+                return
+
             span_body = {
                 "id": new_span_id,
                 "trace_id": new_trace_id,
@@ -1085,7 +1201,7 @@ class Langfuse(object):
                 new_span_id,
                 StateType.OBSERVATION,
                 new_trace_id,
-                self.task_manager,
+                task_manager,
             )
 
     def event(
@@ -1143,7 +1259,13 @@ class Langfuse(object):
         event_id = id or str(uuid.uuid4())
         new_trace_id = trace_id or str(uuid.uuid4())
         self.trace_id = new_trace_id
+        task_manager = self._trace_task_manager(
+            new_trace_id, name if trace_id is None else None
+        )
         try:
+            if isinstance(task_manager, UnsampledTrace):
+                return
+
             event_body = {
                 "id": event_id,
                 "trace_id": new_trace_id,
@@ -1182,7 +1304,7 @@ class Langfuse(object):
                 event_id,
                 StateType.OBSERVATION,
                 new_trace_id,
-                self.task_manager,
+                task_manager,
             )
 
     def generation(
@@ -1258,7 +1380,13 @@ class Langfuse(object):
         new_trace_id = trace_id or str(uuid.uuid4())
         new_generation_id = id or str(uuid.uuid4())
         self.trace_id = new_trace_id
+        task_manager = self._trace_task_manager(
+            new_trace_id, name if trace_id is None else None
+        )
         try:
+            if isinstance(task_manager, UnsampledTrace):
+                return
+
             generation_body = {
                 "id": new_generation_id,
                 "trace_id": new_trace_id,
@@ -1320,7 +1448,7 @@ class Langfuse(object):
                 new_generation_id,
                 StateType.OBSERVATION,
                 new_trace_id,
-                self.task_manager,
+                task_manager,
             )
 
     def _generate_trace(self, trace_id: str, name: str):
@@ -1341,6 +1469,15 @@ class Langfuse(object):
         self.log.debug(f"Creating trace {event}...")
         self.task_manager.add_task(event)
 
+    def _trace_task_manager(
+        self, trace_id: str, name: typing.Optional[str] = None
+    ) -> typing.Union[TaskManager, UnsampledTrace]:
+        """Return the task manager for the events of a trace, which discards them if the trace is not sampled."""
+        if self.sampler is None or self.sampler.is_sampled(trace_id, name):
+            return self.task_manager
+
+        return UnsampledTrace(self.task_manager)
+
     def join(self):
         """Blocks until all consumer Threads are terminated. The SKD calls this upon termination of the Python Interpreter.
 
@@ -1383,6 +1520,44 @@ class Langfuse(object):
         except Exception as e:
             self.log.exception(e)
 
+    async def async_flush(self):
+        """Flush the internal event queue to the Langfuse API without blocking the event loop.
+
+        Use this instead of flush() from async code when the client runs with `ingestion_engine="asyncio"`. With the default threaded engine, the blocking flush is run in a worker thread.
+
+        Example:
+            ```python
+            from langfuse import Langfuse
+
+            langfuse = Langfuse(ingestion_engine="asyncio")
+
+            # Some operations with Langfuse
+
+            await langfuse.async_flush()
+            ```
+        """
+        try:
+            if isinstance(self.task_manager, AsyncTaskManager):
+                return await self.task_manager.async_flush()
+
+            return await asyncio.get_running_loop().run_in_executor(
+                None, self.task_manager.flush
+            )
+        except Exception as e:
+            self.log.exception(e)
+
+    async def async_shutdown(self):
+        """Initiate a graceful shutdown of the Langfuse SDK from async code, see shutdown()."""
+        try:
+            if isinstance(self.task_manager, AsyncTaskManager):
+                return await self.task_manager.async_shutdown()
+
+            return await asyncio.get_running_loop().run_in_executor(
+                None, self.task_manager.shutdown
+            )
+        except Exception as e:
+            self.log.exception(e)
+
 
 class StateType(Enum):
     """Enum to distinguish observation and trace states.
@@ -1435,6 +1610,11 @@ class StatefulClient(object):
         self.state_type = state_type
         self.task_manager = task_manager
 
+    @property
+    def sampled(self) -> bool:
+        """Whether the trace of the client is sampled, see `Langfuse(sample_rate=...)`."""
+        return not isinstance(self.task_manager, UnsampledTrace)
+
     def _add_state_to_event(self, body: dict):
         if self.state_type == StateType.OBSERVATION:
             body["parent_observation_id"] = self.id
@@ -1515,6 +1695,9 @@ class StatefulClient(object):
         """
         generation_id = id or str(uuid.uuid4())
         try:
+            if not self.sampled:
+                return
+
             generation_body = {
                 "id": generation_id,
                 "name": name,
@@ -1609,6 +1792,9 @@ class StatefulClient(object):
         """
         span_id = id or str(uuid.uuid4())
         try:
+            if not self.sampled:
+                return
+
             span_body = {
                 "id": span_id,
                 "name": name,
@@ -1688,6 +1874,9 @@ class StatefulClient(object):
         """
         score_id = id or str(uuid.uuid4())
         try:
+            if not self.sampled:
+                return
+
             new_score = {
                 "id": score_id,
                 "trace_id": self.trace_id,
@@ -1773,6 +1962,9 @@ class StatefulClient(object):
         """
         event_id = id or str(uuid.uuid4())
         try:
+            if not self.sampled:
+                return
+
             event_body = {
                 "id": event_id,
                 "name": name,
@@ -1898,6 +2090,9 @@ class StatefulGenerationClient(StatefulClient):
             ```
         """
         try:
+            if not self.sampled:
+                return
+
             generation_body = {
                 "id": self.id,
                 "trace_id": self.trace_id,  # Included to avoid relying on the order of events sent to the API
@@ -2091,6 +2286,9 @@ class StatefulSpanClient(StatefulClient):
             ```
         """
         try:
+            if not self.sampled:
+                return
+
             span_body = {
                 "id": self.id,
                 "trace_id": self.trace_id,  # Included to avoid relying on the order of events sent to the API
@@ -2294,6 +2492,9 @@ class StatefulTraceClient(StatefulClient):
             ```
         """
         try:
+            if not self.sampled:
+                return
+
             trace_body = {
                 "id": self.id,
                 "name": name,
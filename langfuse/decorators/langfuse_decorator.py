@@ -1,16 +1,14 @@
 import asyncio
-from collections import defaultdict
 from contextvars import ContextVar
 from datetime import datetime
 from functools import wraps
 import httpx
 import inspect
-import json
 import logging
+import uuid
 from typing import (
     Any,
     Callable,
-    DefaultDict,
     List,
     Optional,
     Union,
@@ -33,45 +31,31 @@ from langfuse.client import (
     ModelUsage,
     MapValue,
 )
-from langfuse.serializer import EventSerializer
-from langfuse.types import ObservationParams, SpanLevel
+from langfuse.request import Compression
+from langfuse.sampling import TailSampler
+from langfuse.decorators.observation_state import (
+    ObservationRegistry,
+    StackFrame,
+)
+from langfuse.decorators.stream_accumulator import (
+    STREAM_CAPTURE_BYTES,
+    StreamAccumulator,
+)
+from langfuse.serializer import normalize
+from langfuse.task_manager import FIELD_SIZE_BUDGET
+from langfuse.types import SpanLevel
 from langfuse.utils import _get_timestamp
 from langfuse.utils.langfuse_singleton import LangfuseSingleton
 from langfuse.utils.error_logging import catch_and_log_errors
 
 from pydantic import BaseModel
 
-_observation_stack_context: ContextVar[
-    List[Union[StatefulTraceClient, StatefulSpanClient, StatefulGenerationClient]]
-] = ContextVar("observation_stack_context", default=[])
-_observation_params_context: ContextVar[DefaultDict[str, ObservationParams]] = (
-    ContextVar(
-        "observation_params_context",
-        default=defaultdict(
-            lambda: {
-                "name": None,
-                "user_id": None,
-                "session_id": None,
-                "version": None,
-                "release": None,
-                "metadata": None,
-                "tags": None,
-                "input": None,
-                "output": None,
-                "level": None,
-                "status_message": None,
-                "start_time": None,
-                "end_time": None,
-                "completion_start_time": None,
-                "model": None,
-                "model_parameters": None,
-                "usage": None,
-                "prompt": None,
-                "public": None,
-            },
-        ),
-    )
+# top of the stack of observations of the current context
+_observation_stack_context: ContextVar[Optional[StackFrame]] = ContextVar(
+    "observation_stack_context", default=None
 )
+# parameters of running observations, shared by all contexts like the observations
+_observation_states = ObservationRegistry()
 
 # For users with mypy type checking, we need to define a TypeVar for the decorated function
 # Otherwise, mypy will infer the return type of the decorated function as Any
@@ -81,6 +65,7 @@ F = TypeVar("F", bound=Callable[..., Any])
 
 class LangfuseDecorator:
     _log = logging.getLogger("langfuse")
+    _tail_sampler: Optional[TailSampler] = None
 
     def observe(
         self,
@@ -90,6 +75,7 @@ class LangfuseDecorator:
         capture_input: bool = True,
         capture_output: bool = True,
         transform_to_string: Optional[Callable[[Iterable], str]] = None,
+        max_stream_bytes: int = STREAM_CAPTURE_BYTES,
     ) -> Callable[[F], F]:
         """Wrap a function to create and manage Langfuse tracing around its execution, supporting both synchronous and asynchronous functions.
 
@@ -102,6 +88,7 @@ class LangfuseDecorator:
             capture_input (bool): If True, captures the args and kwargs of the function as input. Default is True.
             capture_output (bool): If True, captures the return value of the function as output. Default is True.
             transform_to_string (Optional[Callable[[Iterable], str]]): When the decorated function returns a generator, this function transforms yielded values into a string representation for output capture
+            max_stream_bytes (int): When the decorated function returns a generator, the approximate number of bytes of yielded values kept for output capture. The first and the most recent values are kept, values in between are replaced by a truncation marker. Default is 900 KB.
 
         Returns:
             Callable: A wrapped version of the original function that, upon execution, is automatically observed and managed by Langfuse.
@@ -137,6 +124,7 @@ class LangfuseDecorator:
                     capture_input=capture_input,
                     capture_output=capture_output,
                     transform_to_string=transform_to_string,
+                    max_stream_bytes=max_stream_bytes,
                 )
                 if asyncio.iscoroutinefunction(func)
                 else self._sync_observe(
@@ -146,6 +134,7 @@ class LangfuseDecorator:
                     capture_input=capture_input,
                     capture_output=capture_output,
                     transform_to_string=transform_to_string,
+                    max_stream_bytes=max_stream_bytes,
                 )
             )
 
@@ -160,14 +149,19 @@ class LangfuseDecorator:
         capture_input: bool,
         capture_output: bool,
         transform_to_string: Optional[Callable[[Iterable], str]] = None,
+        max_stream_bytes: int = STREAM_CAPTURE_BYTES,
     ) -> F:
+        # static facts of the function are computed once, not on every call
+        observation_name = name or func.__name__
+        is_method = self._is_method(func)
+
         @wraps(func)
         async def async_wrapper(*args, **kwargs):
             observation = self._prepare_call(
-                name=name or func.__name__,
+                name=observation_name,
                 as_type=as_type,
                 capture_input=capture_input,
-                is_method=self._is_method(func),
+                is_method=is_method,
                 func_args=args,
                 func_kwargs=kwargs,
             )
@@ -179,7 +173,11 @@ class LangfuseDecorator:
                 self._handle_exception(observation, e)
             finally:
                 result = self._finalize_call(
-                    observation, result, capture_output, transform_to_string
+                    observation,
+                    result,
+                    capture_output,
+                    transform_to_string,
+                    max_stream_bytes,
                 )
 
                 # Returning from finally block may swallow errors, so only return if result is not None
@@ -197,14 +195,19 @@ class LangfuseDecorator:
         capture_input: bool,
         capture_output: bool,
         transform_to_string: Optional[Callable[[Iterable], str]] = None,
+        max_stream_bytes: int = STREAM_CAPTURE_BYTES,
     ) -> F:
+        # static facts of the function are computed once, not on every call
+        observation_name = name or func.__name__
+        is_method = self._is_method(func)
+
         @wraps(func)
         def sync_wrapper(*args, **kwargs):
             observation = self._prepare_call(
-                name=name or func.__name__,
+                name=observation_name,
                 as_type=as_type,
                 capture_input=capture_input,
-                is_method=self._is_method(func),
+                is_method=is_method,
                 func_args=args,
                 func_kwargs=kwargs,
             )
@@ -216,7 +219,11 @@ class LangfuseDecorator:
                 self._handle_exception(observation, e)
             finally:
                 result = self._finalize_call(
-                    observation, result, capture_output, transform_to_string
+                    observation,
+                    result,
+                    capture_output,
+                    transform_to_string,
+                    max_stream_bytes,
                 )
 
                 # Returning from finally block may swallow errors, so only return if result is not None
@@ -236,10 +243,13 @@ class LangfuseDecorator:
         Returns:
         bool: True if 'cls' or 'self' is in the callable's parameters, False otherwise.
         """
-        return (
-            "self" in inspect.signature(func).parameters
-            or "cls" in inspect.signature(func).parameters
-        )
+        try:
+            parameters = inspect.signature(func).parameters
+        except (TypeError, ValueError):
+            # callables without an introspectable signature, e.g. some builtins
+            return False
+
+        return "self" in parameters or "cls" in parameters
 
     def _prepare_call(
         self,
@@ -255,21 +265,30 @@ class LangfuseDecorator:
     ]:
         try:
             langfuse = self._get_langfuse()
-            stack = _observation_stack_context.get().copy()
-            parent = stack[-1] if stack else None
+            top = _observation_stack_context.get()
+            parent = top.observation if top is not None else None
 
             # Collect default observation data
             observation_id = func_kwargs.pop("langfuse_observation_id", None)
             id = str(observation_id) if observation_id else None
             start_time = _get_timestamp()
 
+            if parent is None:
+                # the id is known before the trace is created to skip capturing the input of unsampled traces
+                id = id or str(uuid.uuid4())
+                sampled = langfuse.sampler is None or langfuse.sampler.is_sampled(
+                    id, name
+                )
+            else:
+                sampled = parent.sampled
+
             input = (
                 self._get_input_from_func_args(
                     is_method=is_method,
                     func_args=func_args,
                     func_kwargs=func_kwargs,
                 )
-                if capture_input
+                if capture_input and sampled
                 else None
             )
 
@@ -280,6 +299,10 @@ class LangfuseDecorator:
                 "input": input,
             }
 
+            if parent is None and self._tail_sampler is not None:
+                # held by trace id, also the events of other clients and integrations
+                langfuse.task_manager.trace_buffers.open(id, name)
+
             # Create observation
             if parent and as_type == "generation":
                 observation = parent.generation(**params)
@@ -295,7 +318,7 @@ class LangfuseDecorator:
             else:
                 observation = langfuse.trace(**params)
 
-            _observation_stack_context.set(stack + [observation])
+            _observation_stack_context.set(StackFrame(observation, top))
 
             return observation
         except Exception as e:
@@ -315,9 +338,19 @@ class LangfuseDecorator:
             "kwargs": func_kwargs,
         }
 
-        # Serialize and deserialize to ensure proper JSON serialization.
-        # Objects are later serialized again so deserialization is necessary here to avoid unnecessary escaping of quotes.
-        return json.loads(json.dumps(raw_input, cls=EventSerializer))
+        return self._normalize(raw_input)
+
+    @staticmethod
+    def _normalize(value: Any) -> Any:
+        """Convert captured input/output into JSON-native values in a single walk.
+
+        Values are truncated like when the event is encoded, so large prompts and
+        documents are not walked twice and no intermediate JSON string is built.
+        """
+        try:
+            return normalize(value, FIELD_SIZE_BUDGET)
+        except Exception:
+            return f"<not serializable object of type: {type(value).__name__}>"
 
     def _finalize_call(
         self,
@@ -331,14 +364,26 @@ class LangfuseDecorator:
         result: Any,
         capture_output: bool,
         transform_to_string: Optional[Callable[[Iterable], str]] = None,
+        max_stream_bytes: int = STREAM_CAPTURE_BYTES,
     ):
+        if observation is not None and not observation.sampled:
+            capture_output = False
+
         if inspect.isgenerator(result):
             return self._wrap_sync_generator_result(
-                observation, result, capture_output, transform_to_string
+                observation,
+                result,
+                capture_output,
+                transform_to_string,
+                max_stream_bytes,
             )
         elif inspect.isasyncgen(result):
             return self._wrap_async_generator_result(
-                observation, result, capture_output, transform_to_string
+                observation,
+                result,
+                capture_output,
+                transform_to_string,
+                max_stream_bytes,
             )
 
         else:
@@ -361,21 +406,14 @@ class LangfuseDecorator:
                 raise ValueError("No observation found in the current context")
 
             # Collect final observation data
-            observation_params = _observation_params_context.get()[
-                observation.id
-            ].copy()
-            del _observation_params_context.get()[
-                observation.id
-            ]  # Remove observation params to avoid leaking
+            observation_params = _observation_states.pop(observation.id).to_params()
 
             end_time = observation_params["end_time"] or _get_timestamp()
             raw_output = observation_params["output"] or (
                 result if result and capture_output else None
             )
 
-            # Serialize and deserialize to ensure proper JSON serialization.
-            # Objects are later serialized again so deserialization is necessary here to avoid unnecessary escaping of quotes.
-            output = json.loads(json.dumps(raw_output, cls=EventSerializer))
+            output = self._normalize(raw_output)
             observation_params.update(end_time=end_time, output=output)
 
             if isinstance(observation, (StatefulSpanClient, StatefulGenerationClient)):
@@ -384,8 +422,14 @@ class LangfuseDecorator:
                 observation.update(**observation_params)
 
             # Remove observation from top of stack
-            stack = _observation_stack_context.get()
-            _observation_stack_context.set(stack[:-1])
+            top = _observation_stack_context.get()
+            if top is not None:
+                _observation_stack_context.set(top.parent)
+
+                if top.parent is None and self._tail_sampler is not None:
+                    observation.task_manager.trace_buffers.finish(
+                        observation.trace_id, self._tail_sampler
+                    )
 
         except Exception as e:
             self._log.error(f"Failed to finalize observation: {e}")
@@ -401,8 +445,8 @@ class LangfuseDecorator:
         e: Exception,
     ):
         if observation:
-            _observation_params_context.get()[observation.id].update(
-                level="ERROR", status_message=str(e)
+            _observation_states.get(observation.id).update(
+                {"level": "ERROR", "status_message": str(e)}
             )
         raise e
 
@@ -418,23 +462,20 @@ class LangfuseDecorator:
         generator: Generator,
         capture_output: bool,
         transform_to_string: Optional[Callable[[Iterable], str]] = None,
+        max_stream_bytes: int = STREAM_CAPTURE_BYTES,
     ):
-        items = []
+        accumulator = StreamAccumulator(max_stream_bytes if capture_output else 0)
 
         try:
             for item in generator:
-                items.append(item)
+                accumulator.add(item)
+                if accumulator.count == 1:
+                    self._set_completion_start_time(observation)
 
                 yield item
 
         finally:
-            output = items
-
-            if transform_to_string is not None:
-                output = transform_to_string(items)
-
-            elif all(isinstance(item, str) for item in items):
-                output = "".join(items)
+            output = accumulator.output(transform_to_string)
 
             self._handle_call_result(observation, output, capture_output)
 
@@ -450,26 +491,39 @@ class LangfuseDecorator:
         generator: AsyncGenerator,
         capture_output: bool,
         transform_to_string: Optional[Callable[[Iterable], str]] = None,
+        max_stream_bytes: int = STREAM_CAPTURE_BYTES,
     ) -> AsyncGenerator:
-        items = []
+        accumulator = StreamAccumulator(max_stream_bytes if capture_output else 0)
 
         try:
             async for item in generator:
-                items.append(item)
+                accumulator.add(item)
+                if accumulator.count == 1:
+                    self._set_completion_start_time(observation)
 
                 yield item
 
         finally:
-            output = items
-
-            if transform_to_string is not None:
-                output = transform_to_string(items)
-
-            elif all(isinstance(item, str) for item in items):
-                output = "".join(items)
+            output = accumulator.output(transform_to_string)
 
             self._handle_call_result(observation, output, capture_output)
 
+    def _set_completion_start_time(
+        self,
+        observation: Optional[
+            Union[
+                StatefulSpanClient,
+                StatefulTraceClient,
+                StatefulGenerationClient,
+            ]
+        ],
+    ):
+        """Record the first yielded item of a generation as the start of its completion, unless set by the user."""
+        if isinstance(observation, StatefulGenerationClient):
+            state = _observation_states.get(observation.id)
+            if state.completion_start_time is None:
+                state.completion_start_time = _get_timestamp()
+
     def get_current_llama_index_handler(self):
         """Retrieve the current LlamaIndexCallbackHandler associated with the most recent observation in the observation stack.
 
@@ -494,7 +548,7 @@ class LangfuseDecorator:
 
             return None
 
-        observation = _observation_stack_context.get()[-1]
+        observation = self._get_current_observation()
 
         if observation is None:
             self._log.warn("No observation found in the current context")
@@ -528,7 +582,7 @@ class LangfuseDecorator:
             - This method should be called within the context of a trace (i.e., within a function wrapped by @observe) to ensure that an observation context exists.
             - If no observation is found in the current context (e.g., if called outside of a trace or if the observation stack is empty), the method logs a warning and returns None.
         """
-        observation = _observation_stack_context.get()[-1]
+        observation = self._get_current_observation()
 
         if observation is None:
             self._log.warn("No observation found in the current context")
@@ -559,16 +613,26 @@ class LangfuseDecorator:
             - This method should be called within the context of a trace (i.e., inside a function wrapped with the @observe decorator) to ensure that a current trace is indeed present and its ID can be retrieved.
             - If called outside of a trace context, or if the observation stack has somehow been corrupted or improperly managed, this method will log a warning and return None, indicating the absence of a traceable context.
         """
-        stack = _observation_stack_context.get()
+        top = _observation_stack_context.get()
         should_log_warning = self._get_caller_module_name() != "langfuse.openai"
 
-        if not stack:
+        if top is None:
             if should_log_warning:
                 self._log.warn("No trace found in the current context")
 
             return None
 
-        return stack[0].id
+        return top.root.observation.id
+
+    @staticmethod
+    def _get_current_observation() -> (
+        Optional[
+            Union[StatefulSpanClient, StatefulTraceClient, StatefulGenerationClient]
+        ]
+    ):
+        top = _observation_stack_context.get()
+
+        return top.observation if top is not None else None
 
     def _get_caller_module_name(self):
         try:
@@ -617,16 +681,16 @@ class LangfuseDecorator:
             - If called outside of a trace or observation context, or if the observation stack has somehow been corrupted or improperly managed, this method will log a warning and return None, indicating the absence of a traceable context.
             - If called at the top level of a trace, it will return the trace ID.
         """
-        stack = _observation_stack_context.get()
+        top = _observation_stack_context.get()
         should_log_warning = self._get_caller_module_name() != "langfuse.openai"
 
-        if not stack:
+        if top is None:
             if should_log_warning:
                 self._log.warn("No observation found in the current context")
 
             return None
 
-        return stack[-1].id
+        return top.observation.id
 
     def update_current_trace(
         self,
@@ -684,7 +748,7 @@ class LangfuseDecorator:
             if v is not None
         }
 
-        _observation_params_context.get()[trace_id].update(params_to_update)
+        _observation_states.get(trace_id).update(params_to_update)
 
     def update_current_observation(
         self,
@@ -754,8 +818,7 @@ class LangfuseDecorator:
             - It updates the parameters of the most recently created observation on the observation stack. Care should be taken in nested observation contexts to ensure the updates are applied as intended.
             - Parameters set to `None` will not overwrite existing values for those parameters. This behavior allows for selective updates without clearing previously set information.
         """
-        stack = _observation_stack_context.get()
-        observation = stack[-1] if stack else None
+        observation = self._get_current_observation()
 
         if not observation:
             self._log.warn("No observation found in the current context")
@@ -788,7 +851,7 @@ class LangfuseDecorator:
             if v is not None
         }
 
-        _observation_params_context.get()[observation.id].update(update_params)
+        _observation_states.get(observation.id).update(update_params)
 
     def score_current_observation(
         self,
@@ -918,7 +981,13 @@ class LangfuseDecorator:
         max_retries: Optional[int] = None,
         timeout: Optional[int] = None,
         httpx_client: Optional[httpx.Client] = None,
+        async_httpx_client_factory: Optional[Callable[[], httpx.AsyncClient]] = None,
         enabled: Optional[bool] = None,
+        compression: Optional[Compression] = None,
+        ingestion_engine: Optional[Literal["threads", "asyncio"]] = None,
+        sample_rate: Optional[float] = None,
+        sample_rate_overrides: Optional[Dict[str, float]] = None,
+        tail_sampler: Optional[TailSampler] = None,
     ):
         """Configure the Langfuse client.
 
@@ -936,8 +1005,16 @@ class LangfuseDecorator:
             max_retries: Max number of retries in case of API/network errors.
             timeout: Timeout of API requests in seconds. Default is 20 seconds.
             httpx_client: Pass your own httpx client for more customizability of requests.
+            async_httpx_client_factory: Creates the `httpx.AsyncClient` of the asyncio ingestion engine, e.g. `lambda: httpx.AsyncClient(verify=False)`. Pass it along with `httpx_client` to apply the same settings to its uploads.
             enabled: Enables or disables the Langfuse client. Defaults to True. If disabled, no observability data will be sent to Langfuse. If data is requested while disabled, an error will be raised.
+            compression: Compresses ingestion requests with `"gzip"` or `"zstd"`. Can be set via `LANGFUSE_COMPRESSION` environment variable. Disabled by default.
+            ingestion_engine: `"threads"` (default) or `"asyncio"` to upload events from the running event loop in ASGI services. Can be set via `LANGFUSE_INGESTION_ENGINE` environment variable.
+            sample_rate: Share of the traces that are recorded, between 0 and 1. Traces are sampled by a hash of their id, functions of unsampled traces are called without capturing their input and output. Can be set via `LANGFUSE_SAMPLE_RATE` environment variable. Defaults to 1.
+            sample_rate_overrides: Sample rates of traces by their name, e.g. `{"checkout": 1.0}`.
+            tail_sampler: Holds the events of each trace until its top-level function returns and uploads only the traces the sampler keeps, see `langfuse.sampling`. Disabled by default.
         """
+        self._tail_sampler = tail_sampler
+
         langfuse_singleton = LangfuseSingleton()
         langfuse_singleton.reset()
 
@@ -953,7 +1030,12 @@ class LangfuseDecorator:
             max_retries=max_retries,
             timeout=timeout,
             httpx_client=httpx_client,
+            async_httpx_client_factory=async_httpx_client_factory,
             enabled=enabled,
+            compression=compression,
+            ingestion_engine=ingestion_engine,
+            sample_rate=sample_rate,
+            sample_rate_overrides=sample_rate_overrides,
         )
 
     def _get_langfuse(self) -> Langfuse:
@@ -0,0 +1,101 @@
+"""@private"""
+
+import threading
+import time
+from typing import Any, Dict, Optional, Union
+
+from langfuse.client import (
+    StatefulGenerationClient,
+    StatefulSpanClient,
+    StatefulTraceClient,
+)
+from langfuse.types import ObservationParams
+
+# seconds after the last access when the state of an observation that was never
+# finalized, e.g. of a generator that is never consumed, is removed
+ORPHAN_TTL_SECONDS = 3600
+
+OBSERVATION_PARAMS = tuple(ObservationParams.__annotations__)
+
+Observation = Union[StatefulTraceClient, StatefulSpanClient, StatefulGenerationClient]
+
+
+class ObservationState(object):
+    """Parameters of an observation collected while its decorated function runs."""
+
+    __slots__ = OBSERVATION_PARAMS + ("accessed_at",)
+
+    def __init__(self):
+        for param in OBSERVATION_PARAMS:
+            setattr(self, param, None)
+        self.accessed_at = time.monotonic()
+
+    def update(self, params: Dict[str, Any]):
+        for param, value in params.items():
+            setattr(self, param, value)
+
+    def to_params(self) -> ObservationParams:
+        return {param: getattr(self, param) for param in OBSERVATION_PARAMS}  # type: ignore
+
+
+class ObservationRegistry(object):
+    """States of running observations by id.
+
+    States are created on first access and removed when the observation is finalized.
+    States not accessed for `ttl` seconds are evicted, so observations that are never
+    finalized do not leak memory.
+    """
+
+    def __init__(self, ttl: float = ORPHAN_TTL_SECONDS):
+        self.ttl = ttl
+        # ordered by last access, the stalest state comes first
+        self._states: Dict[str, ObservationState] = {}
+        self._lock = threading.Lock()
+
+    def get(self, id: str) -> ObservationState:
+        now = time.monotonic()
+
+        with self._lock:
+            state = self._states.pop(id, None)
+            if state is None:
+                state = ObservationState()
+                self._evict(now)
+
+            state.accessed_at = now
+            self._states[id] = state
+
+        return state
+
+    def pop(self, id: str) -> ObservationState:
+        with self._lock:
+            state = self._states.pop(id, None)
+
+        return state if state is not None else ObservationState()
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def _evict(self, now: float):
+        stale = []
+        for id, state in self._states.items():
+            if now - state.accessed_at < self.ttl:
+                break
+            stale.append(id)
+
+        for id in stale:
+            del self._states[id]
+
+
+class StackFrame(object):
+    """An observation on the stack of the current context, linked to the frame below.
+
+    Frames are immutable, pushing creates a frame on top of the current one and popping
+    returns to its parent, so the stack is never copied.
+    """
+
+    __slots__ = ("observation", "parent", "root")
+
+    def __init__(self, observation: Observation, parent: Optional["StackFrame"]):
+        self.observation = observation
+        self.parent = parent
+        self.root: StackFrame = parent.root if parent is not None else self
@@ -0,0 +1,123 @@
+"""@private"""
+
+from collections import deque
+from typing import Any, Callable, Deque, Iterable, List, Optional, Tuple
+
+from langfuse.serializer import _native_size
+from langfuse.task_manager import FIELD_SIZE_BUDGET
+
+# bytes of yielded items kept for the output of a generator, the output is truncated
+# to the field budget when the event is encoded anyway
+STREAM_CAPTURE_BYTES = FIELD_SIZE_BUDGET
+# assumed size of items that are not JSON-native, e.g. chunk objects of LLM SDKs
+UNSIZED_ITEM_BYTES = 1_000
+
+
+class StreamAccumulator:
+    """Collects the items yielded by a generator for output capture in bounded memory.
+
+    The first items are kept until half of `max_bytes` is used, then only the most
+    recent items that fit into the other half. Items in between are counted but
+    dropped, so memory stays proportional to `max_bytes` instead of the stream.
+    """
+
+    __slots__ = (
+        "max_bytes",
+        "count",
+        "_head",
+        "_head_bytes",
+        "_tail",
+        "_tail_bytes",
+        "_omitted",
+        "_omitted_chars",
+        "_all_str",
+    )
+
+    def __init__(self, max_bytes: int = STREAM_CAPTURE_BYTES):
+        self.max_bytes = max_bytes
+        self.count = 0
+        self._head: List[Any] = []
+        self._head_bytes = 0
+        self._tail: Deque[Tuple[Any, int]] = deque()
+        self._tail_bytes = 0
+        self._omitted = 0
+        self._omitted_chars = 0
+        self._all_str = True
+
+    @property
+    def truncated(self) -> bool:
+        return self._omitted > 0 or self._omitted_chars > 0
+
+    def add(self, item: Any):
+        self.count += 1
+        if self.max_bytes <= 0:
+            return
+
+        is_str = isinstance(item, str)
+        if not is_str:
+            self._all_str = False
+
+        half = self.max_bytes // 2
+        size = _item_size(item, half)
+
+        if not self._tail and self._head_bytes + size <= half:
+            self._head.append(item)
+            self._head_bytes += size
+            return
+
+        if is_str and size > half:
+            self._omitted_chars += size - half
+            item = item[-half:]
+            size = half
+
+        self._tail.append((item, size))
+        self._tail_bytes += size
+
+        while self._tail_bytes > half:
+            dropped, dropped_size = self._tail.popleft()
+            self._tail_bytes -= dropped_size
+            self._omitted += 1
+            if isinstance(dropped, str):
+                self._omitted_chars += len(dropped)
+
+    def items(self) -> List[Any]:
+        """Return the retained items, the first and the most recent ones."""
+        return self._head + [item for item, _ in self._tail]
+
+    def output(
+        self, transform_to_string: Optional[Callable[[Iterable], str]] = None
+    ) -> Any:
+        """Return the captured output of the stream.
+
+        Strings are joined, other items are returned as a list. If items were dropped,
+        a marker with the number of dropped characters or items is placed between the
+        first and the most recent ones. `transform_to_string` receives the retained
+        items only.
+        """
+        if transform_to_string is not None:
+            return transform_to_string(self.items())
+
+        tail = [item for item, _ in self._tail]
+
+        if self._all_str:
+            if not self.truncated:
+                return "".join(self._head) + "".join(tail)
+
+            return (
+                f"{''.join(self._head)}...[truncated, {self._omitted_chars} chars]..."
+                f"{''.join(tail)}"
+            )
+
+        if not self._omitted:
+            return self._head + tail
+
+        marker = f"...[truncated, {self._omitted} of {self.count} items]"
+        return self._head + [marker] + tail
+
+
+def _item_size(item: Any, limit: int) -> int:
+    if isinstance(item, str):
+        return len(item)
+
+    size = _native_size(item, limit)
+    return UNSIZED_ITEM_BYTES if size == float("inf") else int(size)
@@ -0,0 +1,184 @@
+"""Exporters are the destination of the batches of ingestion events that the Langfuse client uploads in the background.
+
+By default, events are sent to the Langfuse API. Pass another exporter to write them elsewhere:
+
+```python
+from langfuse import Langfuse
+from langfuse.exporter import FileExporter
+
+# write events to local disk, e.g. in an air-gapped batch job, and upload them later
+langfuse = Langfuse(exporter=FileExporter("/var/spool/langfuse", compression="zstd"))
+```
+
+The files can be uploaded later with `python -m langfuse.replay`.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import BinaryIO, List, Literal, Optional
+
+from langfuse.request import LangfuseClient
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class Exporter(ABC):
+    """Destination of ingestion batches.
+
+    A batch is a list of events, each encoded as a UTF-8 JSON document. Exporters are
+    shared by all consumer threads and must be thread-safe. Errors raised by `export` are
+    retried by the consumer like failed uploads.
+    """
+
+    @abstractmethod
+    def export(self, batch: List[bytes], metadata: dict) -> None:
+        """Export a batch of encoded events."""
+
+    async def async_export(self, batch: List[bytes], metadata: dict) -> None:
+        """Export a batch from an event loop. Runs `export` by default, override it for exporters that do I/O."""
+        self.export(batch, metadata)
+
+    def clone_for_event_loop(self) -> "Exporter":
+        """Return an exporter to use on another event loop, override it if the exporter holds loop-bound resources."""
+        return self
+
+    async def aclose(self) -> None:
+        """Release the loop-bound resources of an exporter returned by `clone_for_event_loop`."""
+
+    def shutdown(self) -> None:
+        """Release resources once all batches were exported."""
+
+
+class HTTPExporter(Exporter):
+    """Uploads batches to the Langfuse ingestion API, the default exporter."""
+
+    def __init__(self, client: LangfuseClient):
+        self._client = client
+
+    def export(self, batch: List[bytes], metadata: dict) -> None:
+        self._client.batch_post(batch=batch, metadata=metadata)
+
+    async def async_export(self, batch: List[bytes], metadata: dict) -> None:
+        await self._client.async_batch_post(batch=batch, metadata=metadata)
+
+    def clone_for_event_loop(self) -> "HTTPExporter":
+        return HTTPExporter(self._client.clone_for_event_loop())
+
+    async def aclose(self) -> None:
+        await self._client.close_async_session()
+
+
+class FileExporter(Exporter):
+    """Writes events to rotating newline-delimited JSON (NDJSON) files.
+
+    Each line is one ingestion event as it would be sent to the API. Files are written
+    as `<directory>/events-<timestamp>-<sequence>.ndjson` (with `.zst` appended for zstd
+    compression) and rotated once they hold `max_file_bytes` of uncompressed events. A
+    file carries a `.part` suffix while it is written, so complete files can be picked up
+    by other processes at any time.
+
+    Args:
+        directory: Directory for the files, created if it does not exist.
+        max_file_bytes: Uncompressed size after which a new file is started.
+        compression: `"zstd"` to compress the files, requires the `zstandard` package.
+    """
+
+    _log = logging.getLogger("langfuse")
+
+    def __init__(
+        self,
+        directory: str,
+        max_file_bytes: int = 64_000_000,
+        compression: Optional[Literal["zstd"]] = None,
+    ):
+        if compression not in (None, "zstd"):
+            raise ValueError(f"Unsupported compression '{compression}', use 'zstd'.")
+
+        if compression == "zstd" and zstandard is None:
+            raise ImportError(
+                "zstd compression requires the 'zstandard' package. pip install 'langfuse[zstd]'"
+            )
+
+        self._directory = directory
+        self._max_file_bytes = max_file_bytes
+        self._compression = compression
+        self._lock = threading.Lock()
+        self._file: Optional[BinaryIO] = None
+        self._writer: Optional[BinaryIO] = None
+        self._path: Optional[str] = None
+        self._file_bytes = 0
+        self._sequence = 0
+
+        os.makedirs(directory, exist_ok=True)
+
+    def export(self, batch: List[bytes], metadata: dict) -> None:
+        data = b"".join(event + b"\n" for event in batch)
+
+        with self._lock:
+            if self._writer is None or self._file_bytes >= self._max_file_bytes:
+                self._rotate()
+
+            self._writer.write(data)
+            self._writer.flush()
+            self._file_bytes += len(data)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            self._close()
+
+    def _rotate(self):
+        self._close()
+
+        suffix = ".ndjson.zst" if self._compression == "zstd" else ".ndjson"
+        name = f"events-{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{self._sequence:06d}{suffix}"
+        self._sequence += 1
+
+        self._path = os.path.join(self._directory, name)
+        self._file = open(self._path + ".part", "wb")
+        self._writer = (
+            zstandard.ZstdCompressor().stream_writer(self._file, closefd=False)
+            if self._compression == "zstd"
+            else self._file
+        )
+        self._file_bytes = 0
+
+    def _close(self):
+        if self._file is None:
+            return
+
+        if self._writer is not self._file:
+            # ends the zstd frame
+            self._writer.close()
+        self._file.close()
+        os.replace(self._path + ".part", self._path)
+        self._log.debug("exported events to %s", self._path)
+
+        self._file = self._writer = self._path = None
+
+
+class InMemoryExporter(Exporter):
+    """Keeps exported batches in memory, for tests and benchmarks without network."""
+
+    def __init__(self):
+        self.batches: List[List[bytes]] = []
+        self._lock = threading.Lock()
+
+    def export(self, batch: List[bytes], metadata: dict) -> None:
+        with self._lock:
+            self.batches.append(batch)
+
+    def events(self) -> List[dict]:
+        """Return all exported events, decoded."""
+        with self._lock:
+            return [json.loads(event) for batch in self.batches for event in batch]
+
+    def clear(self) -> None:
+        with self._lock:
+            self.batches.clear()
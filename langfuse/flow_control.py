@@ -0,0 +1,186 @@
+"""@private"""
+
+import logging
+import random
+import threading
+import time
+from typing import Generator, Optional
+
+# longest `Retry-After` that is honored, longer values fall back to exponential backoff
+MAX_RETRY_AFTER = 60.0
+
+
+def retry_after_expo(
+    base: float = 2, factor: float = 1, max_value: Optional[float] = None
+) -> Generator[Optional[float], Optional[Exception], None]:
+    """Wait generator for `backoff.on_exception` that honors `Retry-After`.
+
+    Waits for the `retry_after` of the raised error if it has one, e.g. an `APIError` of a
+    429 or 503 response, and for a fully jittered exponential delay otherwise. Use it with `jitter=None`, as jitter must not shorten the wait
+    requested by the server.
+    """
+    error = yield None
+    n = 0
+
+    while True:
+        delay = factor * base**n
+        if max_value is not None:
+            delay = min(delay, max_value)
+        delay = random.uniform(0, delay)
+        n += 1
+
+        retry_after = getattr(error, "retry_after", None)
+        if retry_after is not None and retry_after <= MAX_RETRY_AFTER:
+            delay = retry_after
+
+        error = yield delay
+
+
+class TokenBucket(object):
+    """Thread-safe token bucket refilled at `rate` tokens per second up to `capacity`.
+
+    `reserve` takes the tokens right away, also if that overdraws the bucket, and returns
+    how long the caller has to wait until it may proceed. Requests larger than the
+    capacity therefore pass, delayed in proportion to their size.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self._rate = rate
+        self._capacity = capacity if capacity is not None else rate
+        self._tokens = self._capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens: float = 1) -> float:
+        """Take `tokens` from the bucket and return the number of seconds to wait."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self._capacity, self._tokens + (now - self._updated_at) * self._rate
+            )
+            self._updated_at = now
+            self._tokens -= tokens
+
+            return max(0.0, -self._tokens / self._rate)
+
+
+class RateLimiter(object):
+    """Limits ingestion requests per second and bytes per second across consumers.
+
+    A `Retry-After` received from the API pauses all requests with `defer`, instead of
+    only retries of the batch that received it.
+    """
+
+    def __init__(
+        self,
+        max_requests_per_second: Optional[float] = None,
+        max_bytes_per_second: Optional[float] = None,
+    ):
+        self._requests = (
+            TokenBucket(max_requests_per_second) if max_requests_per_second else None
+        )
+        self._bytes = (
+            TokenBucket(max_bytes_per_second) if max_bytes_per_second else None
+        )
+        self._not_before = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self, size: int) -> float:
+        """Reserve a request of `size` bytes and return the number of seconds to wait."""
+        delay = self._not_before - time.monotonic()
+        if self._requests is not None:
+            delay = max(delay, self._requests.reserve())
+        if self._bytes is not None:
+            delay = max(delay, self._bytes.reserve(size))
+
+        return max(0.0, delay)
+
+    def defer(self, seconds: float):
+        """Hold back all requests for `seconds`, at most `MAX_RETRY_AFTER`."""
+        seconds = min(seconds, MAX_RETRY_AFTER)
+        with self._lock:
+            self._not_before = max(self._not_before, time.monotonic() + seconds)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of sending a request while the circuit breaker is open."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"circuit breaker is open, retrying in {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker(object):
+    """Stops sending requests to the API after `failure_threshold` consecutive failures.
+
+    Once open, requests fail fast with `CircuitOpenError` for `reset_timeout` seconds.
+    Afterwards, a single trial request is let through (half-open): if it succeeds the
+    circuit closes, otherwise it opens again for twice as long, up to `max_reset_timeout`.
+    """
+
+    _log = logging.getLogger("langfuse")
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        max_reset_timeout: float = 300.0,
+    ):
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._max_reset_timeout = max_reset_timeout
+        self._timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_in_progress = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self.remaining_open_time() > 0
+
+    def remaining_open_time(self) -> float:
+        """Return the number of seconds until the next trial request is allowed."""
+        with self._lock:
+            if self._opened_at is None:
+                return 0.0
+
+            return max(0.0, self._opened_at + self._timeout - time.monotonic())
+
+    def before_request(self):
+        """Raise `CircuitOpenError` if no request may be sent right now."""
+        with self._lock:
+            if self._opened_at is None:
+                return
+
+            remaining = self._opened_at + self._timeout - time.monotonic()
+            if remaining > 0 or self._trial_in_progress:
+                raise CircuitOpenError(max(remaining, 0.0))
+
+            self._trial_in_progress = True
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                self._log.info("ingestion API recovered, closing circuit breaker")
+
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_progress = False
+            self._timeout = self._reset_timeout
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+
+            if self._trial_in_progress:
+                self._trial_in_progress = False
+                self._timeout = min(self._timeout * 2, self._max_reset_timeout)
+                self._opened_at = time.monotonic()
+            elif self._opened_at is None and self._failures >= self._failure_threshold:
+                self._log.warning(
+                    "%d consecutive ingestion requests failed, pausing uploads for %.0fs",
+                    self._failures,
+                    self._timeout,
+                )
+                self._opened_at = time.monotonic()
@@ -0,0 +1,366 @@
+"""Upload ingestion events from NDJSON files, e.g. files written by `langfuse.exporter.FileExporter`.
+
+```
+python -m langfuse.replay --concurrency 8 /var/spool/langfuse
+```
+
+Each line of a file is an ingestion event, lines that are not JSON objects are logged and skipped.
+Events are re-batched under the request size limit and uploaded over a pool of concurrent
+connections. Progress is stored in a checkpoint file, so an interrupted replay resumes where it
+stopped. Events of batches that were in flight when the replay was interrupted are sent again. Credentials are read from the `LANGFUSE_PUBLIC_KEY`,
+`LANGFUSE_SECRET_KEY` and `LANGFUSE_HOST` environment variables unless passed as arguments.
+"""
+
+import argparse
+import io
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Set
+
+import httpx
+
+from langfuse.request import LangfuseClient
+from langfuse.task_manager import (
+    BATCH_SIZE_LIMIT,
+    QueuedEvent,
+    enforce_size_limit,
+    upload_with_retries,
+)
+from langfuse.version import __version__ as version
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+log = logging.getLogger("langfuse")
+
+NDJSON_SUFFIXES = (".ndjson", ".ndjson.zst", ".jsonl")
+
+
+@dataclass
+class Batch:
+    """Events of the lines `start` up to `end` (exclusive) of `path`."""
+
+    path: str
+    start: int
+    end: int
+    events: List[QueuedEvent]
+
+
+@dataclass
+class ReplayStats:
+    events: int = 0
+    batches: int = 0
+    bytes: int = 0
+    rejected: int = 0
+    failed_batches: int = 0
+    started_at: float = field(default_factory=time.monotonic)
+
+
+class Checkpoint(object):
+    """Number of lines of each file that have been uploaded, persisted in a JSON file.
+
+    Batches complete out of order, so the checkpoint of a file only advances across a
+    contiguous range of completed batches.
+    """
+
+    def __init__(self, path: Optional[str]):
+        self._path = path
+        self._lock = threading.Lock()
+        self._lines: Dict[str, int] = {}
+        # completed batches beyond the checkpoint of a file, start line mapped to end line
+        self._completed: Dict[str, Dict[int, int]] = {}
+
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                self._lines = json.load(f)
+
+    def lines_done(self, file: str) -> int:
+        with self._lock:
+            return self._lines.get(file, 0)
+
+    def complete(self, file: str, start: int, end: int):
+        with self._lock:
+            completed = self._completed.setdefault(file, {})
+            completed[start] = end
+
+            done = self._lines.get(file, 0)
+            while done in completed:
+                done = completed.pop(done)
+            self._lines[file] = done
+
+    def save(self):
+        if self._path is None:
+            return
+
+        with self._lock:
+            data = json.dumps(self._lines, indent=2)
+
+        with open(self._path + ".tmp", "w") as f:
+            f.write(data)
+        os.replace(self._path + ".tmp", self._path)
+
+
+def find_files(paths: List[str]) -> List[str]:
+    """Return the NDJSON files in `paths`, expanding directories, in sorted order."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(
+                os.path.join(path, name)
+                for name in sorted(os.listdir(path))
+                if name.endswith(NDJSON_SUFFIXES)
+            )
+        else:
+            files.append(path)
+
+    return [os.path.abspath(file) for file in files]
+
+
+def read_lines(path: str) -> Iterator[bytes]:
+    """Stream the lines of a plain or zstd-compressed file."""
+    with open(path, "rb") as f:
+        if path.endswith(".zst"):
+            if zstandard is None:
+                raise ImportError(
+                    f"Reading {path} requires the 'zstandard' package. pip install 'langfuse[zstd]'"
+                )
+            reader = io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(f))
+            yield from reader
+        else:
+            yield from f
+
+
+def read_batches(
+    path: str, start_line: int, max_items: int, max_bytes: int
+) -> Iterator[Batch]:
+    """Group the events of `path` after `start_line` into batches, skipping invalid lines."""
+    batch = Batch(path, start_line, start_line, [])
+    total_size = 0
+
+    for line_number, line in enumerate(read_lines(path)):
+        if line_number < start_line:
+            continue
+
+        line = line.strip()
+        item = QueuedEvent(data=line) if _is_event(path, line_number, line) else None
+        if item is not None and enforce_size_limit(item, log):
+            if batch.events and total_size + len(item.data) > max_bytes:
+                yield batch
+                batch = Batch(path, batch.end, batch.end, [])
+                total_size = 0
+
+            batch.events.append(item)
+            total_size += len(item.data)
+
+        batch.end = line_number + 1
+
+        if len(batch.events) >= max_items:
+            yield batch
+            batch = Batch(path, batch.end, batch.end, [])
+            total_size = 0
+
+    if batch.end > batch.start:
+        yield batch
+
+
+def _is_event(path: str, line_number: int, line: bytes) -> bool:
+    """Check that a line holds a JSON object, the lines are sent to the API as they are."""
+    if not line:
+        return False
+
+    try:
+        event = json.loads(line)
+    except ValueError as e:
+        log.warning("skipping invalid line %d of %s: %s", line_number + 1, path, e)
+        return False
+
+    if not isinstance(event, dict):
+        log.warning(
+            "skipping line %d of %s, it is not a JSON object", line_number + 1, path
+        )
+        return False
+
+    return True
+
+
+class Replayer(object):
+    """Uploads batches of `read_batches` with up to `concurrency` concurrent requests."""
+
+    def __init__(
+        self,
+        client: LangfuseClient,
+        checkpoint: Checkpoint,
+        concurrency: int = 4,
+        batch_size: int = 200,
+        max_retries: int = 5,
+        checkpoint_interval: float = 5.0,
+    ):
+        self._client = client
+        self._checkpoint = checkpoint
+        self._concurrency = concurrency
+        self._batch_size = batch_size
+        self._max_retries = max_retries
+        self._checkpoint_interval = checkpoint_interval
+        self._lock = threading.Lock()
+        self.stats = ReplayStats()
+
+    def run(self, files: List[str]) -> bool:
+        """Replay all files, return False if a batch could not be uploaded."""
+        inflight: Set[Future] = set()
+        last_checkpoint = time.monotonic()
+        ok = True
+
+        with ThreadPoolExecutor(self._concurrency) as executor:
+            try:
+                for batch in self._batches(files):
+                    # bounds the number of batches read ahead of the uploads
+                    while len(inflight) >= 2 * self._concurrency:
+                        done, inflight = wait(inflight, return_when=FIRST_COMPLETED)
+                        ok = all(future.result() for future in done) and ok
+
+                    if not ok:
+                        break
+
+                    inflight.add(executor.submit(self._upload, batch))
+
+                    if time.monotonic() - last_checkpoint >= self._checkpoint_interval:
+                        self._checkpoint.save()
+                        last_checkpoint = time.monotonic()
+
+                done, _ = wait(inflight)
+                ok = all(future.result() for future in done) and ok
+            finally:
+                self._checkpoint.save()
+
+        return ok
+
+    def _batches(self, files: List[str]) -> Iterator[Batch]:
+        for file in files:
+            start_line = self._checkpoint.lines_done(file)
+            if start_line > 0:
+                log.info("resuming %s from line %d", file, start_line)
+
+            yield from read_batches(
+                file, start_line, self._batch_size, BATCH_SIZE_LIMIT
+            )
+
+    def _upload(self, batch: Batch) -> bool:
+        rejected: List[QueuedEvent] = []
+
+        undelivered = upload_with_retries(
+            lambda pending: self._client.batch_post(
+                batch=[item.data for item in pending],
+                metadata={"batch_size": len(pending), "sdk_name": "python-replay"},
+            ),
+            batch.events,
+            self._max_retries,
+            lambda items, _: rejected.extend(items),
+            log,
+        )
+
+        if undelivered:
+            log.error(
+                "failed to upload lines %d-%d of %s", batch.start, batch.end, batch.path
+            )
+            with self._lock:
+                self.stats.failed_batches += 1
+            return False
+
+        if rejected:
+            log.warning(
+                "%d events of %s were rejected by the API", len(rejected), batch.path
+            )
+
+        self._checkpoint.complete(batch.path, batch.start, batch.end)
+        with self._lock:
+            self.stats.batches += 1
+            self.stats.events += len(batch.events) - len(rejected)
+            self.stats.rejected += len(rejected)
+            self.stats.bytes += sum(len(item.data) for item in batch.events)
+
+        return True
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m langfuse.replay",
+        description="Upload ingestion events from NDJSON files to Langfuse.",
+    )
+    parser.add_argument("paths", nargs="+", help="NDJSON files or directories")
+    parser.add_argument("--host", default=os.environ.get("LANGFUSE_HOST"))
+    parser.add_argument("--public-key", default=os.environ.get("LANGFUSE_PUBLIC_KEY"))
+    parser.add_argument("--secret-key", default=os.environ.get("LANGFUSE_SECRET_KEY"))
+    parser.add_argument(
+        "--concurrency", type=int, default=4, help="concurrent requests (default: 4)"
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=200, help="events per request (default: 200)"
+    )
+    parser.add_argument("--max-retries", type=int, default=5)
+    parser.add_argument("--timeout", type=int, default=20)
+    parser.add_argument("--compression", choices=["gzip", "zstd"])
+    parser.add_argument(
+        "--checkpoint",
+        help="checkpoint file to resume from (default: langfuse-replay.checkpoint in the working directory)",
+        default="langfuse-replay.checkpoint",
+    )
+    parser.add_argument("--debug", action="store_true")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig()
+    log.setLevel(logging.DEBUG if args.debug else logging.INFO)
+
+    if not args.public_key or not args.secret_key:
+        parser.error(
+            "public and secret key are required, pass them as arguments or set LANGFUSE_PUBLIC_KEY and LANGFUSE_SECRET_KEY"
+        )
+
+    client = LangfuseClient(
+        public_key=args.public_key,
+        secret_key=args.secret_key,
+        base_url=args.host or "https://cloud.langfuse.com",
+        version=version,
+        timeout=args.timeout,
+        session=httpx.Client(
+            timeout=args.timeout,
+            limits=httpx.Limits(max_connections=args.concurrency),
+        ),
+        compression=args.compression,
+    )
+
+    replayer = Replayer(
+        client,
+        Checkpoint(args.checkpoint),
+        concurrency=args.concurrency,
+        batch_size=args.batch_size,
+        max_retries=args.max_retries,
+    )
+    ok = replayer.run(find_files(args.paths))
+
+    stats = replayer.stats
+    elapsed = time.monotonic() - stats.started_at
+    print(
+        f"uploaded {stats.events} events in {stats.batches} batches "
+        f"({stats.bytes / 1e6:.1f} MB, {stats.events / max(elapsed, 1e-9):.0f} events/s), "
+        f"{stats.rejected} rejected"
+    )
+    if not ok:
+        print(
+            f"{stats.failed_batches} batches failed, run again to resume from {args.checkpoint}",
+            file=sys.stderr,
+        )
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
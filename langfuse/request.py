@@ -1,14 +1,34 @@
 """@private"""
 
+import copy
+import gzip
 import json
 import logging
 from base64 import b64encode
-from typing import Any, List, Union
+from typing import Any, Callable, List, Literal, Optional, Tuple, Union
 
 import httpx
 
+from langfuse.api.core.http_client import _parse_retry_after
 from langfuse.serializer import EventSerializer
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+Compression = Literal["gzip", "zstd"]
+
+# bodies below this size are sent uncompressed, the savings do not outweigh the CPU cost
+MIN_COMPRESSION_SIZE = 1_024
+
+# (max body size, gzip level, zstd level), larger bodies use cheaper levels
+COMPRESSION_LEVELS = [
+    (64_000, 6, 6),
+    (512_000, 4, 3),
+    (float("inf"), 1, 1),
+]
+
 
 class LangfuseClient:
     _public_key: str
@@ -17,6 +37,8 @@ class LangfuseClient:
     _version: str
     _timeout: int
     _session: httpx.Client
+    _async_session: Optional[httpx.AsyncClient]
+    _compression: Optional[Compression]
 
     def __init__(
         self,
@@ -26,6 +48,10 @@ class LangfuseClient:
         version: str,
         timeout: int,
         session: httpx.Client,
+        compression: Optional[Compression] = None,
+        async_session: Optional[httpx.AsyncClient] = None,
+        http2: bool = False,
+        async_session_factory: Optional[Callable[[], httpx.AsyncClient]] = None,
     ):
         self._public_key = public_key
         self._secret_key = secret_key
@@ -33,6 +59,22 @@ class LangfuseClient:
         self._version = version
         self._timeout = timeout
         self._session = session
+        self._async_session = async_session
+        self._http2 = http2
+        self._async_session_factory = async_session_factory
+
+        if compression not in (None, "gzip", "zstd"):
+            raise ValueError(
+                f"Unsupported compression '{compression}', use 'gzip' or 'zstd'."
+            )
+
+        if compression == "zstd" and zstandard is None:
+            logging.getLogger("langfuse").warning(
+                "zstd compression requires the 'zstandard' package, falling back to gzip. pip install 'langfuse[zstd]'"
+            )
+            compression = "gzip"
+
+        self._compression = compression
 
     def generate_headers(self):
         return {
@@ -60,10 +102,7 @@ class LangfuseClient:
     def post(self, **kwargs) -> httpx.Response:
         """Post the `kwargs` to the API"""
         log = logging.getLogger("langfuse")
-        url = self._remove_trailing_slash(self._base_url) + "/api/public/ingestion"
-        data = json.dumps(kwargs, cls=EventSerializer)
-        log.debug("making request: %s to %s", data, url)
-        headers = self.generate_headers()
+        url, data, headers = self._build_request(kwargs)
         res = self._session.post(
             url, content=data, headers=headers, timeout=self._timeout
         )
@@ -73,6 +112,122 @@ class LangfuseClient:
 
         return res
 
+    async def async_batch_post(self, **kwargs) -> httpx.Response:
+        """Post the `kwargs` to the batch API endpoint for events using the async session"""
+        log = logging.getLogger("langfuse")
+        log.debug("uploading data: %s", kwargs)
+
+        res = await self.async_post(**kwargs)
+        return self._process_response(
+            res, success_message="data uploaded successfully", return_json=False
+        )
+
+    async def async_post(self, **kwargs) -> httpx.Response:
+        """Post the `kwargs` to the API using the async session"""
+        log = logging.getLogger("langfuse")
+        url, data, headers = self._build_request(kwargs)
+
+        if self._async_session is None:
+            self._async_session = self._create_async_session()
+
+        res = await self._async_session.post(
+            url, content=data, headers=headers, timeout=self._timeout
+        )
+
+        if res.status_code == 200:
+            log.debug("data uploaded successfully")
+
+        return res
+
+    def reset_async_session(self):
+        """Drop the async session, e.g. because its event loop was closed. A new one is created on the next request."""
+        self._async_session = None
+
+    def clone_for_event_loop(self) -> "LangfuseClient":
+        """Return a copy of the client with its own async session for use on another event loop."""
+        client = copy.copy(self)
+        client._async_session = None
+        return client
+
+    async def close_async_session(self):
+        if self._async_session is not None:
+            await self._async_session.aclose()
+            self._async_session = None
+
+    def _create_async_session(self) -> httpx.AsyncClient:
+        # async clients are bound to the event loop they are used on, one is created per loop
+        if self._async_session_factory is not None:
+            return self._async_session_factory()
+
+        if self._http2:
+            try:
+                # concurrent requests are multiplexed on a single connection
+                return httpx.AsyncClient(timeout=self._timeout, http2=True)
+            except ImportError:
+                logging.getLogger("langfuse").warning(
+                    "HTTP/2 requires the 'h2' package, falling back to HTTP/1.1. pip install 'langfuse[http2]'"
+                )
+                self._http2 = False
+
+        return httpx.AsyncClient(timeout=self._timeout)
+
+    def _build_request(self, payload: dict) -> Tuple[str, bytes, dict]:
+        log = logging.getLogger("langfuse")
+        url = self._remove_trailing_slash(self._base_url) + "/api/public/ingestion"
+        data = self._encode_body(payload)
+        log.debug("making request: %s to %s", data, url)
+        headers = self.generate_headers()
+
+        data, content_encoding = self._compress(data)
+        if content_encoding is not None:
+            headers["Content-Encoding"] = content_encoding
+
+        return url, data, headers
+
+    def _encode_body(self, payload: dict) -> bytes:
+        """Encodes the request body, splicing in batch items that are already encoded.
+
+        Events are serialized once when they are enqueued (see `TaskManager.add_task`),
+        so the body is assembled by joining those fragments instead of encoding them again.
+        """
+        batch = payload.get("batch")
+        if not batch or not all(isinstance(item, bytes) for item in batch):
+            return json.dumps(payload, cls=EventSerializer).encode("utf-8")
+
+        rest = json.dumps(
+            {k: v for k, v in payload.items() if k != "batch"}, cls=EventSerializer
+        ).encode("utf-8")
+        body = b'{"batch": [' + b", ".join(batch) + b"]"
+
+        if rest == b"{}":
+            return body + b"}"
+
+        return body + b", " + rest[1:]
+
+    def _compress(self, data: bytes) -> Tuple[bytes, Optional[str]]:
+        """Compresses the request body if compression is enabled.
+
+        The compression level is chosen from the body size: small batches use a higher
+        level, large batches a cheaper one to keep the consumer thread from stalling.
+
+        Returns:
+            The (possibly compressed) body and the value for the `Content-Encoding` header.
+        """
+        if self._compression is None or len(data) < MIN_COMPRESSION_SIZE:
+            return data, None
+
+        gzip_level, zstd_level = next(
+            (gzip_level, zstd_level)
+            for max_size, gzip_level, zstd_level in COMPRESSION_LEVELS
+            if len(data) <= max_size
+        )
+
+        if self._compression == "zstd":
+            compressor = zstandard.ZstdCompressor(level=zstd_level)
+            return compressor.compress(data), "zstd"
+
+        return gzip.compress(data, compresslevel=gzip_level), "gzip"
+
     def _remove_trailing_slash(self, url: str) -> str:
         """Removes the trailing slash from a URL"""
         if url.endswith("/"):
@@ -105,6 +260,7 @@ class LangfuseClient:
                                 error.get("status"),
                                 error.get("message", "No message provided"),
                                 error.get("error", "No error details provided"),
+                                event_id=error.get("id"),
                             )
                             for error in errors
                         ]
@@ -114,19 +270,32 @@ class LangfuseClient:
             except json.JSONDecodeError:
                 log.error("Response is not valid JSON.")
                 raise APIError(res.status_code, "Invalid JSON response received")
+        retry_after = _parse_retry_after(res.headers)
         try:
             payload = res.json()
             log.error("received error response: %s", payload)
-            raise APIError(res.status_code, payload)
+            raise APIError(res.status_code, payload, retry_after=retry_after)
         except (KeyError, ValueError):
-            raise APIError(res.status_code, res.text)
+            raise APIError(res.status_code, res.text, retry_after=retry_after)
 
 
 class APIError(Exception):
-    def __init__(self, status: Union[int, str], message: str, details: Any = None):
+    def __init__(
+        self,
+        status: Union[int, str],
+        message: str,
+        details: Any = None,
+        *,
+        event_id: Optional[str] = None,
+        retry_after: Optional[float] = None,
+    ):
         self.message = message
         self.status = status
         self.details = details
+        # id of the ingestion event that failed, set for errors of a 207 response
+        self.event_id = event_id
+        # seconds to wait before retrying, from the `Retry-After` header of the response
+        self.retry_after = retry_after
 
     def __str__(self):
         msg = "{0} ({1}): {2}"
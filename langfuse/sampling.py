@@ -0,0 +1,350 @@
+"""Sampling of traces to reduce the overhead of tracing high-traffic applications.
+
+*Head sampling* decides when a trace is created whether it is recorded, by a hash of its
+id. All observations and scores of a trace follow the decision of the trace, also when
+they are created by integrations or in other processes that share the trace id:
+
+```python
+from langfuse import Langfuse
+
+# record 10% of the traces, and all traces named "checkout"
+langfuse = Langfuse(sample_rate=0.1, sample_rate_overrides={"checkout": 1.0})
+```
+
+Events of traces that are not sampled are not built, encoded or uploaded.
+
+*Tail sampling* applies to traces created with the `@observe()` decorator. With a tail
+sampler, the events of a trace are held in memory until its top-level function returns.
+The sampler then decides whether the trace is uploaded, e.g. to trace every request of a
+high-traffic endpoint but only pay for the traces that matter:
+
+```python
+from langfuse.decorators import langfuse_context
+from langfuse.sampling import TailSampler
+
+# keep failed and slow (p95) traces and 5% of the rest
+langfuse_context.configure(
+    tail_sampler=TailSampler(0.05, keep_errors=True, latency_percentile=95)
+)
+```
+
+Events of dropped traces are never encoded or uploaded. Subclass `TailSampler` and
+override `should_keep` to sample by other properties of a `TraceBuffer`.
+"""
+
+import bisect
+import logging
+import random
+import threading
+import time
+import zlib
+from collections import OrderedDict, deque
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+# events held per trace; beyond that, the trace is kept and its events are uploaded directly
+MAX_BUFFERED_EVENTS = 10_000
+# number of traces finished before slow traces are detected by their latency
+MIN_LATENCY_SAMPLES = 20
+# decisions remembered for traces sampled at the rate of their name, to apply them to
+# observations and scores that only know the trace id
+MAX_REMEMBERED_DECISIONS = 10_000
+
+
+class HeadSampler(object):
+    """Decides by the trace id whether a trace is recorded.
+
+    The trace id is hashed to a number between 0 and 1, the trace is sampled if it is
+    below the rate. The same trace id is therefore always sampled the same way.
+
+    Args:
+        rate (float): Share of the traces that are recorded, between 0 and 1.
+        overrides (Optional[Dict[str, float]]): Rates of traces by their name.
+    """
+
+    def __init__(self, rate: float, overrides: Optional[Dict[str, float]] = None):
+        for value in [rate, *(overrides or {}).values()]:
+            if not 0 <= value <= 1:
+                raise ValueError("sample rates must be between 0 and 1")
+
+        self.rate = rate
+        self.overrides = overrides or {}
+        self._decisions: "OrderedDict[str, bool]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def is_sampled(self, trace_id: str, name: Optional[str] = None) -> bool:
+        """Return whether the trace is recorded, `name` is given when the trace is created or updated."""
+        if name is not None and name in self.overrides:
+            sampled = _hash(trace_id) < self.overrides[name]
+
+            with self._lock:
+                self._decisions[trace_id] = sampled
+                self._decisions.move_to_end(trace_id)
+                if len(self._decisions) > MAX_REMEMBERED_DECISIONS:
+                    self._decisions.popitem(last=False)
+
+            return sampled
+
+        if self._decisions:
+            with self._lock:
+                sampled = self._decisions.get(trace_id)
+
+            if sampled is not None:
+                return sampled
+
+        return _hash(trace_id) < self.rate
+
+
+class UnsampledTrace(object):
+    """Takes the place of the task manager for the clients of a trace that is not sampled.
+
+    Clients check for it to skip building events, the events that still arrive are
+    discarded. Everything else is forwarded to the task manager of the Langfuse client.
+    """
+
+    def __init__(self, task_manager: Any):
+        self.task_manager = task_manager
+
+    def add_task(self, event: dict):
+        return
+
+    def __getattr__(self, name: str):
+        return getattr(self.task_manager, name)
+
+
+def _hash(trace_id: str) -> float:
+    """Map a trace id to a number between 0 and 1 that is stable across processes."""
+    return zlib.crc32(trace_id.encode()) / 0x100000000
+
+
+class TraceBuffer(object):
+    """Holds the events of one trace until the sampler decided whether to upload them.
+
+    Kept events are passed on to the task manager, everything else is forwarded to it.
+    Buffers of the task manager are opened with `TraceBuffers`.
+
+    Attributes:
+        name (Optional[str]): Name of the trace.
+        events (List[dict]): Events held until the trace is finished.
+        has_error (bool): Whether an observation of the trace has the level `ERROR`.
+        duration (Optional[float]): Seconds from the start to the end of the top-level function, once finished.
+    """
+
+    _log = logging.getLogger("langfuse")
+
+    def __init__(
+        self,
+        task_manager: Any,
+        name: Optional[str] = None,
+        on_decided: Optional[Callable[[bool], None]] = None,
+    ):
+        self.task_manager = task_manager
+        self.name = name
+        self.events: List[dict] = []
+        self.has_error = False
+        self.duration: Optional[float] = None
+        self._started_at = time.monotonic()
+        self._keep: Optional[bool] = None
+        self._on_decided = on_decided
+        self._lock = threading.Lock()
+
+    def add_task(self, event: dict):
+        with self._lock:
+            if self._keep is None:
+                if len(self.events) < MAX_BUFFERED_EVENTS:
+                    body = event.get("body")
+                    if isinstance(body, dict) and body.get("level") == "ERROR":
+                        self.has_error = True
+
+                    self.events.append(event)
+                    return
+
+                self._log.warning(
+                    f"Trace {self.name} has more than {MAX_BUFFERED_EVENTS} events, it is not sampled."
+                )
+                self._decide(True)
+                events, self.events = self.events, []
+            else:
+                events = []
+
+        if not self._keep:
+            return
+
+        for buffered in events:
+            self.task_manager.add_task(buffered)
+
+        return self.task_manager.add_task(event)
+
+    def finish(self, sampler: "TailSampler") -> bool:
+        """Let the sampler decide about the trace and upload its events if it is kept.
+
+        Events added afterwards, e.g. by generators consumed after the top-level
+        function returned, follow the same decision.
+
+        Returns:
+            bool: True if the trace is kept.
+        """
+        with self._lock:
+            if self._keep is not None:
+                return self._keep
+
+            self.duration = time.monotonic() - self._started_at
+
+            try:
+                keep = sampler.should_keep(self)
+            except Exception as e:
+                self._log.exception(f"Tail sampler failed, keeping trace: {e}")
+                keep = True
+
+            self._decide(keep)
+            events, self.events = self.events, []
+
+        if keep:
+            for event in events:
+                self.task_manager.add_task(event)
+
+        return keep
+
+    def _decide(self, keep: bool):
+        self._keep = keep
+        if self._on_decided is not None:
+            self._on_decided(keep)
+
+    def __getattr__(self, name: str):
+        return getattr(self.task_manager, name)
+
+
+class TraceBuffers(object):
+    """Routes the events of traces that wait for the tail sampler to their `TraceBuffer`.
+
+    The task manager offers every event to `hold` before queueing it. Events are matched
+    by their trace id, so the events of a buffered trace are held whichever client
+    created them, e.g. scores of the Langfuse client or generations of the OpenAI
+    integration. Events that arrive after a trace was dropped are discarded.
+    """
+
+    def __init__(self, task_manager: Any):
+        self._task_manager = task_manager
+        self._buffers: Dict[str, TraceBuffer] = {}
+        self._dropped: "OrderedDict[str, None]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def open(self, trace_id: str, name: Optional[str] = None) -> TraceBuffer:
+        """Hold the events of the trace until `finish` is called with its id."""
+        buffer = TraceBuffer(
+            self._task_manager,
+            name=name,
+            on_decided=lambda keep: self._close(trace_id, keep),
+        )
+
+        with self._lock:
+            self._buffers[trace_id] = buffer
+
+        return buffer
+
+    def finish(self, trace_id: str, sampler: "TailSampler") -> Optional[bool]:
+        """Let the sampler decide about the trace, return None if it is not buffered."""
+        with self._lock:
+            buffer = self._buffers.get(trace_id)
+
+        return buffer.finish(sampler) if buffer is not None else None
+
+    def hold(self, event: dict) -> bool:
+        """Return True if the event belongs to a buffered or dropped trace and must not be queued."""
+        if not self._buffers and not self._dropped:
+            return False
+
+        trace_id = _event_trace_id(event)
+        if trace_id is None:
+            return False
+
+        with self._lock:
+            buffer = self._buffers.get(trace_id)
+            if buffer is None:
+                return trace_id in self._dropped
+
+        # added outside of the lock, a kept trace forwards its events to the task manager
+        buffer.add_task(event)
+        return True
+
+    def _close(self, trace_id: str, keep: bool):
+        with self._lock:
+            self._buffers.pop(trace_id, None)
+
+            if not keep:
+                self._dropped[trace_id] = None
+                if len(self._dropped) > MAX_REMEMBERED_DECISIONS:
+                    self._dropped.popitem(last=False)
+
+
+def _event_trace_id(event: dict) -> Optional[str]:
+    body = event.get("body")
+    if not isinstance(body, dict):
+        return None
+
+    if event.get("type") == "trace-create":
+        return body.get("id")
+
+    return body.get("traceId")
+
+
+class TailSampler(object):
+    """Decides which finished traces are uploaded.
+
+    A trace is kept if an observation failed, if it is slower than the given percentile
+    of the recently finished traces, or otherwise with probability `rate`.
+
+    Args:
+        rate (float): Share of the other traces that are kept, between 0 and 1.
+        keep_errors (bool): Keep all traces with an observation with the level `ERROR`. Default is True.
+        latency_percentile (Optional[float]): Keep traces at or above this percentile of latency, e.g. `95`. Disabled by default.
+        latency_window (int): Number of recently finished traces the percentile is computed from.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        *,
+        keep_errors: bool = True,
+        latency_percentile: Optional[float] = None,
+        latency_window: int = 1_000,
+    ):
+        if not 0 <= rate <= 1:
+            raise ValueError("rate must be between 0 and 1")
+        if latency_percentile is not None and not 0 < latency_percentile < 100:
+            raise ValueError("latency_percentile must be between 0 and 100")
+
+        self.rate = rate
+        self.keep_errors = keep_errors
+        self.latency_percentile = latency_percentile
+        self._durations: Deque[float] = deque(maxlen=latency_window)
+        self._sorted_durations: List[float] = []
+        self._lock = threading.Lock()
+
+    def should_keep(self, trace: TraceBuffer) -> bool:
+        is_slow = self._is_slow(trace.duration)
+
+        if self.keep_errors and trace.has_error:
+            return True
+
+        return is_slow or random.random() < self.rate
+
+    def _is_slow(self, duration: Optional[float]) -> bool:
+        """Compare the duration to the percentile of the window, then add it to the window."""
+        if self.latency_percentile is None or duration is None:
+            return False
+
+        with self._lock:
+            durations = self._sorted_durations
+            threshold = None
+            if len(durations) >= MIN_LATENCY_SAMPLES:
+                index = int(len(durations) * self.latency_percentile / 100)
+                threshold = durations[min(index, len(durations) - 1)]
+
+            if len(self._durations) == self._durations.maxlen:
+                oldest = self._durations.popleft()
+                del durations[bisect.bisect_left(durations, oldest)]
+
+            self._durations.append(duration)
+            bisect.insort(durations, duration)
+
+        return threshold is not None and duration >= threshold
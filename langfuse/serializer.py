@@ -4,11 +4,15 @@ from asyncio import Queue
 from datetime import date, datetime
 from dataclasses import is_dataclass, asdict
 import enum
+import json
+import logging
+import os
 from json import JSONEncoder
-from typing import Any
+from typing import Any, Callable, Dict, Optional, Set, Union
 from uuid import UUID
 from collections.abc import Sequence
 from langfuse.api.core import serialize_datetime
+from langfuse.array_summary import SUMMARY_HANDLERS
 from pathlib import Path
 
 from pydantic import BaseModel
@@ -20,67 +24,143 @@ except ImportError:
     # If Serializable is not available, set it to NoneType
     Serializable = type(None)
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSON_BACKENDS = ("orjson", "json")
+
+# Datetimes and dataclasses are passed to `EventSerializer.default` so that they are
+# formatted like by the standard library encoder; non-string keys are converted like
+# `json.dumps` does.
+ORJSON_OPTIONS = (
+    orjson.OPT_PASSTHROUGH_DATETIME
+    | orjson.OPT_PASSTHROUGH_DATACLASS
+    | orjson.OPT_NON_STR_KEYS
+    if orjson is not None
+    else 0
+)
+
+
+# dispatch cache entries, the cache is reset when it grows beyond this size
+MAX_DISPATCH_CACHE_SIZE = 10_000
+
+Handler = Callable[["EventSerializer", Any], Any]
+
 
 class EventSerializer(JSONEncoder):
+    """JSON encoder for the values passed to Langfuse, converting types json does not know.
+
+    The conversion of a value is selected by its class: handlers registered with
+    `register` are resolved along the MRO first, followed by the summaries of arrays
+    and dataframes in `langfuse.array_summary` and the built-in conversions.
+    The handler of each class is cached, so repeated types are converted without
+    testing them against all conversions again.
+    """
+
+    _handlers: Dict[type, Handler] = {}
+    _dispatch_cache: Dict[type, Handler] = {}
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.seen = set()  # Track seen objects to detect circular references
 
+    @classmethod
+    def register(cls, type_: type, handler: Callable[[Any], Any]):
+        """Register a conversion for instances of `type_` and its subclasses.
+
+        Args:
+            type_: Class whose instances are converted by `handler`.
+            handler: Function returning a JSON-encodable representation of an instance. Values
+                nested in the result are converted again.
+        """
+        cls._handlers[type_] = lambda serializer, obj: handler(obj)
+        cls._dispatch_cache.clear()
+
+    @classmethod
+    def unregister(cls, type_: type):
+        """Remove the conversion registered for `type_`."""
+        cls._handlers.pop(type_, None)
+        cls._dispatch_cache.clear()
+
     def default(self, obj: Any):
-        if isinstance(obj, (datetime)):
+        obj_type = type(obj)
+        handler = self._dispatch_cache.get(obj_type)
+        if handler is None:
+            handler = self._resolve(obj_type)
+            if len(self._dispatch_cache) >= MAX_DISPATCH_CACHE_SIZE:
+                self._dispatch_cache.clear()
+            self._dispatch_cache[obj_type] = handler
+
+        return handler(self, obj)
+
+    @classmethod
+    def _resolve(cls, obj_type: type) -> Handler:
+        for base in obj_type.__mro__:
+            if base in cls._handlers:
+                return cls._handlers[base]
+
+        for base in obj_type.__mro__:
+            summary = SUMMARY_HANDLERS.get(f"{base.__module__}.{base.__qualname__}")
+            if summary is not None:
+                return lambda self, obj: summary(obj)
+
+        if issubclass(obj_type, datetime):
             # Timezone-awareness check
-            return serialize_datetime(obj)
+            return lambda self, obj: serialize_datetime(obj)
 
         # LlamaIndex StreamingAgentChatResponse and StreamingResponse is not serializable by default as it is a generator
         # Attention: These LlamaIndex objects are a also a dataclasses, so check for it first
-        if "Streaming" in type(obj).__name__:
-            return str(obj)
+        if "Streaming" in obj_type.__name__:
+            return lambda self, obj: str(obj)
 
-        if isinstance(obj, enum.Enum):
-            return obj.value
+        if issubclass(obj_type, enum.Enum):
+            return lambda self, obj: obj.value
 
-        if isinstance(obj, Queue):
-            return type(obj).__name__
-
-        if is_dataclass(obj):
-            return asdict(obj)
+        if issubclass(obj_type, Queue):
+            return lambda self, obj: type(obj).__name__
 
-        if isinstance(obj, UUID):
-            return str(obj)
+        if is_dataclass(obj_type):
+            return lambda self, obj: asdict(obj)
 
-        if isinstance(obj, bytes):
-            return obj.decode("utf-8")
+        if issubclass(obj_type, (UUID, Path)):
+            return lambda self, obj: str(obj)
 
-        if isinstance(obj, (date)):
-            return obj.isoformat()
+        if issubclass(obj_type, bytes):
+            return lambda self, obj: obj.decode("utf-8")
 
-        if isinstance(obj, BaseModel):
-            return obj.dict()
+        if issubclass(obj_type, date):
+            return lambda self, obj: obj.isoformat()
 
-        if isinstance(obj, Path):
-            return str(obj)
+        if issubclass(obj_type, BaseModel):
+            return lambda self, obj: obj.dict()
 
         # if langchain is not available, the Serializable type is NoneType
-        if Serializable is not None and isinstance(obj, Serializable):
-            return obj.to_json()
+        if Serializable is not type(None) and issubclass(obj_type, Serializable):
+            return lambda self, obj: obj.to_json()
 
         # Standard JSON-encodable types
-        if isinstance(obj, (dict, list, str, int, float, type(None))):
-            return obj
+        if issubclass(obj_type, (dict, list, str, int, float, type(None))):
+            return lambda self, obj: obj
 
-        if isinstance(obj, (tuple, set, frozenset)):
-            return list(obj)
+        if issubclass(obj_type, (tuple, set, frozenset)):
+            return lambda self, obj: list(obj)
 
         # Important: this needs to be always checked after str and bytes types
         # Useful for serializing protobuf messages
-        if isinstance(obj, Sequence):
-            return [self.default(item) for item in obj]
+        if issubclass(obj_type, Sequence):
+            return lambda self, obj: [self.default(item) for item in obj]
 
-        if hasattr(obj, "__slots__"):
-            return self.default(
+        if hasattr(obj_type, "__slots__"):
+            return lambda self, obj: self.default(
                 {slot: getattr(obj, slot, None) for slot in obj.__slots__}
             )
-        elif hasattr(obj, "__dict__"):
+
+        return cls._serialize_object
+
+    def _serialize_object(self, obj: Any):
+        if hasattr(obj, "__dict__"):
             obj_id = id(obj)
 
             if obj_id in self.seen:
@@ -104,3 +184,312 @@ class EventSerializer(JSONEncoder):
             return super().encode(obj)
         except Exception:
             return f'"<not serializable object of type: {type(obj).__name__}>"'  # escaping the string to avoid JSON parsing errors
+
+
+def _select_json_backend() -> str:
+    backend = os.environ.get("LANGFUSE_JSON_BACKEND")
+    if backend is None:
+        return "orjson" if orjson is not None else "json"
+
+    if backend not in JSON_BACKENDS:
+        logging.getLogger("langfuse").warning(
+            "Unknown LANGFUSE_JSON_BACKEND '%s', use one of %s.",
+            backend,
+            ", ".join(JSON_BACKENDS),
+        )
+        backend = "json"
+
+    if backend == "orjson" and orjson is None:
+        logging.getLogger("langfuse").warning(
+            "LANGFUSE_JSON_BACKEND is set to 'orjson' but orjson is not installed. pip install 'langfuse[fast]'"
+        )
+        backend = "json"
+
+    return backend
+
+
+json_backend = _select_json_backend()
+
+
+# fields of an event body that hold user data and are truncated to the field budget
+BUDGETED_FIELDS = ("input", "output", "metadata")
+
+# key added to truncated dicts, holding the number of keys that were left out
+TRUNCATED_KEY = "..."
+
+_NATIVE_SCALARS = (int, float, bool)
+
+
+class Normalizer(object):
+    """Converts values into JSON-native dicts, lists, strings and numbers.
+
+    Values are converted with the conversions of `EventSerializer` while tracking the
+    approximate size of their JSON encoding. Once `max_bytes` are spent, the rest of
+    the value is not walked: strings are cut and get a marker with their original
+    length, lists and dicts keep their head followed by a marker with the number of
+    items that were left out. Circular references are replaced by the type name.
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None):
+        self.remaining = max_bytes if max_bytes is not None else float("inf")
+        self.truncated = False
+        self._serializer = EventSerializer()
+        self._path: Set[int] = set()
+
+    def normalize(self, obj: Any) -> Any:
+        obj_type = type(obj)
+        if obj_type is str:
+            return self._normalize_str(obj)
+        if obj_type is dict:
+            return self._normalize_dict(obj)
+        if obj_type is list or obj_type is tuple:
+            return self._normalize_list(obj)
+        if obj is None or obj_type in _NATIVE_SCALARS:
+            self.remaining -= 8
+            return obj
+
+        # subclasses of native types
+        if isinstance(obj, str):
+            return self._normalize_str(obj)
+        if isinstance(obj, (int, float)):
+            self.remaining -= 8
+            return obj
+        if isinstance(obj, dict):
+            return self._normalize_dict(obj)
+        if isinstance(obj, (list, tuple)):
+            return self._normalize_list(obj)
+
+        try:
+            converted = self._serializer.default(obj)
+        except Exception as e:
+            # only the value is replaced, the rest of the event is kept
+            logging.getLogger("langfuse").debug(
+                "Failed to serialize value of type %s: %s", obj_type.__name__, e
+            )
+            return self._normalize_str(
+                f"<not serializable object of type: {obj_type.__name__}>"
+            )
+
+        if converted is obj:
+            return obj
+
+        return self.normalize(converted)
+
+    def _normalize_str(self, obj: str) -> str:
+        if len(obj) + 2 <= self.remaining:
+            self.remaining -= len(obj) + 2
+            return obj
+
+        keep = max(int(self.remaining) - 2, 0)
+        self.remaining = 0
+        self.truncated = True
+        return f"{obj[:keep]}...[truncated, {len(obj)} chars]"
+
+    def _normalize_dict(self, obj: dict) -> Union[dict, str]:
+        obj_id = id(obj)
+        if obj_id in self._path:
+            # Break on circular references
+            return type(obj).__name__
+        self._path.add(obj_id)
+
+        result = {}
+        remaining = self.remaining - 2
+
+        for i, (key, value) in enumerate(obj.items()):
+            if remaining <= 0:
+                self.truncated = True
+                result[TRUNCATED_KEY] = (
+                    f"[truncated, {len(obj) - i} of {len(obj)} keys]"
+                )
+                break
+
+            if not isinstance(key, str):
+                key = _normalize_key(key)
+
+            # strings that fit are taken as they are, they are most values of chat payloads
+            if isinstance(value, str) and len(key) + len(value) + 6 <= remaining:
+                remaining -= len(key) + len(value) + 6
+                result[key] = value
+            else:
+                self.remaining = remaining - len(key) - 4
+                result[key] = self.normalize(value)
+                remaining = self.remaining
+
+        self.remaining = remaining
+        self._path.discard(obj_id)
+
+        return result
+
+    def _normalize_list(self, obj: Union[list, tuple]) -> Union[list, str]:
+        obj_id = id(obj)
+        if obj_id in self._path:
+            # Break on circular references
+            return type(obj).__name__
+        self._path.add(obj_id)
+
+        result = []
+        remaining = self.remaining - 2
+
+        for i, value in enumerate(obj):
+            if remaining <= 0:
+                self.truncated = True
+                result.append(f"...[truncated, {len(obj) - i} of {len(obj)} items]")
+                break
+
+            if isinstance(value, str) and len(value) + 3 <= remaining:
+                remaining -= len(value) + 3
+                result.append(value)
+            else:
+                self.remaining = remaining - 1
+                result.append(self.normalize(value))
+                remaining = self.remaining
+
+        self.remaining = remaining
+        self._path.discard(obj_id)
+
+        return result
+
+
+def _normalize_key(key: Any) -> str:
+    # same conversion of non-string keys as json.dumps
+    if isinstance(key, str):
+        return key
+    if key is True:
+        return "true"
+    if key is False:
+        return "false"
+    if key is None:
+        return "null"
+    if isinstance(key, (int, float)):
+        return json.dumps(key)
+
+    return str(key)
+
+
+def normalize(obj: Any, max_bytes: Optional[int] = None) -> Any:
+    """Convert `obj` into JSON-native values, truncated after about `max_bytes` of JSON."""
+    return Normalizer(max_bytes).normalize(obj)
+
+
+def serialize_event(
+    event: Any,
+    max_field_bytes: Optional[int] = None,
+    max_event_bytes: Optional[int] = None,
+) -> bytes:
+    """Encode an ingestion event into its UTF-8 encoded JSON representation.
+
+    Uses orjson if it is installed, unless `LANGFUSE_JSON_BACKEND` is set to `json`.
+    Types orjson does not encode natively are converted by `EventSerializer.default`,
+    and events orjson rejects, e.g. integers beyond 64 bit, are encoded with the
+    standard library encoder. The result is equivalent to the standard library
+    encoding but more compact, and non-ASCII characters are not escaped.
+
+    With a byte budget, the event is normalized first and the `BUDGETED_FIELDS` of its
+    body are truncated by `Normalizer` once they exceed `max_field_bytes` or the event
+    exceeds `max_event_bytes`, without walking the rest of large values.
+    """
+    if max_field_bytes is not None or max_event_bytes is not None:
+        event = _normalize_event(event, max_field_bytes, max_event_bytes)
+
+    if json_backend == "orjson":
+        try:
+            return orjson.dumps(
+                event, default=EventSerializer().default, option=ORJSON_OPTIONS
+            )
+        except orjson.JSONEncodeError:
+            pass
+
+    return json.dumps(event, cls=EventSerializer).encode("utf-8")
+
+
+def _normalize_event(
+    event: Any, max_field_bytes: Optional[int], max_event_bytes: Optional[int]
+) -> Any:
+    body = event.get("body") if isinstance(event, dict) else None
+    if not isinstance(body, dict):
+        return event
+
+    inf = float("inf")
+    remaining = max_event_bytes if max_event_bytes is not None else inf
+    field_budget = max_field_bytes if max_field_bytes is not None else inf
+
+    # fields within their budget are kept, the others share the rest of the event budget
+    oversized = []
+    for key in BUDGETED_FIELDS:
+        if key in body:
+            size = _native_size(body[key], field_budget)
+            if size <= field_budget:
+                remaining -= size
+            else:
+                oversized.append(key)
+
+    if remaining < 0:
+        oversized = [key for key in BUDGETED_FIELDS if key in body]
+        remaining = max_event_bytes
+
+    normalized = {}
+    for i, key in enumerate(oversized):
+        budget = min(field_budget, remaining / (len(oversized) - i))
+        normalizer = Normalizer(budget)
+        try:
+            normalized[key] = normalizer.normalize(body[key])
+        except RecursionError:
+            continue
+        remaining -= budget - normalizer.remaining
+
+        if normalizer.truncated:
+            logging.getLogger("langfuse").warning(
+                "%s of event %s exceeds the size budget of %d bytes, truncated it.",
+                key,
+                event.get("id"),
+                budget,
+            )
+
+    if not normalized:
+        return event
+
+    return {**event, "body": {**body, **normalized}}
+
+
+def _native_size(obj: Any, limit: float) -> float:
+    """Estimate the encoded size of JSON-native values, stopping early beyond `limit`.
+
+    Returns infinity for values that hold other types, their size is only known once
+    they are converted.
+    """
+    obj_type = type(obj)
+    if obj_type is str:
+        return len(obj) + 2
+
+    if obj_type is dict:
+        size = 2
+        for key, value in obj.items():
+            if not isinstance(key, str):
+                return float("inf")
+
+            # strings are sized inline, they are most values of chat payloads
+            if isinstance(value, str):
+                size += len(key) + len(value) + 6
+            else:
+                size += len(key) + 4 + _native_size(value, limit - size)
+
+            if size > limit:
+                break
+        return size
+
+    if obj_type is list:
+        size = 2
+        for value in obj:
+            if isinstance(value, str):
+                size += len(value) + 3
+            else:
+                size += 1 + _native_size(value, limit - size)
+
+            if size > limit:
+                break
+        return size
+
+    if obj is None or obj_type in _NATIVE_SCALARS:
+        return 8
+
+    return float("inf")
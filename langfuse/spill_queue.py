@@ -0,0 +1,316 @@
+"""@private"""
+
+import logging
+import mmap
+import os
+import struct
+import threading
+from typing import BinaryIO, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:
+    # not available on Windows, where directories are not locked
+    fcntl = None
+
+SEGMENT_SUFFIX = ".seg"
+CURSOR_FILE = "cursor"
+LOCK_FILE = "lock"
+
+# each record is prefixed with its length as unsigned 32-bit big-endian integer
+RECORD_HEADER = struct.Struct(">I")
+
+
+class SpillDirectoryInUseError(Exception):
+    """Raised when the directory of a `SpillQueue` is locked by another queue."""
+
+
+class SpillQueue(object):
+    """Durable write-ahead log for encoded ingestion events.
+
+    Events are appended to append-only segment files in `directory`. Segments are read
+    back in order through `mmap`, and a segment is deleted once all of its records have
+    been acknowledged. The read position is persisted in a cursor file, so events that
+    are still on disk when the process exits are replayed by the next process using the
+    same directory. Records are delivered at least once: a batch that was read but not
+    acknowledged before a crash is read again after the restart.
+
+    Disk usage is bounded by `max_bytes`; appends that would exceed it are rejected.
+    A directory is used by a single queue at a time: it is locked until `close`, and
+    opening a second queue on it raises `SpillDirectoryInUseError`.
+    """
+
+    _log = logging.getLogger("langfuse")
+
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int = 256_000_000,
+        segment_size: int = 8_000_000,
+    ):
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._segment_size = segment_size
+        self._lock = threading.Lock()
+        self._progress = threading.Condition(self._lock)
+
+        os.makedirs(directory, exist_ok=True)
+        self._lock_file = self._lock_directory()
+        self._closed = False
+
+        segments = self._list_segments()
+        self._total_bytes = sum(
+            os.path.getsize(self._segment_path(seq)) for seq in segments
+        )
+
+        self._read_seq, self._read_offset = self._load_cursor(segments)
+        # reading is exclusive, the end of the batch that has been read but not acknowledged yet
+        self._inflight: Optional[Tuple[int, int, int]] = None
+
+        # segments written by a previous process are sealed, new records go to a new segment
+        self._write_seq = (segments[-1] + 1) if segments else 0
+        self._writer: Optional[BinaryIO] = None
+        self._write_size = 0
+
+        self._pending = sum(self._count_records(seq) for seq in segments)
+        if self._pending:
+            self._log.info(
+                "found %d spilled events in %s, replaying them",
+                self._pending,
+                directory,
+            )
+
+    def __len__(self) -> int:
+        """Return the number of records that have not been acknowledged yet."""
+        return self._pending
+
+    def append(self, records: List[bytes]) -> bool:
+        """Append records to the log.
+
+        Returns:
+            bool: False if the records were rejected because the log is full.
+        """
+        size = sum(RECORD_HEADER.size + len(record) for record in records)
+
+        with self._lock:
+            if self._closed:
+                return False
+
+            if self._total_bytes + size > self._max_bytes:
+                self._log.warning(
+                    "spill queue is full (%d bytes), dropping %d events",
+                    self._total_bytes,
+                    len(records),
+                )
+                return False
+
+            if self._writer is None or self._write_size >= self._segment_size:
+                self._rotate()
+
+            self._writer.write(
+                b"".join(RECORD_HEADER.pack(len(record)) + record for record in records)
+            )
+            self._writer.flush()
+
+            self._write_size += size
+            self._total_bytes += size
+            self._pending += len(records)
+
+            return True
+
+    def read(self, max_items: int, max_bytes: int) -> List[bytes]:
+        """Read the next records in order without removing them.
+
+        The records have to be confirmed with `ack` or returned with `release` before the
+        next batch can be read; concurrent readers get an empty list in the meantime.
+        """
+        with self._lock:
+            if self._inflight is not None or self._pending == 0:
+                return []
+
+            records: List[bytes] = []
+            total_size = 0
+            seq, offset = self._read_seq, self._read_offset
+
+            for segment in self._list_segments():
+                if segment < seq:
+                    continue
+                if segment > seq:
+                    seq, offset = segment, 0
+
+                offset = self._read_segment(
+                    seq,
+                    offset,
+                    records,
+                    max_items - len(records),
+                    max_bytes - total_size,
+                )
+                total_size = sum(len(record) for record in records)
+
+                if len(records) >= max_items or total_size >= max_bytes:
+                    break
+
+            if records:
+                self._inflight = (seq, offset, len(records))
+
+            return records
+
+    def ack(self):
+        """Confirm the records returned by the last `read`, they will not be replayed again."""
+        with self._lock:
+            if self._inflight is None:
+                return
+
+            seq, offset, count = self._inflight
+            self._inflight = None
+
+            for segment in self._list_segments():
+                if segment >= seq:
+                    break
+                self._remove_segment(segment)
+
+            self._read_seq, self._read_offset = seq, offset
+            self._pending -= count
+            self._store_cursor()
+            self._progress.notify_all()
+
+    def release(self):
+        """Return the records of the last `read` to the log, they are read again later."""
+        with self._lock:
+            self._inflight = None
+
+    def wait_for_progress(self, timeout: float) -> bool:
+        """Block until records were acknowledged or the log is empty.
+
+        Returns:
+            bool: False if no records were acknowledged within `timeout` seconds.
+        """
+        with self._lock:
+            if self._pending == 0:
+                return True
+
+            return self._progress.wait(timeout)
+
+    def close(self):
+        """Close the active segment, syncing it to disk, and unlock the directory.
+
+        Records appended afterwards are rejected.
+        """
+        with self._lock:
+            self._close_writer()
+            self._closed = True
+
+            if self._lock_file is not None:
+                # closing the file releases the lock
+                self._lock_file.close()
+                self._lock_file = None
+
+    def _lock_directory(self) -> Optional[BinaryIO]:
+        if fcntl is None:
+            return None
+
+        lock_file = open(os.path.join(self._directory, LOCK_FILE), "ab")
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            raise SpillDirectoryInUseError(
+                f"spill directory {self._directory} is used by another process"
+            )
+
+        return lock_file
+
+    def _rotate(self):
+        self._close_writer()
+
+        path = self._segment_path(self._write_seq)
+        self._writer = open(path, "ab")
+        self._write_size = 0
+        self._write_seq += 1
+
+    def _close_writer(self):
+        if self._writer is None:
+            return
+
+        self._writer.flush()
+        os.fsync(self._writer.fileno())
+        self._writer.close()
+        self._writer = None
+
+    def _read_segment(
+        self,
+        seq: int,
+        offset: int,
+        records: List[bytes],
+        max_items: int,
+        max_bytes: int,
+    ) -> int:
+        """Append records of segment `seq` starting at `offset` to `records`, return the new offset."""
+        with open(self._segment_path(seq), "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size <= offset:
+                return offset
+
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                read_bytes = 0
+                while (
+                    offset + RECORD_HEADER.size <= size
+                    and max_items > 0
+                    and read_bytes < max_bytes
+                ):
+                    (length,) = RECORD_HEADER.unpack_from(data, offset)
+                    end = offset + RECORD_HEADER.size + length
+                    if end > size:
+                        # torn record of a segment that was being written when the process died
+                        break
+
+                    records.append(data[offset + RECORD_HEADER.size : end])
+                    read_bytes += length
+                    max_items -= 1
+                    offset = end
+
+        return offset
+
+    def _count_records(self, seq: int) -> int:
+        if seq < self._read_seq:
+            return 0
+
+        offset = self._read_offset if seq == self._read_seq else 0
+        records: List[bytes] = []
+        self._read_segment(seq, offset, records, float("inf"), float("inf"))
+
+        return len(records)
+
+    def _remove_segment(self, seq: int):
+        path = self._segment_path(seq)
+        self._total_bytes -= os.path.getsize(path)
+        os.remove(path)
+
+    def _list_segments(self) -> List[int]:
+        return sorted(
+            int(name[: -len(SEGMENT_SUFFIX)])
+            for name in os.listdir(self._directory)
+            if name.endswith(SEGMENT_SUFFIX)
+        )
+
+    def _segment_path(self, seq: int) -> str:
+        return os.path.join(self._directory, f"{seq:020d}{SEGMENT_SUFFIX}")
+
+    def _load_cursor(self, segments: List[int]) -> Tuple[int, int]:
+        first = segments[0] if segments else 0
+        try:
+            with open(os.path.join(self._directory, CURSOR_FILE)) as f:
+                seq, offset = (int(value) for value in f.read().split())
+        except (OSError, ValueError):
+            return first, 0
+
+        if seq < first:
+            return first, 0
+
+        return seq, offset
+
+    def _store_cursor(self):
+        path = os.path.join(self._directory, CURSOR_FILE)
+        with open(path + ".tmp", "w") as f:
+            f.write(f"{self._read_seq} {self._read_offset}")
+        os.replace(path + ".tmp", path)
@@ -1,13 +1,16 @@
 """@private"""
 
+import asyncio
 import atexit
 import json
 import logging
-import queue
+import math
+import random
 import threading
 from queue import Empty, Queue
 import time
-from typing import List, Any
+from collections import Counter
+from typing import Callable, Dict, List, Literal, Optional, Set, Tuple
 from datetime import datetime, timezone
 import typing
 
@@ -20,11 +23,26 @@ except ImportError:
 
 import backoff
 
-from langfuse.request import LangfuseClient
-from langfuse.serializer import EventSerializer
+from langfuse.exporter import Exporter, HTTPExporter
+from langfuse.flow_control import (
+    CircuitBreaker,
+    CircuitOpenError,
+    RateLimiter,
+    retry_after_expo,
+)
+from langfuse.request import APIError, APIErrors, LangfuseClient
+from langfuse.sampling import TraceBuffers
+from langfuse.serializer import BUDGETED_FIELDS, _native_size, serialize_event
+from langfuse.spill_queue import SpillDirectoryInUseError, SpillQueue
 
 # largest message size in db is 331_000 bytes right now
 MAX_MSG_SIZE = 1_000_000
+# approximate budget for an encoded event and its input, output and metadata,
+# leaving headroom below MAX_MSG_SIZE as sizes are estimated while encoding
+EVENT_SIZE_BUDGET = 900_000
+FIELD_SIZE_BUDGET = 900_000
+# assumed size of an event queued for deferred encoding, besides its input, output and metadata
+DEFERRED_EVENT_SIZE = 1_000
 
 # https://vercel.com/docs/functions/serverless-functions/runtimes#request-body-size
 # The maximum payload size for the request body or the response body of a Serverless Function is 4.5 MB
@@ -33,6 +51,41 @@ MAX_MSG_SIZE = 1_000_000
 
 BATCH_SIZE_LIMIT = 2_500_000
 
+# event types that upsert a trace or observation, mapped to the type of the entity
+UPSERT_EVENT_TYPES = {
+    "trace-create": "trace",
+    "span-create": "span",
+    "span-update": "span",
+    "generation-create": "generation",
+    "generation-update": "generation",
+}
+
+BackpressurePolicy = Literal["drop_newest", "drop_oldest", "block", "shed"]
+BACKPRESSURE_POLICIES = ("drop_newest", "drop_oldest", "block", "shed")
+
+# event types that are small and cheap to keep, never shed under load
+PROTECTED_EVENT_TYPES = {"score-create", "trace-create"}
+
+# queue utilization from which the `shed` policy starts to drop events
+SHED_THRESHOLD = 0.8
+
+# a consumer is added when the oldest event of a batch waited longer than this many
+# seconds in addition to `flush_interval`, or when the queue holds more batches than
+# `SCALE_UP_QUEUE_BATCHES`
+SCALE_UP_LAG = 1.0
+SCALE_UP_QUEUE_BATCHES = 10
+# consumers beyond the minimum are retired after being idle for this many seconds
+SCALE_DOWN_IDLE_TIME = 30.0
+
+# how often a pipelined consumer checks the queue while uploads are in flight, in seconds
+PIPELINE_POLL_INTERVAL = 0.01
+# how often a batch waiting for the trial request of the circuit breaker checks again,
+# in seconds
+CIRCUIT_POLL_INTERVAL = 0.1
+
+# upper bound of adaptive batch sizes, batches are also limited by `BATCH_SIZE_LIMIT`
+MAX_ADAPTIVE_BATCH_SIZE = 10_000
+
 
 class LangfuseMetadata(pydantic.BaseModel):
     batch_size: int
@@ -42,9 +95,631 @@ class LangfuseMetadata(pydantic.BaseModel):
     public_key: str = None
 
 
+class QueuedEvent(object):
+    """An ingestion event queued as its UTF-8 encoded JSON payload.
+
+    The payload is produced once and reused for the size checks in the consumer
+    and for assembling the request body, so events are not serialized again on
+    their way to the API. Besides the payload, only the type and ids that are needed to
+    merge and shed events are kept, so the queue does not hold on to the event and its
+    input and output. Events replayed from the spill queue only carry the payload.
+
+    Input, output and metadata beyond `FIELD_SIZE_BUDGET` are truncated while encoding,
+    so oversized values are not encoded in full only to be dropped by `enforce_size_limit`.
+
+    Events created with `snapshot` keep the event until they are encoded on first access
+    to `data`, i.e. by the consumer thread, and are accounted in the queue with an
+    estimated `size`.
+    """
+
+    __slots__ = ("type", "body_id", "_id", "_event", "_data", "size", "enqueued_at")
+
+    def __init__(self, event: Optional[dict] = None, data: Optional[bytes] = None):
+        self._set_fields(event)
+        self._event = None
+        self._data = (
+            data
+            if data is not None
+            else serialize_event(event, FIELD_SIZE_BUDGET, EVENT_SIZE_BUDGET)
+        )
+        self.size = len(self._data)
+        self.enqueued_at = time.monotonic()
+
+    @classmethod
+    def snapshot(cls, event: dict) -> "QueuedEvent":
+        """Queue a shallow copy of `event` that is encoded later.
+
+        The event, its body and the top-level dicts and lists of its input, output and
+        metadata are copied, so changing them afterwards does not change the queued
+        event. Nested values are shared and encoded as they are at upload time.
+        """
+        snapshot = dict(event)
+        body = snapshot.get("body")
+        if isinstance(body, dict):
+            body = dict(body)
+            for key in BUDGETED_FIELDS:
+                value = body.get(key)
+                if type(value) in (dict, list):
+                    body[key] = type(value)(value)
+            snapshot["body"] = body
+
+        item = cls.__new__(cls)
+        item._set_fields(snapshot)
+        item._event = snapshot
+        item._data = None
+        item.size = _estimate_size(snapshot)
+        item.enqueued_at = time.monotonic()
+
+        return item
+
+    def _set_fields(self, event: Optional[dict]):
+        if event is None:
+            self.type = self.body_id = self._id = None
+            return
+
+        body = event.get("body")
+        self.type = event.get("type")
+        self.body_id = body.get("id") if isinstance(body, dict) else None
+        self._id = event.get("id")
+
+    @property
+    def data(self) -> bytes:
+        if self._data is None:
+            self._data = serialize_event(
+                self._event, FIELD_SIZE_BUDGET, EVENT_SIZE_BUDGET
+            )
+            self._event = None
+
+        return self._data
+
+    @data.setter
+    def data(self, data: bytes):
+        self._data = data
+        self._event = None
+
+    def decoded(self) -> dict:
+        """Return the event decoded from the payload."""
+        return json.loads(self.data)
+
+    @property
+    def id(self) -> Optional[str]:
+        # events replayed from their payload only are decoded
+        return self._id if self.type is not None else self.decoded().get("id")
+
+
+def _estimate_size(event: dict) -> int:
+    """Estimate the encoded size of an event without encoding it."""
+    body = event.get("body")
+    if not isinstance(body, dict):
+        return DEFERRED_EVENT_SIZE
+
+    size = DEFERRED_EVENT_SIZE
+    for key in BUDGETED_FIELDS:
+        value = body.get(key)
+        if isinstance(value, str):
+            size += len(value)
+        elif isinstance(value, (dict, list)):
+            # values that are not JSON-native are only sized once they are converted
+            field_size = _native_size(value, FIELD_SIZE_BUDGET)
+            if field_size != float("inf"):
+                size += int(field_size)
+
+    return size
+
+
+DeadLetterHandler = Callable[[List[dict], Exception], None]
+"""Receives events rejected by the API with a non-retryable error, together with the error."""
+
+
+def is_retryable(error: Exception) -> bool:
+    """Check whether an upload error is transient, e.g. a network error, a 5xx or a 429 response."""
+    if isinstance(error, APIErrors):
+        return any(is_retryable(e) for e in error.errors)
+
+    if isinstance(error, APIError) and isinstance(error.status, int):
+        return error.status >= 500 or error.status == 429
+
+    return True
+
+
+def partition_failed_events(
+    pending: List[QueuedEvent], error: APIErrors
+) -> Tuple[List[QueuedEvent], List[QueuedEvent]]:
+    """Split the events of a partially successful (207) upload by their errors.
+
+    Events without an error were ingested. If the errors do not name the failed
+    events, the outcome of every event is unknown and all of them count as failed.
+
+    Returns:
+        The events to retry and the events rejected with a non-retryable error.
+    """
+    errors_by_id = {e.event_id: e for e in error.errors if e.event_id is not None}
+    if not errors_by_id:
+        return (pending, []) if is_retryable(error) else ([], pending)
+
+    retry, rejected = [], []
+    for item in pending:
+        event_error = errors_by_id.get(item.id)
+        if event_error is None:
+            continue
+
+        if is_retryable(event_error):
+            retry.append(item)
+        else:
+            rejected.append(item)
+
+    return retry, rejected
+
+
+def log_dead_letters(events: List[dict], error: Exception):
+    """Default dead-letter handler, logs events rejected by the API."""
+    logging.getLogger("langfuse").error(
+        "dropping %d events rejected by the API: %s", len(events), error
+    )
+
+
+def upload_with_retries(
+    send: Callable[[List[QueuedEvent]], typing.Any],
+    batch: List[QueuedEvent],
+    max_retries: int,
+    on_rejected: Callable[[List[QueuedEvent], Exception], None],
+    log: logging.Logger,
+    before_attempt: Optional[Callable[[List[QueuedEvent]], None]] = None,
+    after_attempt: Optional[Callable[[Optional[Exception]], None]] = None,
+) -> List[QueuedEvent]:
+    """Upload a batch, retrying only the events that failed with transient errors.
+
+    After a partially successful (207) upload, only the failed events are sent again.
+    Events rejected with a non-retryable error are passed to `on_rejected`.
+
+    Args:
+        send: Sends the events of a single attempt.
+        before_attempt: Called with the pending events before each attempt, e.g. to wait
+            for the rate limiter.
+        after_attempt: Called with the error of each attempt, or None if it succeeded.
+
+    Returns:
+        The events that could not be delivered within `max_retries` attempts.
+    """
+    if not batch:
+        return []
+
+    log.debug("uploading batch of %d items", len(batch))
+    pending = batch
+
+    @backoff.on_exception(
+        retry_after_expo,
+        Exception,
+        max_tries=max_retries,
+        giveup=lambda e: not is_retryable(e),
+        jitter=None,
+    )
+    def execute_task_with_backoff():
+        nonlocal pending
+        try:
+            if before_attempt is not None:
+                before_attempt(pending)
+
+            try:
+                send(pending)
+            except Exception as e:
+                if after_attempt is not None:
+                    after_attempt(e)
+                raise
+
+            if after_attempt is not None:
+                after_attempt(None)
+        except APIErrors as e:
+            pending, rejected = partition_failed_events(pending, e)
+            if rejected:
+                on_rejected(rejected, e)
+
+            if pending:
+                log.debug("retrying %d failed items", len(pending))
+                raise
+
+    try:
+        execute_task_with_backoff()
+    except Exception as e:
+        return _settle_failed_upload(pending, e, on_rejected, log)
+
+    log.debug("successfully uploaded batch of %d items", len(batch))
+    return []
+
+
+async def async_upload_with_retries(
+    send: Callable[[List[QueuedEvent]], typing.Awaitable[typing.Any]],
+    batch: List[QueuedEvent],
+    max_retries: int,
+    on_rejected: Callable[[List[QueuedEvent], Exception], None],
+    log: logging.Logger,
+    before_attempt: Optional[
+        Callable[[List[QueuedEvent]], typing.Awaitable[None]]
+    ] = None,
+    after_attempt: Optional[Callable[[Optional[Exception]], None]] = None,
+) -> List[QueuedEvent]:
+    """Async counterpart of `upload_with_retries`, `send` and `before_attempt` are awaited."""
+    if not batch:
+        return []
+
+    log.debug("uploading batch of %d items", len(batch))
+    pending = batch
+
+    @backoff.on_exception(
+        retry_after_expo,
+        Exception,
+        max_tries=max_retries,
+        giveup=lambda e: not is_retryable(e),
+        jitter=None,
+    )
+    async def execute_task_with_backoff():
+        nonlocal pending
+        try:
+            if before_attempt is not None:
+                await before_attempt(pending)
+
+            try:
+                await send(pending)
+            except Exception as e:
+                if after_attempt is not None:
+                    after_attempt(e)
+                raise
+
+            if after_attempt is not None:
+                after_attempt(None)
+        except APIErrors as e:
+            pending, rejected = partition_failed_events(pending, e)
+            if rejected:
+                on_rejected(rejected, e)
+
+            if pending:
+                log.debug("retrying %d failed items", len(pending))
+                raise
+
+    try:
+        await execute_task_with_backoff()
+    except Exception as e:
+        return _settle_failed_upload(pending, e, on_rejected, log)
+
+    log.debug("successfully uploaded batch of %d items", len(batch))
+    return []
+
+
+def _settle_failed_upload(
+    pending: List[QueuedEvent],
+    error: Exception,
+    on_rejected: Callable[[List[QueuedEvent], Exception], None],
+    log: logging.Logger,
+) -> List[QueuedEvent]:
+    log.exception("error uploading: %s", error)
+
+    if is_retryable(error):
+        return pending
+
+    if pending:
+        on_rejected(pending, error)
+    return []
+
+
+def enforce_size_limit(item: QueuedEvent, log: logging.Logger) -> bool:
+    """Drop input/output of events exceeding `MAX_MSG_SIZE`.
+
+    Events queued for deferred serialization are encoded here, on the consumer thread.
+    Events that fail to encode are dropped, like `TaskManager.add_task` drops them.
+
+    Returns:
+        bool: False if the event has to be dropped entirely, True otherwise.
+    """
+    try:
+        item_size = len(item.data)
+    except Exception as e:
+        log.exception(f"Exception in encoding task {e}")
+        return False
+
+    log.debug(f"item size {item_size}")
+    if item_size <= MAX_MSG_SIZE:
+        return True
+
+    log.warning(
+        "Item exceeds size limit (size: %s), dropping input/output of item.",
+        item_size,
+    )
+
+    event = item.decoded()
+
+    # for large events, drop input / output within the body
+    if "body" in event and "input" in event["body"]:
+        event["body"]["input"] = None
+    if "body" in event and "output" in event["body"]:
+        event["body"]["output"] = None
+
+    # if item does not have body or input/output fields, drop the event
+    if "body" not in event or (
+        "input" not in event["body"] and "output" not in event["body"]
+    ):
+        log.warning("Item does not have body or input/output fields, dropping item.")
+        return False
+
+    # need to encode the item again after dropping input/output
+    item.data = serialize_event(event)
+    log.debug(f"item size after dropping input/output {len(item.data)}")
+
+    return True
+
+
+def coalesce_events(items: List[QueuedEvent]) -> List[QueuedEvent]:
+    """Merge events of a batch that upsert the same trace or observation.
+
+    A generation is usually sent as a `generation-create` followed by one or more
+    `generation-update` events. These are merged into a single event at the position of
+    the first one, so the API receives the final state once. Later values override
+    earlier ones, except for `metadata`, which is merged key by key, and trace `tags`,
+    which are combined, the same way the API merges upserts.
+
+    Returns:
+        The batch with merged events, in the order of their first occurrence.
+    """
+    groups: Dict[Tuple[str, str], List[QueuedEvent]] = {}
+    batch = []
+
+    for item in items:
+        key = _upsert_key(item)
+        if key is None:
+            batch.append(item)
+        elif key in groups:
+            groups[key].append(item)
+        else:
+            groups[key] = [item]
+            batch.append(item)
+
+    for group in groups.values():
+        if len(group) > 1:
+            _merge_events(group)
+
+    return batch
+
+
+def _upsert_key(item: QueuedEvent) -> Optional[Tuple[str, str]]:
+    # spilled events only carry their payload and are not merged
+    if item.type not in UPSERT_EVENT_TYPES or item.body_id is None:
+        return None
+
+    return UPSERT_EVENT_TYPES[item.type], item.body_id
+
+
+def _merge_events(group: List[QueuedEvent]):
+    """Merge all events of `group` into the first one."""
+    # merge the encoded payloads, the events may have been changed since they were queued
+    events = [json.loads(item.data) for item in group]
+    merged = events[0]
+
+    for event in events[1:]:
+        if event["type"].endswith("-create"):
+            merged["type"] = event["type"]
+        merged["timestamp"] = event["timestamp"]
+
+        body = merged["body"]
+        for key, value in event["body"].items():
+            previous = body.get(key)
+            if (
+                key == "metadata"
+                and isinstance(previous, dict)
+                and isinstance(value, dict)
+            ):
+                body[key] = {**previous, **value}
+            elif (
+                key == "tags" and isinstance(previous, list) and isinstance(value, list)
+            ):
+                body[key] = previous + [tag for tag in value if tag not in previous]
+            else:
+                body[key] = value
+
+    group[0].type = merged["type"]
+    group[0].data = serialize_event(merged, FIELD_SIZE_BUDGET, EVENT_SIZE_BUDGET)
+
+
+class EventQueue(Queue):
+    """Queue of `QueuedEvent`s bounded by the number of events and their total size.
+
+    `put_event` applies a backpressure policy when the queue is full:
+
+    - `drop_newest`: the new event is dropped.
+    - `drop_oldest`: the oldest events are dropped to make room for the new one.
+    - `block`: waits up to `timeout` seconds for room, then drops the new event.
+    - `shed`: once the queue is filled beyond `SHED_THRESHOLD`, new events are dropped
+      with a probability that grows with the fill level and their payload size. Scores
+      and trace-creates are not shed; when the queue is full, they replace the oldest
+      other events.
+    """
+
+    def __init__(self, maxsize: int = 0, max_bytes: int = 0):
+        super().__init__(maxsize)
+        self.max_bytes = max_bytes
+        self.bytes = 0
+
+    def _put(self, item: QueuedEvent):
+        self.queue.append(item)
+        self.bytes += item.size
+
+    def get_event(
+        self,
+        timeout: Optional[float] = None,
+        cancelled: Callable[[], bool] = lambda: False,
+    ) -> Optional[QueuedEvent]:
+        """Remove and return the next event, waiting until one is available.
+
+        Returns:
+            The event, or None if `timeout` seconds passed or `cancelled()` became true
+            after `interrupt` was called.
+        """
+        with self.not_empty:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while not self._qsize():
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if cancelled() or (remaining is not None and remaining <= 0):
+                    return None
+                self.not_empty.wait(remaining)
+
+            item = self._get()
+            self.not_full.notify()
+            return item
+
+    def interrupt(self):
+        """Wake up all consumers waiting in `get_event` to check whether they were cancelled."""
+        with self.not_empty:
+            self.not_empty.notify_all()
+
+    def _get(self) -> QueuedEvent:
+        item = self.queue.popleft()
+        self.bytes -= item.size
+        return item
+
+    def put_event(
+        self,
+        item: QueuedEvent,
+        policy: BackpressurePolicy = "drop_newest",
+        timeout: Optional[float] = None,
+    ) -> List[QueuedEvent]:
+        """Add an event to the queue, applying `policy` if the queue is full.
+
+        Returns:
+            The events dropped by the policy, which may include `item` itself.
+        """
+        size = item.size
+
+        with self.not_full:
+            dropped = []
+
+            if policy == "shed" and self._should_shed(item, size):
+                return [item]
+
+            if policy == "block":
+                deadline = None if timeout is None else time.monotonic() + timeout
+                while not self._has_room(size):
+                    remaining = (
+                        None if deadline is None else deadline - time.monotonic()
+                    )
+                    if remaining is not None and remaining <= 0:
+                        return [item]
+                    self.not_full.wait(remaining)
+
+            elif not self._has_room(size):
+                if policy == "drop_oldest" or (
+                    policy == "shed" and _is_protected(item)
+                ):
+                    dropped = self._evict(size, keep_protected=policy == "shed")
+
+                if not self._has_room(size):
+                    return dropped + [item]
+
+            self._put(item)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+
+            return dropped
+
+    def _has_room(self, size: int) -> bool:
+        if 0 < self.maxsize <= self._qsize():
+            return False
+
+        # an event larger than `max_bytes` is still accepted by an empty queue
+        return not (0 < self.max_bytes < self.bytes + size and self.bytes > 0)
+
+    def _utilization(self) -> float:
+        return max(
+            self._qsize() / self.maxsize if self.maxsize > 0 else 0,
+            self.bytes / self.max_bytes if self.max_bytes > 0 else 0,
+        )
+
+    def _should_shed(self, item: QueuedEvent, size: int) -> bool:
+        utilization = self._utilization()
+        if utilization < SHED_THRESHOLD or _is_protected(item):
+            return False
+
+        pressure = min(1.0, (utilization - SHED_THRESHOLD) / (1 - SHED_THRESHOLD))
+        # events up to the average size are shed less often, larger ones with `pressure`
+        average_size = self.bytes / self._qsize() if self._qsize() else size
+        weight = min(1.0, size / average_size) if average_size else 1.0
+
+        return random.random() < pressure * weight
+
+    def _evict(self, size: int, keep_protected: bool) -> List[QueuedEvent]:
+        """Remove the oldest events until `size` bytes fit, must hold the mutex."""
+        evicted = []
+        i = 0
+        while i < len(self.queue) and not self._has_room(size):
+            if keep_protected and _is_protected(self.queue[i]):
+                i += 1
+                continue
+
+            item = self.queue[i]
+            del self.queue[i]
+            self.bytes -= item.size
+            evicted.append(item)
+
+            # evicted events will not be acknowledged by a consumer
+            self.unfinished_tasks -= 1
+            if self.unfinished_tasks == 0:
+                self.all_tasks_done.notify_all()
+
+        return evicted
+
+
+def _is_protected(item: QueuedEvent) -> bool:
+    return item.type in PROTECTED_EVENT_TYPES
+
+
+class BatchController(object):
+    """Adapts the batch size of a consumer to the event rate and the upload latency.
+
+    The batch size targets the number of events that arrive while a batch is being
+    uploaded plus the current backlog, so that a consumer catches up with bursts by
+    sending fewer, larger batches instead of many small ones. When the load drops, the
+    batch size shrinks back to `min_size`. Batches remain limited to `BATCH_SIZE_LIMIT`.
+    """
+
+    _smoothing = 0.3
+    # time constant in seconds of the arrival rate average
+    _rate_window = 1.0
+
+    def __init__(self, min_size: int, max_size: int = MAX_ADAPTIVE_BATCH_SIZE):
+        self.batch_size = min_size
+        self._min_size = min_size
+        self._max_size = max(min_size, max_size)
+        # moving averages of the arrival rate (events/s) and upload latency (s)
+        self._rate = 0.0
+        self._latency = 0.0
+        self._backlog = 0
+        self._last_batch_time: Optional[float] = None
+
+    def record_batch(self, size: int, backlog: int):
+        """Record a batch of `size` events taken from a queue with `backlog` events left."""
+        now = time.monotonic()
+        if self._last_batch_time is not None and now > self._last_batch_time:
+            elapsed = now - self._last_batch_time
+            # events that arrived since the last batch were consumed or are in the backlog
+            arrivals = max(0, size + backlog - self._backlog)
+            # weighted by the elapsed time, so that bursts and idle periods decay alike
+            weight = 1 - math.exp(-elapsed / self._rate_window)
+            self._rate += weight * (arrivals / elapsed - self._rate)
+
+        self._last_batch_time = now
+        self._backlog = backlog
+        self._update()
+
+    def record_upload(self, latency: float):
+        """Record the duration of an upload in seconds."""
+        self._latency += self._smoothing * (latency - self._latency)
+        self._update()
+
+    def _update(self):
+        target = self._rate * self._latency + self._backlog
+        self.batch_size = int(min(self._max_size, max(self._min_size, target)))
+
+
 class Consumer(threading.Thread):
     _log = logging.getLogger("langfuse")
-    _queue: Queue
+    _queue: EventQueue
     _identifier: int
     _client: LangfuseClient
     _flush_at: int
@@ -54,10 +729,11 @@ class Consumer(threading.Thread):
     _sdk_name: str
     _sdk_version: str
     _sdk_integration: str
+    _spill: Optional[SpillQueue]
 
     def __init__(
         self,
-        queue: Queue,
+        queue: EventQueue,
         identifier: int,
         client: LangfuseClient,
         flush_at: int,
@@ -67,8 +743,28 @@ class Consumer(threading.Thread):
         sdk_name: str,
         sdk_version: str,
         sdk_integration: str,
+        spill: Optional[SpillQueue] = None,
+        dead_letter_handler: DeadLetterHandler = log_dead_letters,
+        coalesce: bool = True,
+        adaptive_batching: bool = False,
+        on_batch: Optional[Callable[[float], None]] = None,
+        retire: Optional[Callable[["Consumer"], bool]] = None,
+        idle_timeout: float = SCALE_DOWN_IDLE_TIME,
+        max_inflight_uploads: int = 1,
+        rate_limiter: Optional[RateLimiter] = None,
+        circuit_breaker: Optional[CircuitBreaker] = None,
+        drain: Optional[threading.Event] = None,
+        exporter: Optional[Exporter] = None,
     ):
-        """Create a consumer thread."""
+        """Create a consumer thread.
+
+        Args:
+            max_inflight_uploads: Number of batches uploaded concurrently by the consumer, see `_run_pipelined`.
+            drain: Set while the queue is flushed, the consumer then keeps uploading even if the circuit breaker is open.
+            exporter: Destination of the batches, uploads them to the API with `client` by default.
+            on_batch: Called with the time in seconds the oldest event of each batch waited in the queue.
+            retire: Called once the consumer was idle for `idle_timeout` seconds. The consumer stops if it returns True.
+        """
         threading.Thread.__init__(self)
         # Make consumer a daemon thread so that it doesn't block program exit
         self.daemon = True
@@ -80,6 +776,7 @@ class Consumer(threading.Thread):
         self.running = True
         self._identifier = identifier
         self._client = client
+        self._exporter = exporter or HTTPExporter(client)
         self._flush_at = flush_at
         self._flush_interval = flush_interval
         self._max_retries = max_retries
@@ -87,105 +784,410 @@ class Consumer(threading.Thread):
         self._sdk_name = sdk_name
         self._sdk_version = sdk_version
         self._sdk_integration = sdk_integration
+        self._spill = spill
+        self._dead_letter_handler = dead_letter_handler
+        self._coalesce = coalesce
+        self._batch_controller = (
+            BatchController(flush_at) if adaptive_batching else None
+        )
+        self._on_batch = on_batch
+        self._retire = retire
+        self._idle_timeout = idle_timeout
+        self._idle_since: Optional[float] = None
+        self._max_inflight_uploads = max_inflight_uploads
+        self._rate_limiter = rate_limiter
+        self._circuit_breaker = circuit_breaker
+        self._drain = drain or threading.Event()
+
+    def _next(self, block: bool = True):
+        """Return the next batch of items to upload.
 
-    def _next(self):
-        """Return the next batch of items to upload."""
+        Args:
+            block: Wait for events up to `flush_interval`. Otherwise only the events that
+                are already queued are taken, and the batch may be empty.
+        """
         queue = self._queue
         items = []
+        flush_at = self._flush_at
+        item = None
 
-        start_time = time.monotonic()
-        total_size = 0
+        if self._batch_controller is not None:
+            # sleep until the next event instead of polling an idle queue,
+            # unless spilled events are waiting to be replayed
+            idle_timeout = (
+                self._flush_interval
+                if self._spill is not None and len(self._spill) > 0
+                else self._idle_timeout
+                if self._retire is not None
+                else None
+            )
+            if not block:
+                idle_timeout = 0
+            item = queue.get_event(idle_timeout, cancelled=lambda: not self.running)
+            if item is None:
+                return items
 
-        while len(items) < self._flush_at:
-            elapsed = time.monotonic() - start_time
-            if elapsed >= self._flush_interval:
-                break
-            try:
-                item = queue.get(block=True, timeout=self._flush_interval - elapsed)
-                item_size = len(json.dumps(item, cls=EventSerializer).encode())
-                self._log.debug(f"item size {item_size}")
-                if item_size > MAX_MSG_SIZE:
-                    self._log.warning(
-                        "Item exceeds size limit (size: %s), dropping input/output of item.",
-                        item_size,
-                    )
+            flush_at = self._batch_controller.batch_size
 
-                    # for large events, drop input / output within the body
-                    if "body" in item and "input" in item["body"]:
-                        item["body"]["input"] = None
-                    if "body" in item and "output" in item["body"]:
-                        item["body"]["output"] = None
-
-                    # if item does not have body or input/output fields, drop the event
-                    if "body" not in item or (
-                        "input" not in item["body"] and "output" not in item["body"]
-                    ):
-                        self._log.warning(
-                            "Item does not have body or input/output fields, dropping item."
-                        )
-                        self._queue.task_done()
-                        continue
+        start_time = time.monotonic()
+        total_size = 0
 
-                    # need to calculate the size again after dropping input/output
-                    item_size = len(json.dumps(item, cls=EventSerializer).encode())
-                    self._log.debug(
-                        f"item size after dropping input/output {item_size}"
+        while len(items) < flush_at:
+            if item is None:
+                elapsed = time.monotonic() - start_time
+                if elapsed >= self._flush_interval:
+                    break
+                try:
+                    item = queue.get(
+                        block=block, timeout=self._flush_interval - elapsed
                     )
-
-                items.append(item)
-                total_size += item_size
-                if total_size >= BATCH_SIZE_LIMIT:
-                    self._log.debug("hit batch size limit (size: %d)", total_size)
+                except Empty:
                     break
 
-            except Empty:
+            if not enforce_size_limit(item, self._log):
+                self._queue.task_done()
+                item = None
+                continue
+
+            items.append(item)
+            item = None
+            total_size += len(items[-1].data)
+            if total_size >= BATCH_SIZE_LIMIT:
+                self._log.debug("hit batch size limit (size: %d)", total_size)
                 break
+
         self._log.debug("~%d items in the Langfuse queue", self._queue.qsize())
 
+        if self._batch_controller is not None:
+            self._batch_controller.record_batch(len(items), queue.qsize())
+
+        if self._coalesce:
+            batch = coalesce_events(items)
+            # merged events are acknowledged together with the event they were merged into
+            for _ in range(len(items) - len(batch)):
+                self._queue.task_done()
+
+            if len(batch) < len(items):
+                self._log.debug("coalesced %d items into %d", len(items), len(batch))
+
+            return batch
+
         return items
 
     def run(self):
         """Runs the consumer."""
         self._log.debug("consumer is running...")
+        if self._max_inflight_uploads > 1:
+            asyncio.run(self._run_pipelined())
+            return
+
         while self.running:
             self.upload()
 
     def upload(self):
         """Upload the next batch of items, return whether successful."""
-        batch = self._next()
-        if len(batch) == 0:
+        if self._circuit_open():
+            # leave events in the queue, where the backpressure policy applies
+            self._drain.wait(self._circuit_breaker.remaining_open_time())
             return
 
+        batch = self._next()
+
+        if len(batch) > 0:
+            self._start_upload(batch)
+            try:
+                start_time = time.monotonic()
+                undelivered = self._upload_batch(batch)
+                self._finish_upload(batch, undelivered, time.monotonic() - start_time)
+            finally:
+                # mark items as acknowledged from queue
+                for _ in batch:
+                    self._queue.task_done()
+
+        elif self._retire is not None:
+            self._retire_if_idle()
+
+        if self._spill is not None and len(self._spill) > 0:
+            self._replay_spill()
+
+    def _start_upload(self, batch: List[QueuedEvent]):
+        self._idle_since = None
+        if self._on_batch is not None:
+            self._on_batch(time.monotonic() - batch[0].enqueued_at)
+
+    def _finish_upload(
+        self, batch: List[QueuedEvent], undelivered: List[QueuedEvent], latency: float
+    ):
+        if self._batch_controller is not None:
+            self._batch_controller.record_upload(latency)
+
+        self._spill_batch(undelivered)
+
+    async def _run_pipelined(self):
+        """Upload up to `max_inflight_uploads` batches concurrently on a private event loop.
+
+        The uploads share one async session, which multiplexes them on a single connection
+        if HTTP/2 is enabled. While uploads are in flight, the consumer only takes full
+        batches of events that are already queued, so it never blocks the loop waiting
+        for events, and replays spilled events asynchronously as well. A
+        batch with events of an observation that is part of an in-flight batch is held
+        back until that upload finished, so the events of an observation arrive in order.
+        """
+        exporter = self._exporter.clone_for_event_loop()
+        inflight: Set[asyncio.Task] = set()
+        inflight_ids: Counter = Counter()
+
         try:
-            self._upload_batch(batch)
-        except Exception as e:
-            self._log.exception("error uploading: %s", e)
+            while self.running:
+                if not inflight and self._circuit_open():
+                    await asyncio.sleep(
+                        min(self._circuit_breaker.remaining_open_time(), 0.1)
+                    )
+                    continue
+
+                batch_size = (
+                    self._batch_controller.batch_size
+                    if self._batch_controller is not None
+                    else self._flush_at
+                )
+                if inflight and (
+                    len(inflight) >= self._max_inflight_uploads
+                    or self._queue.qsize() < batch_size
+                ):
+                    await asyncio.wait(
+                        inflight,
+                        timeout=PIPELINE_POLL_INTERVAL,
+                        return_when=asyncio.FIRST_COMPLETED,
+                    )
+                    continue
+
+                # another consumer may have taken the events in the meantime
+                batch = self._next(block=not inflight)
+                if len(batch) == 0:
+                    if inflight:
+                        await asyncio.wait(
+                            inflight,
+                            timeout=PIPELINE_POLL_INTERVAL,
+                            return_when=asyncio.FIRST_COMPLETED,
+                        )
+                        continue
+                    if self._retire is not None:
+                        self._retire_if_idle()
+                    if self._spill is not None and len(self._spill) > 0:
+                        await self._replay_spill_async(exporter)
+                    continue
+
+                ids = {item.body_id for item in batch} - {None}
+                while inflight and any(inflight_ids[id] for id in ids):
+                    await asyncio.wait(inflight, return_when=asyncio.FIRST_COMPLETED)
+
+                inflight_ids.update(ids)
+                self._start_upload(batch)
+                task = asyncio.ensure_future(
+                    self._upload_pipelined(exporter, batch, ids, inflight_ids)
+                )
+                inflight.add(task)
+                task.add_done_callback(inflight.discard)
         finally:
-            # mark items as acknowledged from queue
+            await asyncio.gather(*inflight, return_exceptions=True)
+            await exporter.aclose()
+
+    async def _upload_pipelined(
+        self,
+        exporter: Exporter,
+        batch: List[QueuedEvent],
+        ids: Set[str],
+        inflight_ids: Counter,
+    ):
+        try:
+            start_time = time.monotonic()
+            undelivered = await self._upload_batch_async(exporter, batch)
+            self._finish_upload(batch, undelivered, time.monotonic() - start_time)
+        finally:
+            inflight_ids.subtract(ids)
             for _ in batch:
                 self._queue.task_done()
 
+    def _retire_if_idle(self):
+        now = time.monotonic()
+        if self._idle_since is None:
+            self._idle_since = now
+        elif now - self._idle_since >= self._idle_timeout and self._retire(self):
+            self._log.debug("retiring idle consumer %d", self._identifier)
+            self.running = False
+
+    def _spill_batch(self, batch: List[QueuedEvent]):
+        """Keep events that failed with a transient error on disk instead of dropping them."""
+        if self._spill is None or len(batch) == 0:
+            return
+
+        if self._spill.append([item.data for item in batch]):
+            self._log.warning("spilled batch of %d items to disk", len(batch))
+
+    def _replay_spill(self):
+        """Upload the next batch of events from the spill queue, in the order they were spilled."""
+        batch = self._read_spill()
+        if batch is not None:
+            self._settle_spill(batch, self._upload_batch(batch) if batch else [])
+
+    async def _replay_spill_async(self, exporter: Exporter):
+        """Async counterpart of `_replay_spill` for pipelined uploads."""
+        batch = self._read_spill()
+        if batch is not None:
+            undelivered = (
+                await self._upload_batch_async(exporter, batch) if batch else []
+            )
+            self._settle_spill(batch, undelivered)
+
+    def _read_spill(self) -> Optional[List[QueuedEvent]]:
+        records = self._spill.read(self._flush_at, BATCH_SIZE_LIMIT)
+        if len(records) == 0:
+            return None
+
+        batch = [QueuedEvent(data=record) for record in records]
+        return [item for item in batch if enforce_size_limit(item, self._log)]
+
+    def _settle_spill(self, batch: List[QueuedEvent], undelivered: List[QueuedEvent]):
+        if undelivered and len(undelivered) == len(batch):
+            # nothing was delivered, keep the events in place to preserve their order
+            self._spill.release()
+            return
+
+        self._spill.ack()
+        self._spill_batch(undelivered)
+
     def pause(self):
         """Pause the consumer."""
         self.running = False
+        self._drain.set()
+        # wakes up the consumer if it sleeps on an idle queue
+        self._queue.interrupt()
 
-    def _upload_batch(self, batch: List[Any]):
-        self._log.debug("uploading batch of %d items", len(batch))
-
-        metadata = LangfuseMetadata(
-            batch_size=len(batch),
+    def _metadata(self, batch_size: int) -> dict:
+        return LangfuseMetadata(
+            batch_size=batch_size,
             sdk_integration=self._sdk_integration,
             sdk_name=self._sdk_name,
             sdk_version=self._sdk_version,
             public_key=self._public_key,
         ).dict()
 
-        @backoff.on_exception(backoff.expo, Exception, max_tries=self._max_retries)
-        def execute_task_with_backoff(batch: List[Any]):
-            return self._client.batch_post(batch=batch, metadata=metadata)
+    def _upload_batch(self, batch: List[QueuedEvent]) -> List[QueuedEvent]:
+        """Upload a batch, return the events that could not be delivered."""
+        # events are sent as their pre-encoded payloads, see QueuedEvent
+        return upload_with_retries(
+            lambda pending: self._exporter.export(
+                [item.data for item in pending], self._metadata(len(pending))
+            ),
+            batch,
+            self._max_retries,
+            self._dead_letter,
+            self._log,
+            before_attempt=self._prepare_request,
+            after_attempt=self._after_request,
+        )
 
-        execute_task_with_backoff(batch)
-        self._log.debug("successfully uploaded batch of %d items", len(batch))
+    async def _upload_batch_async(
+        self, exporter: Exporter, batch: List[QueuedEvent]
+    ) -> List[QueuedEvent]:
+        """Async counterpart of `_upload_batch` for pipelined uploads."""
+        return await async_upload_with_retries(
+            lambda pending: exporter.async_export(
+                [item.data for item in pending], self._metadata(len(pending))
+            ),
+            batch,
+            self._max_retries,
+            self._dead_letter,
+            self._log,
+            before_attempt=self._prepare_request_async,
+            after_attempt=self._after_request,
+        )
+
+    def _prepare_request(self, batch: List[QueuedEvent]):
+        """Wait for the circuit breaker and the rate limiter before sending `batch`."""
+        self._wait_for_circuit()
+        self._drain.wait(self._before_request(batch))
+
+    async def _prepare_request_async(self, batch: List[QueuedEvent]):
+        """Async counterpart of `_prepare_request` for pipelined uploads."""
+        await self._wait_for_circuit_async()
+        await self._wait_async(self._before_request(batch))
+
+    def _circuit_open(self) -> bool:
+        return (
+            self._circuit_breaker is not None
+            and self._circuit_breaker.is_open
+            and not self._drain.is_set()
+        )
+
+    def _wait_for_circuit(self):
+        """Hold a batch until the circuit breaker lets a request through.
+
+        While the circuit is open, or another consumer sends the trial request, the batch
+        waits instead of failing, so it is neither dropped nor retried in a tight loop.
+        While the queue is flushed, batches are sent right away.
+        """
+        while self._circuit_breaker is not None and not self._drain.is_set():
+            try:
+                self._circuit_breaker.before_request()
+                return
+            except CircuitOpenError as e:
+                self._drain.wait(max(e.retry_after, CIRCUIT_POLL_INTERVAL))
+
+    async def _wait_for_circuit_async(self):
+        """Async counterpart of `_wait_for_circuit` for pipelined uploads."""
+        while self._circuit_breaker is not None and not self._drain.is_set():
+            try:
+                self._circuit_breaker.before_request()
+                return
+            except CircuitOpenError as e:
+                await self._wait_async(max(e.retry_after, CIRCUIT_POLL_INTERVAL))
+
+    async def _wait_async(self, seconds: float):
+        """Async counterpart of `self._drain.wait`, polls so that a flush cuts the wait short."""
+        deadline = time.monotonic() + seconds
+        while not self._drain.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            await asyncio.sleep(min(remaining, CIRCUIT_POLL_INTERVAL))
+
+    def _before_request(self, batch: List[QueuedEvent]) -> float:
+        """Return the number of seconds to wait before sending `batch`.
+
+        The wait is cut short while the queue is flushed.
+        """
+        if self._rate_limiter is None:
+            return 0.0
+
+        return self._rate_limiter.reserve(sum(len(item.data) for item in batch))
+
+    def _after_request(self, error: Optional[Exception]):
+        retry_after = getattr(error, "retry_after", None)
+        if retry_after is not None and self._rate_limiter is not None:
+            self._rate_limiter.defer(retry_after)
+
+        if self._circuit_breaker is None:
+            return
+
+        # the API is available if it processed the request, even if it rejected events
+        if (
+            error is not None
+            and not isinstance(error, APIErrors)
+            and is_retryable(error)
+        ):
+            self._circuit_breaker.record_failure()
+        else:
+            self._circuit_breaker.record_success()
+
+    def _dead_letter(self, items: List[QueuedEvent], error: Exception):
+        if len(items) == 0:
+            return
+
+        try:
+            self._dead_letter_handler([item.decoded() for item in items], error)
+        except Exception as e:
+            self._log.exception("error in dead-letter handler: %s", e)
 
 
 class TaskManager(object):
@@ -194,7 +1196,7 @@ class TaskManager(object):
     _enabled: bool
     _threads: int
     _max_task_queue_size: int
-    _queue: Queue
+    _queue: EventQueue
     _client: LangfuseClient
     _flush_at: int
     _flush_interval: float
@@ -203,6 +1205,8 @@ class TaskManager(object):
     _sdk_name: str
     _sdk_version: str
     _sdk_integration: str
+    _spill: Optional[SpillQueue]
+    trace_buffers: TraceBuffers
 
     def __init__(
         self,
@@ -217,12 +1221,43 @@ class TaskManager(object):
         sdk_integration: str,
         enabled: bool = True,
         max_task_queue_size: int = 100_000,
+        spill_directory: Optional[str] = None,
+        max_spill_bytes: int = 256_000_000,
+        dead_letter_handler: Optional[DeadLetterHandler] = None,
+        coalesce_events: bool = True,
+        adaptive_batching: bool = False,
+        backpressure_policy: BackpressurePolicy = "drop_newest",
+        max_queue_bytes: Optional[int] = None,
+        queue_block_timeout: float = 1.0,
+        max_threads: Optional[int] = None,
+        max_inflight_uploads: int = 1,
+        max_requests_per_second: Optional[float] = None,
+        max_bytes_per_second: Optional[float] = None,
+        circuit_breaker_threshold: Optional[int] = 5,
+        exporter: Optional[Exporter] = None,
+        deferred_serialization: bool = False,
     ):
+        if backpressure_policy not in BACKPRESSURE_POLICIES:
+            raise ValueError(
+                f"Invalid backpressure policy {backpressure_policy!r}, expected one of {BACKPRESSURE_POLICIES}"
+            )
+
         self._max_task_queue_size = max_task_queue_size
         self._threads = threads
-        self._queue = queue.Queue(self._max_task_queue_size)
+        # consumers are added up to `max_threads` under load and retired when idle
+        self._max_threads = max(threads, max_threads or threads)
+        self._scaling_lock = threading.Lock()
+        self._last_scale_up = 0.0
+        self._joining = False
+        self._next_identifier = 0
+        self._queue = EventQueue(self._max_task_queue_size, max_queue_bytes or 0)
+        self._backpressure_policy = backpressure_policy
+        self._queue_block_timeout = queue_block_timeout
+        self._dropped = Counter()
+        self._dropped_lock = threading.Lock()
         self._consumers = []
         self._client = client
+        self._exporter = exporter or HTTPExporter(client)
         self._flush_at = flush_at
         self._flush_interval = flush_interval
         self._max_retries = max_retries
@@ -231,6 +1266,31 @@ class TaskManager(object):
         self._sdk_version = sdk_version
         self._sdk_integration = sdk_integration
         self._enabled = enabled
+        self._dead_letter_handler = dead_letter_handler or log_dead_letters
+        self._coalesce_events = coalesce_events
+        self._deferred_serialization = deferred_serialization
+        self._adaptive_batching = adaptive_batching
+        self._max_inflight_uploads = max_inflight_uploads
+        # shared by all consumers, so that limits apply to the client as a whole
+        self._drain = threading.Event()
+        self._rate_limiter = RateLimiter(max_requests_per_second, max_bytes_per_second)
+        self._circuit_breaker = (
+            CircuitBreaker(circuit_breaker_threshold)
+            if circuit_breaker_threshold
+            else None
+        )
+        # events that do not fit into the queue or failed to upload are kept on disk
+        self._spill = None
+        if spill_directory is not None and enabled:
+            try:
+                self._spill = SpillQueue(spill_directory, max_bytes=max_spill_bytes)
+            except SpillDirectoryInUseError as e:
+                self._log.warning(
+                    f"{e}, events are not spilled to disk. Use a separate directory for each process."
+                )
+
+        # events of traces that wait for the tail sampler
+        self.trace_buffers = TraceBuffers(self)
 
         self.init_resources()
 
@@ -238,45 +1298,149 @@ class TaskManager(object):
         atexit.register(self.join)
 
     def init_resources(self):
-        for i in range(self._threads):
-            consumer = Consumer(
-                queue=self._queue,
-                identifier=i,
-                client=self._client,
-                flush_at=self._flush_at,
-                flush_interval=self._flush_interval,
-                max_retries=self._max_retries,
-                public_key=self._public_key,
-                sdk_name=self._sdk_name,
-                sdk_version=self._sdk_version,
-                sdk_integration=self._sdk_integration,
+        for _ in range(self._threads):
+            self._start_consumer()
+
+    def _start_consumer(self):
+        autoscaling = self._max_threads > self._threads
+        consumer = Consumer(
+            queue=self._queue,
+            identifier=self._next_identifier,
+            client=self._client,
+            flush_at=self._flush_at,
+            flush_interval=self._flush_interval,
+            max_retries=self._max_retries,
+            public_key=self._public_key,
+            sdk_name=self._sdk_name,
+            sdk_version=self._sdk_version,
+            sdk_integration=self._sdk_integration,
+            spill=self._spill,
+            dead_letter_handler=self._dead_letter_handler,
+            coalesce=self._coalesce_events,
+            adaptive_batching=self._adaptive_batching,
+            on_batch=self._scale_up if autoscaling else None,
+            retire=self._retire if autoscaling else None,
+            idle_timeout=SCALE_DOWN_IDLE_TIME,
+            max_inflight_uploads=self._max_inflight_uploads,
+            rate_limiter=self._rate_limiter,
+            circuit_breaker=self._circuit_breaker,
+            drain=self._drain,
+            exporter=self._exporter,
+        )
+        self._next_identifier += 1
+        consumer.start()
+        self._consumers.append(consumer)
+
+    def _scale_up(self, lag: float):
+        """Add a consumer if events wait too long or the queue is too deep."""
+        backlogged = (
+            lag > self._flush_interval + SCALE_UP_LAG
+            or self._queue.qsize() > SCALE_UP_QUEUE_BATCHES * self._flush_at
+        )
+        if not backlogged:
+            return
+
+        with self._scaling_lock:
+            now = time.monotonic()
+            # give a new consumer one flush interval to take effect
+            if (
+                len(self._consumers) >= self._max_threads
+                or now - self._last_scale_up < self._flush_interval
+                or self._joining
+            ):
+                return
+
+            self._last_scale_up = now
+            self._start_consumer()
+            self._log.debug(
+                "added consumer thread (lag: %.2fs), %d running",
+                lag,
+                len(self._consumers),
             )
-            consumer.start()
-            self._consumers.append(consumer)
+
+    def _retire(self, consumer: Consumer) -> bool:
+        """Remove an idle consumer if more than `threads` consumers are running."""
+        with self._scaling_lock:
+            if len(self._consumers) <= self._threads or consumer not in self._consumers:
+                return False
+
+            self._consumers.remove(consumer)
+            return True
 
     def add_task(self, event: dict):
         if not self._enabled:
             return
 
+        if self.trace_buffers.hold(event):
+            return
+
         try:
-            json.dumps(event, cls=EventSerializer)
             event["timestamp"] = datetime.utcnow().replace(tzinfo=timezone.utc)
 
-            self._queue.put(event, block=False)
-        except queue.Full:
-            self._log.warning("analytics-python queue is full")
-            return False
+            if self._deferred_serialization:
+                # encoded by the consumer thread
+                item = QueuedEvent.snapshot(event)
+            else:
+                # Encoding also validates the event; the payload is reused downstream
+                item = QueuedEvent(event)
+            dropped = self._queue.put_event(
+                item, self._backpressure_policy, self._queue_block_timeout
+            )
         except Exception as e:
             self._log.exception(f"Exception in adding task {e}")
 
             return False
 
+        if dropped:
+            self._drop(dropped)
+
+            if item in dropped:
+                return False
+
+    def _drop(self, items: List[QueuedEvent]):
+        """Keep events rejected by the backpressure policy on disk or count them as dropped."""
+        if self._spill is not None and self._spill.append(
+            [i.data for i in items if enforce_size_limit(i, self._log)]
+        ):
+            return
+
+        with self._dropped_lock:
+            self._dropped[self._backpressure_policy] += len(items)
+
+        self._log.warning(
+            "analytics-python queue is full, dropped %d events (policy: %s)",
+            len(items),
+            self._backpressure_policy,
+        )
+
+    def dropped_events(self) -> Dict[str, int]:
+        """Return the number of events dropped on a full queue, per backpressure policy."""
+        with self._dropped_lock:
+            return dict(self._dropped)
+
     def flush(self):
         """Forces a flush from the internal queue to the server"""
         self._log.debug("flushing queue")
         queue = self._queue
         size = queue.qsize()
-        queue.join()
+
+        # consumers waiting for the circuit breaker or the rate limiter upload right away
+        self._drain.set()
+        try:
+            queue.join()
+
+            # wait for the consumers to replay spilled events as long as they make progress
+            while self._spill is not None and len(self._spill) > 0:
+                if not self._spill.wait_for_progress(timeout=self._client._timeout):
+                    self._log.warning(
+                        "%d events remain in the spill queue and are replayed later.",
+                        len(self._spill),
+                    )
+                    break
+        finally:
+            if not self._joining:
+                self._drain.clear()
+
         # Note that this message may not be precise, because of threading.
         self._log.debug("successfully flushed about %s items.", size)
 
@@ -284,8 +1448,12 @@ class TaskManager(object):
         """Ends the consumer threads once the queue is empty.
         Blocks execution until finished
         """
-        self._log.debug(f"joining {len(self._consumers)} consumer threads")
-        for consumer in self._consumers:
+        with self._scaling_lock:
+            self._joining = True
+            consumers = list(self._consumers)
+
+        self._log.debug(f"joining {len(consumers)} consumer threads")
+        for consumer in consumers:
             consumer.pause()
             try:
                 consumer.join()
@@ -295,6 +1463,11 @@ class TaskManager(object):
 
             self._log.debug(f"consumer thread {consumer._identifier} joined")
 
+        if self._spill is not None:
+            self._spill.close()
+
+        self._exporter.shutdown()
+
     def shutdown(self):
         """Flush all messages and cleanly shutdown the client"""
         self._log.debug("shutdown initiated")
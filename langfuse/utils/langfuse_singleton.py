@@ -1,9 +1,10 @@
 import httpx
 import threading
-from typing import Optional
+from typing import Callable, Dict, Literal, Optional
 
 
 from langfuse import Langfuse
+from langfuse.request import Compression
 
 
 class LangfuseSingleton:
@@ -32,8 +33,13 @@ class LangfuseSingleton:
         max_retries: Optional[int] = None,
         timeout: Optional[int] = None,
         httpx_client: Optional[httpx.Client] = None,
+        async_httpx_client_factory: Optional[Callable[[], httpx.AsyncClient]] = None,
         sdk_integration: Optional[str] = None,
         enabled: Optional[bool] = None,
+        compression: Optional[Compression] = None,
+        ingestion_engine: Optional[Literal["threads", "asyncio"]] = None,
+        sample_rate: Optional[float] = None,
+        sample_rate_overrides: Optional[Dict[str, float]] = None,
     ) -> Langfuse:
         if self._langfuse:
             return self._langfuse
@@ -54,8 +60,13 @@ class LangfuseSingleton:
                 "max_retries": max_retries,
                 "timeout": timeout,
                 "httpx_client": httpx_client,
+                "async_httpx_client_factory": async_httpx_client_factory,
                 "sdk_integration": sdk_integration,
                 "enabled": enabled,
+                "compression": compression,
+                "ingestion_engine": ingestion_engine,
+                "sample_rate": sample_rate,
+                "sample_rate_overrides": sample_rate_overrides,
             }
 
             self._langfuse = Langfuse(
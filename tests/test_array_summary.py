@@ -0,0 +1,58 @@
+import json
+
+import pytest
+
+from langfuse import array_summary
+from langfuse.array_summary import FullData
+from langfuse.serializer import EventSerializer, serialize_event
+
+np = pytest.importorskip("numpy")
+
+
+def test_arrays_are_summarized():
+    embeddings = np.arange(1_000_000, dtype=np.float32).reshape(1_000, 1_000)
+
+    result = json.loads(serialize_event({"embeddings": embeddings}))
+
+    assert result["embeddings"] == {
+        "type": "numpy.ndarray",
+        "shape": [1_000, 1_000],
+        "dtype": "float32",
+        "head": [0.0, 1.0, 2.0],
+        "tail": [999_997.0, 999_998.0, 999_999.0],
+    }
+
+
+def test_array_stats(monkeypatch):
+    monkeypatch.setattr(array_summary, "compute_stats", True)
+
+    result = json.loads(json.dumps(np.array([1.0, np.nan, 3.0]), cls=EventSerializer))
+
+    assert result["stats"] == {"min": 1.0, "max": 3.0, "mean": 2.0, "std": 1.0}
+
+
+def test_numpy_scalars_and_full_data():
+    result = json.loads(
+        serialize_event(
+            {
+                "count": np.int64(3),
+                "flag": np.bool_(True),
+                "ids": FullData(np.arange(4)),
+            }
+        )
+    )
+
+    assert result == {"count": 3, "flag": True, "ids": [0, 1, 2, 3]}
+
+
+def test_dataframes_are_summarized():
+    pd = pytest.importorskip("pandas")
+    frame = pd.DataFrame({"id": range(100), "score": [i / 100 for i in range(100)]})
+
+    result = json.loads(serialize_event({"frame": frame, "ids": frame["id"]}))
+
+    assert result["frame"]["shape"] == [100, 2]
+    assert result["frame"]["columns"] == {"id": "int64", "score": "float64"}
+    assert result["frame"]["head"][0] == {"id": 0, "score": 0.0}
+    assert result["frame"]["tail"][-1] == {"id": 99, "score": 0.99}
+    assert result["ids"]["head"] == [0, 1, 2]
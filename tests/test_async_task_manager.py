@@ -0,0 +1,144 @@
+import asyncio
+import httpx
+import pytest
+from pytest_httpserver import HTTPServer
+from werkzeug.wrappers import Request, Response
+
+from langfuse import Langfuse
+from langfuse.async_task_manager import AsyncTaskManager
+from langfuse.request import LangfuseClient
+from tests.test_task_manager import get_host
+
+
+def setup_async_task_manager(httpserver: HTTPServer, **kwargs):
+    langfuse_client = LangfuseClient(
+        "public_key",
+        "secret_key",
+        get_host(httpserver.url_for("/api/public/ingestion")),
+        "1.0.0",
+        15,
+        httpx.Client(),
+    )
+
+    return AsyncTaskManager(
+        langfuse_client,
+        kwargs.pop("flush_at", 10),
+        0.1,
+        3,
+        "public_key",
+        "test-sdk",
+        "1.0.0",
+        "default",
+        **kwargs,
+    )
+
+
+@pytest.mark.asyncio
+@pytest.mark.timeout(10)
+async def test_async_flush(httpserver: HTTPServer):
+    received = []
+
+    def handler(request: Request):
+        received.extend(request.json["batch"])
+        return Response(status=200)
+
+    httpserver.expect_request(
+        "/api/public/ingestion", method="POST"
+    ).respond_with_handler(handler)
+
+    tm = setup_async_task_manager(httpserver)
+
+    tm.add_task({"foo": "bar"})
+    tm.add_task({"foo": "bar"})
+    tm.add_task({"foo": "bar"})
+
+    await tm.async_flush()
+
+    assert [event["foo"] for event in received] == ["bar", "bar", "bar"]
+    assert tm._queue.empty()
+
+    await tm.async_shutdown()
+
+
+@pytest.mark.asyncio
+@pytest.mark.timeout(10)
+async def test_concurrent_uploads(httpserver: HTTPServer):
+    in_flight = 0
+    max_in_flight = 0
+    uploaded = 0
+
+    async def batch_post(**kwargs):
+        nonlocal in_flight, max_in_flight, uploaded
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.2)
+        in_flight -= 1
+        uploaded += len(kwargs["batch"])
+
+    tm = setup_async_task_manager(httpserver, flush_at=1, max_concurrent_uploads=3)
+    tm._client.async_batch_post = batch_post
+
+    for _ in range(6):
+        tm.add_task({"foo": "bar"})
+
+    await tm.async_flush()
+
+    assert uploaded == 6
+    assert max_in_flight == 3
+
+    await tm.async_shutdown()
+
+
+@pytest.mark.timeout(10)
+def test_add_task_from_other_thread(httpserver: HTTPServer):
+    received = []
+
+    def handler(request: Request):
+        received.extend(request.json["batch"])
+        return Response(status=200)
+
+    httpserver.expect_request(
+        "/api/public/ingestion", method="POST"
+    ).respond_with_handler(handler)
+
+    tm = setup_async_task_manager(httpserver)
+
+    async def main():
+        tm.add_task({"foo": "loop"})
+
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, tm.add_task, {"foo": "thread"})
+        await tm.async_flush()
+
+    asyncio.run(main())
+
+    assert sorted(event["foo"] for event in received) == ["loop", "thread"]
+
+
+@pytest.mark.timeout(10)
+def test_leftovers_are_uploaded_without_event_loop(httpserver: HTTPServer):
+    received = []
+
+    def handler(request: Request):
+        received.extend(request.json["batch"])
+        return Response(status=200)
+
+    httpserver.expect_request(
+        "/api/public/ingestion", method="POST"
+    ).respond_with_handler(handler)
+
+    tm = setup_async_task_manager(httpserver)
+
+    tm.add_task({"foo": "bar"})
+    tm.flush()
+
+    assert [event["foo"] for event in received] == ["bar"]
+
+
+@pytest.mark.asyncio
+async def test_langfuse_selects_async_engine():
+    langfuse = Langfuse(
+        public_key="pk", secret_key="sk", ingestion_engine="asyncio", debug=False
+    )
+
+    assert isinstance(langfuse.task_manager, AsyncTaskManager)
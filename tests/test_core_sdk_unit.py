@@ -1,4 +1,5 @@
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
+import httpx
 from langfuse.api.client import FernLangfuse
 from langfuse.client import (
     StatefulClient,
@@ -82,3 +83,32 @@ def test_stateful_client_returning_if_taskmanager_fails(
     mock_task_manager.assert_called()
 
     assert isinstance(result, expected_client)
+
+
+@pytest.mark.parametrize(
+    "kwargs, warns",
+    [
+        ({"max_inflight_uploads": 2}, True),
+        ({"ingestion_engine": "asyncio"}, True),
+        (
+            {
+                "max_inflight_uploads": 2,
+                "async_httpx_client_factory": httpx.AsyncClient,
+            },
+            False,
+        ),
+        ({}, False),
+    ],
+)
+def test_custom_httpx_client_warns_about_async_uploads(kwargs, warns):
+    with patch.object(Langfuse, "log") as log:
+        langfuse = Langfuse(
+            public_key="pk", secret_key="sk", httpx_client=httpx.Client(), **kwargs
+        )
+        langfuse.shutdown()
+
+    warned = any(
+        "async_httpx_client_factory" in call.args[0]
+        for call in log.warning.call_args_list
+    )
+    assert warned is warns
@@ -1,4 +1,5 @@
 import asyncio
+import inspect
 from contextvars import ContextVar
 from collections import defaultdict
 from concurrent.futures import ThreadPoolExecutor
@@ -8,8 +9,14 @@ from langchain_community.chat_models import ChatOpenAI
 from langchain.prompts import ChatPromptTemplate
 from langfuse.openai import AsyncOpenAI
 from langfuse.decorators import langfuse_context, observe
+from langfuse.decorators.langfuse_decorator import (
+    _observation_stack_context,
+    _observation_states,
+)
+from langfuse.sampling import TailSampler
 from tests.utils import create_uuid, get_api, get_llama_index_index
 from typing import Optional
+from unittest.mock import patch
 
 mock_metadata = "mock_metadata"
 mock_deep_metadata = "mock_deep_metadata"
@@ -1091,3 +1098,106 @@ def test_manual_context_copy_in_threadpoolexecutor():
         assert (
             observation.parent_observation_id is None
         )  # Ensure that the observations are not nested
+
+
+def test_function_signature_is_inspected_at_decoration_time():
+    mock_trace_id = create_uuid()
+
+    with patch(
+        "langfuse.decorators.langfuse_decorator.inspect.signature",
+        wraps=inspect.signature,
+    ) as signature:
+
+        @observe()
+        def add(a, b):
+            return a + b
+
+        for _ in range(3):
+            add(1, 2, langfuse_observation_id=mock_trace_id)
+
+    langfuse_context.flush()
+
+    assert signature.call_count == 1
+    assert get_api().trace.get(mock_trace_id).input == {"args": [1, 2], "kwargs": {}}
+
+
+def test_large_input_is_truncated_when_captured():
+    mock_trace_id = create_uuid()
+
+    @observe()
+    def summarize(document):
+        return document[:10]
+
+    summarize("x" * 2_000_000, langfuse_observation_id=mock_trace_id)
+
+    langfuse_context.flush()
+
+    trace_input = get_api().trace.get(mock_trace_id).input
+    assert trace_input["args"][0].endswith("...[truncated, 2000000 chars]")
+    assert len(trace_input["args"][0]) < 1_000_000
+
+
+def test_streamed_generation_output_is_bounded():
+    mock_trace_id = create_uuid()
+
+    @observe(as_type="generation", max_stream_bytes=20)
+    def stream():
+        for i in range(1_000):
+            yield f"{i % 10}"
+
+    @observe()
+    def main(**kwargs):
+        return "".join(stream())
+
+    main(langfuse_observation_id=mock_trace_id)
+    langfuse_context.flush()
+
+    generation = get_api().trace.get(mock_trace_id).observations[0]
+    assert generation.output == "0123456789...[truncated, 980 chars]...0123456789"
+    assert generation.start_time <= generation.completion_start_time
+    assert generation.completion_start_time <= generation.end_time
+
+
+def test_tail_sampling_drops_unsampled_traces():
+    kept_trace_id = create_uuid()
+    dropped_trace_id = create_uuid()
+
+    @observe()
+    def handle(fail):
+        if fail:
+            raise ValueError("failed")
+
+    langfuse_context._tail_sampler = TailSampler(0.0)
+    try:
+        with pytest.raises(ValueError):
+            handle(True, langfuse_observation_id=kept_trace_id)
+        handle(False, langfuse_observation_id=dropped_trace_id)
+    finally:
+        langfuse_context._tail_sampler = None
+
+    langfuse_context.flush()
+
+    assert get_api().trace.get(kept_trace_id).id == kept_trace_id
+    with pytest.raises(Exception):
+        get_api().trace.get(dropped_trace_id)
+
+
+def test_observation_state_is_released_after_the_call():
+    mock_trace_id = create_uuid()
+
+    @observe()
+    def level_2():
+        langfuse_context.update_current_observation(metadata={"level": 2})
+        return langfuse_context.get_current_trace_id()
+
+    @observe()
+    def level_1():
+        langfuse_context.update_current_trace(user_id="user-1")
+        return level_2()
+
+    assert level_1(langfuse_observation_id=mock_trace_id) == mock_trace_id
+    langfuse_context.flush()
+
+    assert len(_observation_states) == 0
+    assert _observation_stack_context.get() is None
+    assert get_api().trace.get(mock_trace_id).user_id == "user-1"
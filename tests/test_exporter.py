@@ -0,0 +1,89 @@
+import json
+import os
+
+import pytest
+import zstandard
+
+from langfuse import Langfuse
+from langfuse.exporter import FileExporter, InMemoryExporter
+from langfuse.task_manager import TaskManager
+from tests.test_task_manager import setup_langfuse_client
+
+
+def setup_task_manager(exporter, **kwargs):
+    return TaskManager(
+        setup_langfuse_client("http://localhost:3000"),
+        10,
+        0.1,
+        3,
+        1,
+        "public_key",
+        "test-sdk",
+        "1.0.0",
+        "default",
+        exporter=exporter,
+        **kwargs,
+    )
+
+
+def read_ndjson(path):
+    with open(path, "rb") as f:
+        data = f.read()
+
+    if path.endswith(".zst"):
+        data = zstandard.ZstdDecompressor().decompressobj().decompress(data)
+
+    return [json.loads(line) for line in data.splitlines()]
+
+
+@pytest.mark.timeout(10)
+def test_in_memory_exporter():
+    exporter = InMemoryExporter()
+    tm = setup_task_manager(exporter)
+
+    for i in range(25):
+        tm.add_task({"id": str(i), "type": "event-create", "body": {"name": i}})
+    tm.flush()
+
+    assert [event["body"]["name"] for event in exporter.events()] == list(range(25))
+    assert len(exporter.batches) >= 3
+
+
+@pytest.mark.timeout(10)
+@pytest.mark.parametrize("compression", [None, "zstd"])
+def test_file_exporter_rotates_files(tmp_path, compression):
+    exporter = FileExporter(str(tmp_path), max_file_bytes=500, compression=compression)
+    tm = setup_task_manager(exporter)
+
+    for i in range(50):
+        tm.add_task({"id": str(i), "type": "event-create", "body": {"name": i}})
+    tm.shutdown()
+
+    files = sorted(os.listdir(tmp_path))
+    assert len(files) > 1
+    assert not any(name.endswith(".part") for name in files)
+
+    events = [e for name in files for e in read_ndjson(str(tmp_path / name))]
+    assert [event["body"]["name"] for event in events] == list(range(50))
+
+
+def test_file_exporter_marks_incomplete_files(tmp_path):
+    exporter = FileExporter(str(tmp_path))
+    exporter.export([b'{"id": "1"}'], {})
+
+    [name] = os.listdir(tmp_path)
+    assert name.endswith(".ndjson.part")
+
+    exporter.shutdown()
+    [name] = os.listdir(tmp_path)
+    assert read_ndjson(str(tmp_path / name)) == [{"id": "1"}]
+
+
+def test_langfuse_without_keys_records_to_exporter():
+    exporter = InMemoryExporter()
+    langfuse = Langfuse(public_key=None, secret_key=None, exporter=exporter)
+
+    langfuse.trace(name="trace")
+    langfuse.flush()
+
+    assert [event["type"] for event in exporter.events()] == ["trace-create"]
@@ -0,0 +1,85 @@
+import time
+
+import pytest
+
+from langfuse.flow_control import (
+    MAX_RETRY_AFTER,
+    CircuitBreaker,
+    CircuitOpenError,
+    RateLimiter,
+    TokenBucket,
+    retry_after_expo,
+)
+from langfuse.request import APIError
+
+
+def test_token_bucket_delays_requests_beyond_rate():
+    bucket = TokenBucket(rate=10)
+
+    delays = [bucket.reserve() for _ in range(15)]
+
+    assert delays[:10] == [0] * 10
+    assert delays[14] == pytest.approx(0.5, abs=0.05)
+
+
+def test_rate_limiter_limits_bytes():
+    limiter = RateLimiter(max_bytes_per_second=1_000)
+
+    assert limiter.reserve(1_000) == 0
+    assert limiter.reserve(2_000) == pytest.approx(2, abs=0.05)
+
+
+def test_rate_limiter_defers_requests():
+    limiter = RateLimiter()
+
+    assert limiter.reserve(1_000) == 0
+
+    limiter.defer(5)
+    assert limiter.reserve(1_000) == pytest.approx(5, abs=0.05)
+
+
+def test_rate_limiter_caps_deferral():
+    limiter = RateLimiter()
+
+    limiter.defer(3_600)
+    assert limiter.reserve(1_000) == pytest.approx(MAX_RETRY_AFTER, abs=0.05)
+
+
+def test_retry_after_is_honored():
+    wait = retry_after_expo()
+    wait.send(None)
+
+    assert wait.send(APIError(429, "rate limited", retry_after=7)) == 7
+    assert 0 <= wait.send(APIError(500, "error")) <= 2
+    # excessive values fall back to exponential backoff
+    assert wait.send(APIError(503, "unavailable", retry_after=3_600)) <= 4
+
+
+def test_circuit_breaker():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=0.1)
+
+    for _ in range(2):
+        breaker.before_request()
+        breaker.record_failure()
+    assert not breaker.is_open
+
+    breaker.record_failure()
+    assert breaker.is_open
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request()
+
+    # a single trial request is let through once the timeout passed
+    time.sleep(0.1)
+    breaker.before_request()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request()
+
+    # a failed trial opens the circuit for longer
+    breaker.record_failure()
+    assert 0.1 < breaker.remaining_open_time() <= 0.2
+
+    time.sleep(0.2)
+    breaker.before_request()
+    breaker.record_success()
+    assert not breaker.is_open
+    breaker.before_request()
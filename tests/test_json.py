@@ -13,6 +13,7 @@ from pydantic import BaseModel
 
 import langfuse
 from langfuse.api.resources.commons.types.observation_level import ObservationLevel
+from langfuse import serializer
 from langfuse.serializer import EventSerializer
 
 
@@ -138,3 +139,155 @@ def test_mongo_cursor():
     result = json.dumps(test_id, cls=EventSerializer)
 
     assert isinstance(result, str)
+
+
+class Node:
+    def __init__(self, name):
+        self.name = name
+        self.parent = self
+
+
+class Slotted:
+    __slots__ = ("a", "b")
+
+    def __init__(self):
+        self.a = 1
+        self.b = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+@pytest.mark.parametrize(
+    "event",
+    [
+        {"id": "1", "timestamp": datetime(2024, 1, 1, 12, 30)},
+        {"date": date(2024, 1, 1), "id": uuid.uuid4(), "level": ObservationLevel.ERROR},
+        {"model": TestModel(foo="bar", bar=datetime(2021, 1, 1, tzinfo=timezone.utc))},
+        {"messages": [HumanMessage(content="I love programming! ü")]},
+        {"node": Node("root"), "slotted": Slotted(), "tags": {"a"}, 1: (1, 2)},
+        {"large": 2**70, "bytes": b"abc"},
+    ],
+)
+@pytest.mark.parametrize("backend", ["orjson", "json"])
+def test_serialize_event_backends_are_equivalent(monkeypatch, backend, event):
+    if backend == "orjson":
+        pytest.importorskip("orjson")
+    monkeypatch.setattr(serializer, "json_backend", backend)
+
+    assert json.loads(serializer.serialize_event(event)) == json.loads(
+        json.dumps(event, cls=EventSerializer)
+    )
+
+
+class Money:
+    def __init__(self, amount, currency):
+        self.amount = amount
+        self.currency = currency
+
+
+class Euro(Money):
+    def __init__(self, amount):
+        super().__init__(amount, "EUR")
+
+
+def test_registered_handlers_are_resolved_along_the_mro():
+    EventSerializer.register(Money, lambda m: f"{m.amount} {m.currency}")
+    try:
+        result = json.dumps(
+            {"price": Money(3, "USD"), "discount": Euro(1)}, cls=EventSerializer
+        )
+        assert result == '{"price": "3 USD", "discount": "1 EUR"}'
+    finally:
+        EventSerializer.unregister(Money)
+
+    # without a handler, the attributes are serialized
+    assert json.loads(json.dumps(Euro(1), cls=EventSerializer)) == {
+        "amount": 1,
+        "currency": "EUR",
+    }
+
+
+def test_handlers_are_cached_per_class():
+    json.dumps([uuid.uuid4(), uuid.uuid4()], cls=EventSerializer)
+
+    assert uuid.UUID in EventSerializer._dispatch_cache
+
+
+def test_normalize_truncates_beyond_budget():
+    assert serializer.normalize({"a": "x" * 10}, max_bytes=100) == {"a": "x" * 10}
+
+    text = serializer.normalize("x" * 1_000, max_bytes=100)
+    assert text == "x" * 98 + "...[truncated, 1000 chars]"
+
+    items = serializer.normalize(list(range(1_000)), max_bytes=100)
+    assert items[:5] == [0, 1, 2, 3, 4]
+    assert items[-1] == f"...[truncated, {1_000 - len(items) + 1} of 1000 items]"
+
+    keys = serializer.normalize({str(i): i for i in range(1_000)}, max_bytes=100)
+    assert keys["0"] == 0
+    assert keys[serializer.TRUNCATED_KEY].endswith(" of 1000 keys]")
+
+
+def test_normalize_converts_values():
+    cyclic = {"name": "root"}
+    cyclic["self"] = cyclic
+
+    result = serializer.normalize(
+        {
+            "when": datetime(2024, 1, 1, tzinfo=timezone.utc),
+            "ids": (1, 2),
+            1: cyclic,
+            "model": TestModel(
+                foo="bar", bar=datetime(2021, 1, 1, tzinfo=timezone.utc)
+            ),
+        }
+    )
+
+    assert result == {
+        "when": "2024-01-01T00:00:00Z",
+        "ids": [1, 2],
+        "1": {"name": "root", "self": "dict"},
+        "model": {"foo": "bar", "bar": "2021-01-01T00:00:00Z"},
+    }
+
+
+class Broken:
+    @property
+    def __dict__(self):
+        raise RuntimeError("broken")
+
+
+def test_normalize_replaces_values_that_fail_to_convert():
+    result = serializer.normalize({"b": b"\xff\xfe", "items": [1, Broken()], "ok": "x"})
+
+    assert result == {
+        "b": "<not serializable object of type: bytes>",
+        "items": [1, "<not serializable object of type: Broken>"],
+        "ok": "x",
+    }
+
+    event = {"id": "1", "body": {"input": {"b": b"\xff"}, "output": "hello"}}
+    encoded = json.loads(serializer.serialize_event(event, 1_000, 1_000))
+    assert encoded["body"] == {
+        "input": {"b": "<not serializable object of type: bytes>"},
+        "output": "hello",
+    }
+
+
+class Doc(BaseModel):
+    text: str
+    meta: dict
+
+
+@dataclass
+class MutableDoc:
+    text: str
+    meta: dict
+
+
+@pytest.mark.parametrize("doc_type", [Doc, MutableDoc])
+def test_mutable_objects_are_converted_on_every_use(doc_type):
+    doc = doc_type(text="a", meta={"score": 1})
+
+    assert json.dumps(doc, cls=EventSerializer) == '{"text": "a", "meta": {"score": 1}}'
+
+    doc.meta["score"] = 2
+    assert json.dumps(doc, cls=EventSerializer) == '{"text": "a", "meta": {"score": 2}}'
@@ -0,0 +1,59 @@
+from unittest.mock import patch
+
+from langfuse.decorators.observation_state import (
+    ObservationRegistry,
+    ObservationState,
+    StackFrame,
+)
+
+
+def test_state_holds_observation_params():
+    state = ObservationState()
+    state.update({"name": "retrieval", "level": "ERROR"})
+
+    params = state.to_params()
+    assert params["name"] == "retrieval"
+    assert params["level"] == "ERROR"
+    assert params["output"] is None
+    assert len(params) == 19
+
+
+def test_registry_creates_and_removes_states():
+    registry = ObservationRegistry()
+
+    registry.get("a").update({"name": "a"})
+    assert registry.get("a").name == "a"
+    assert len(registry) == 1
+
+    assert registry.pop("a").name == "a"
+    assert len(registry) == 0
+    # finalizing an observation without state yields empty params
+    assert registry.pop("a").name is None
+
+
+def test_registry_evicts_orphaned_states():
+    registry = ObservationRegistry(ttl=10)
+
+    with patch("langfuse.decorators.observation_state.time.monotonic") as monotonic:
+        monotonic.return_value = 0
+        registry.get("orphan")
+        registry.get("running")
+
+        monotonic.return_value = 8
+        registry.get("running")
+
+        monotonic.return_value = 12
+        registry.get("new")
+
+    assert len(registry) == 2
+    assert registry.pop("orphan").name is None
+
+
+def test_stack_frames_link_to_their_parent():
+    root = StackFrame("trace", None)
+    child = StackFrame("span", root)
+    grandchild = StackFrame("generation", child)
+
+    assert grandchild.root is root
+    assert grandchild.parent.observation == "span"
+    assert root.root is root
@@ -0,0 +1,148 @@
+import json
+
+import pytest
+from pytest_httpserver import HTTPServer
+from werkzeug.wrappers import Request, Response
+
+from langfuse.exporter import FileExporter
+from langfuse.replay import Checkpoint, main, read_batches
+
+
+def write_events(path, count, start=0):
+    with open(path, "w") as f:
+        for i in range(start, start + count):
+            f.write(json.dumps({"id": str(i), "type": "event-create"}) + "\n")
+
+
+def replay(httpserver: HTTPServer, *args):
+    return main(
+        [
+            "--host",
+            httpserver.url_for("/").rstrip("/"),
+            "--public-key",
+            "pk",
+            "--secret-key",
+            "sk",
+            "--max-retries",
+            "2",
+            *args,
+        ]
+    )
+
+
+def test_read_batches_respects_limits(tmp_path):
+    path = str(tmp_path / "events.ndjson")
+    write_events(path, 10)
+
+    batches = list(read_batches(path, 0, max_items=4, max_bytes=1_000))
+    assert [(b.start, b.end, len(b.events)) for b in batches] == [
+        (0, 4, 4),
+        (4, 8, 4),
+        (8, 10, 2),
+    ]
+
+    batches = list(read_batches(path, 3, max_items=100, max_bytes=100))
+    assert batches[0].start == 3
+    assert all(sum(len(e.data) for e in b.events) <= 100 for b in batches)
+    assert sum(len(b.events) for b in batches) == 7
+
+
+def test_read_batches_skips_invalid_lines(tmp_path):
+    path = tmp_path / "events.ndjson"
+    path.write_bytes(
+        b'{"id": "1", "type": "event-create"}\n'
+        b'{"id": "2", "type": "event-cre\n'
+        b"\xff\xfe\n"
+        b"[1, 2]\n"
+        b"\n"
+        b'{"id": "3", "type": "event-create"}\n'
+    )
+
+    batches = list(read_batches(str(path), 0, max_items=100, max_bytes=1_000))
+
+    assert [(b.start, b.end) for b in batches] == [(0, 6)]
+    assert [json.loads(e.data)["id"] for e in batches[0].events] == ["1", "3"]
+
+
+def test_checkpoint_advances_over_contiguous_batches(tmp_path):
+    checkpoint = Checkpoint(str(tmp_path / "checkpoint"))
+
+    checkpoint.complete("a", 10, 20)
+    assert checkpoint.lines_done("a") == 0
+
+    checkpoint.complete("a", 0, 10)
+    assert checkpoint.lines_done("a") == 20
+
+    checkpoint.save()
+    assert Checkpoint(str(tmp_path / "checkpoint")).lines_done("a") == 20
+
+
+@pytest.mark.timeout(20)
+def test_replay_uploads_files_concurrently(httpserver: HTTPServer, tmp_path):
+    received = []
+
+    def handler(request: Request):
+        received.extend(request.json["batch"])
+        return Response(status=200)
+
+    httpserver.expect_request(
+        "/api/public/ingestion", method="POST"
+    ).respond_with_handler(handler)
+
+    exporter = FileExporter(str(tmp_path / "spool"), compression="zstd")
+    exporter.export([json.dumps({"id": "zst"}).encode()], {})
+    exporter.shutdown()
+    write_events(str(tmp_path / "spool" / "events.ndjson"), 250)
+
+    exit_code = replay(
+        httpserver,
+        "--concurrency",
+        "4",
+        "--batch-size",
+        "20",
+        "--checkpoint",
+        str(tmp_path / "checkpoint"),
+        str(tmp_path / "spool"),
+    )
+
+    assert exit_code == 0
+    assert sorted(event["id"] for event in received) == sorted(
+        [str(i) for i in range(250)] + ["zst"]
+    )
+
+
+@pytest.mark.timeout(20)
+def test_interrupted_replay_resumes_from_checkpoint(httpserver: HTTPServer, tmp_path):
+    received = []
+    outage_after = 3
+
+    def handler(request: Request):
+        if outage_after is not None and len(received) >= outage_after * 10:
+            return Response(status=503)
+        received.extend(request.json["batch"])
+        return Response(status=200)
+
+    httpserver.expect_request(
+        "/api/public/ingestion", method="POST"
+    ).respond_with_handler(handler)
+
+    path = str(tmp_path / "events.ndjson")
+    write_events(path, 100)
+    args = [
+        "--concurrency",
+        "1",
+        "--batch-size",
+        "10",
+        "--checkpoint",
+        str(tmp_path / "checkpoint"),
+        path,
+    ]
+
+    assert replay(httpserver, *args) == 1
+    assert len(received) == 30
+
+    outage_after = None
+    assert replay(httpserver, *args) == 0
+
+    # nothing that was acknowledged is sent twice
+    assert [event["id"] for event in received] == [str(i) for i in range(100)]
@@ -0,0 +1,188 @@
+from unittest.mock import patch
+
+import pytest
+
+from langfuse import Langfuse
+from langfuse.decorators import langfuse_context, observe
+from langfuse.decorators.langfuse_decorator import LangfuseDecorator
+from langfuse.exporter import InMemoryExporter
+from langfuse.sampling import (
+    MIN_LATENCY_SAMPLES,
+    HeadSampler,
+    TailSampler,
+    TraceBuffer,
+)
+
+
+class RecordingTaskManager:
+    def __init__(self):
+        self.events = []
+
+    def add_task(self, event):
+        self.events.append(event)
+
+    def flush(self):
+        return "flushed"
+
+
+def span(level=None):
+    return {"type": "span-create", "body": {"level": level} if level else {}}
+
+
+def finished_trace(duration, has_error=False):
+    trace = TraceBuffer(RecordingTaskManager())
+    trace.duration = duration
+    trace.has_error = has_error
+
+    return trace
+
+
+def test_buffer_holds_events_until_kept():
+    task_manager = RecordingTaskManager()
+    trace = TraceBuffer(task_manager, name="request")
+
+    trace.add_task(span())
+    trace.add_task(span("ERROR"))
+    assert task_manager.events == []
+    assert trace.has_error
+    assert trace.flush() == "flushed"
+
+    assert trace.finish(TailSampler(0.0))
+    assert trace.duration is not None
+    assert len(task_manager.events) == 2
+
+    # late events follow the decision
+    trace.add_task(span())
+    assert len(task_manager.events) == 3
+
+
+def test_dropped_traces_are_not_uploaded():
+    task_manager = RecordingTaskManager()
+    trace = TraceBuffer(task_manager)
+
+    trace.add_task(span())
+    assert not trace.finish(TailSampler(0.0))
+
+    trace.add_task(span())
+    assert task_manager.events == []
+    assert trace.events == []
+
+
+def test_sampler_keeps_errors_and_a_share_of_the_rest():
+    assert TailSampler(0.0).should_keep(finished_trace(0.1, has_error=True))
+    assert not TailSampler(0.0, keep_errors=False).should_keep(
+        finished_trace(0.1, has_error=True)
+    )
+    assert TailSampler(1.0).should_keep(finished_trace(0.1))
+
+    sampler = TailSampler(0.25)
+    kept = sum(sampler.should_keep(finished_trace(0.1)) for _ in range(4_000))
+    assert 800 < kept < 1_200
+
+
+def test_sampler_keeps_slow_traces():
+    sampler = TailSampler(0.0, latency_percentile=90, latency_window=100)
+
+    # the percentile is only known after some traces
+    assert not sampler.should_keep(finished_trace(10.0))
+
+    for i in range(MIN_LATENCY_SAMPLES * 5):
+        sampler.should_keep(finished_trace(i / 100))
+
+    assert sampler.should_keep(finished_trace(5.0))
+    assert not sampler.should_keep(finished_trace(0.5))
+
+
+def test_sampler_validates_arguments():
+    with pytest.raises(ValueError):
+        TailSampler(1.5)
+
+    with pytest.raises(ValueError):
+        TailSampler(0.1, latency_percentile=100)
+
+
+def test_head_sampler_is_deterministic():
+    sampler = HeadSampler(0.3)
+    trace_ids = [f"trace-{i}" for i in range(2_000)]
+
+    sampled = [sampler.is_sampled(trace_id) for trace_id in trace_ids]
+    assert sampled == [HeadSampler(0.3).is_sampled(t) for t in trace_ids]
+    assert 500 < sum(sampled) < 700
+
+    assert not any(HeadSampler(0.0).is_sampled(t) for t in trace_ids)
+    assert all(HeadSampler(1.0).is_sampled(t) for t in trace_ids)
+
+
+def test_head_sampler_overrides_apply_to_the_trace_id():
+    sampler = HeadSampler(0.0, overrides={"checkout": 1.0})
+
+    assert sampler.is_sampled("trace-1", name="checkout")
+    # later events of the trace only know its id
+    assert sampler.is_sampled("trace-1")
+    assert not sampler.is_sampled("trace-2", name="search")
+
+
+def test_unsampled_traces_are_not_built_or_recorded():
+    exporter = InMemoryExporter()
+    langfuse = Langfuse(
+        exporter=exporter, sample_rate=0.0, sample_rate_overrides={"vip": 1.0}
+    )
+
+    trace = langfuse.trace(name="request")
+    with patch("langfuse.client.CreateSpanBody") as span_body:
+        span = trace.span(name="retrieval")
+    span_body.assert_not_called()
+    span.generation(name="llm").end(output="answer")
+    span.end()
+    trace.score(name="quality", value=1)
+    langfuse.score(trace_id=trace.id, name="feedback", value=1)
+
+    assert not trace.sampled
+    assert not span.sampled
+
+    vip = langfuse.trace(name="vip")
+    langfuse.span(trace_id=vip.id, name="retrieval")
+    langfuse.flush()
+
+    assert vip.sampled
+    assert {
+        event["body"].get("traceId", event["body"]["id"]) for event in exporter.events()
+    } == {vip.id}
+
+
+def test_tail_sampling_holds_the_events_of_all_clients_by_trace_id():
+    exporter = InMemoryExporter()
+    langfuse = Langfuse(exporter=exporter)
+
+    @observe()
+    def handle(fail):
+        langfuse_context.score_current_trace(name="quality", value=1)
+
+        # e.g. a generation of the OpenAI integration
+        generation = langfuse.generation(
+            trace_id=langfuse_context.get_current_trace_id(), name="llm"
+        )
+        if fail:
+            generation.end(level="ERROR", status_message="failed")
+        else:
+            generation.end()
+
+    with patch.object(LangfuseDecorator, "_get_langfuse", return_value=langfuse):
+        langfuse_context._tail_sampler = TailSampler(0.0)
+        try:
+            handle(False, langfuse_observation_id="dropped")
+            handle(True, langfuse_observation_id="kept")
+        finally:
+            langfuse_context._tail_sampler = None
+
+    # late events of a dropped trace are discarded as well
+    langfuse.score(trace_id="dropped", name="feedback", value=1)
+    langfuse.flush()
+
+    events = exporter.events()
+    assert {event["body"].get("traceId", event["body"]["id"]) for event in events} == {
+        "kept"
+    }
+    assert {"trace-create", "score-create", "generation-create"} <= {
+        event["type"] for event in events
+    }
@@ -0,0 +1,95 @@
+import os
+
+import pytest
+
+from langfuse.spill_queue import SpillDirectoryInUseError, SpillQueue, fcntl
+
+
+def test_records_are_replayed_in_order(tmp_path):
+    spill = SpillQueue(str(tmp_path), segment_size=100)
+
+    records = [f'{{"id": {i}}}'.encode() for i in range(20)]
+    for record in records:
+        assert spill.append([record])
+
+    assert len(spill) == 20
+
+    replayed = []
+    while len(spill) > 0:
+        batch = spill.read(max_items=3, max_bytes=1_000)
+        replayed.extend(batch)
+        spill.ack()
+
+    assert replayed == records
+    # fully acknowledged segments are removed
+    assert len([f for f in os.listdir(tmp_path) if f.endswith(".seg")]) == 1
+
+
+def test_released_records_are_read_again(tmp_path):
+    spill = SpillQueue(str(tmp_path))
+    spill.append([b"a", b"b"])
+
+    assert spill.read(max_items=10, max_bytes=1_000) == [b"a", b"b"]
+    # reading is exclusive until the batch is acknowledged or released
+    assert spill.read(max_items=10, max_bytes=1_000) == []
+
+    spill.release()
+
+    assert spill.read(max_items=1, max_bytes=1_000) == [b"a"]
+    spill.ack()
+    assert spill.read(max_items=10, max_bytes=1_000) == [b"b"]
+
+
+def test_unacknowledged_records_survive_restart(tmp_path):
+    spill = SpillQueue(str(tmp_path))
+    spill.append([b"a", b"b", b"c"])
+
+    spill.read(max_items=1, max_bytes=1_000)
+    spill.ack()
+    spill.read(max_items=1, max_bytes=1_000)
+    spill.close()
+
+    restarted = SpillQueue(str(tmp_path))
+    assert len(restarted) == 2
+    assert restarted.read(max_items=10, max_bytes=1_000) == [b"b", b"c"]
+
+    restarted.append([b"d"])
+    restarted.ack()
+    assert restarted.read(max_items=10, max_bytes=1_000) == [b"d"]
+
+
+def test_torn_records_are_skipped(tmp_path):
+    spill = SpillQueue(str(tmp_path))
+    spill.append([b"a"])
+    spill.close()
+
+    segment = [f for f in os.listdir(tmp_path) if f.endswith(".seg")][0]
+    with open(tmp_path / segment, "ab") as f:
+        f.write(b"\x00\x00\x00\x10abc")
+
+    restarted = SpillQueue(str(tmp_path))
+    assert len(restarted) == 1
+    assert restarted.read(max_items=10, max_bytes=1_000) == [b"a"]
+
+
+def test_disk_usage_is_bounded(tmp_path):
+    spill = SpillQueue(str(tmp_path), max_bytes=100)
+
+    assert spill.append([b"a" * 50])
+    assert not spill.append([b"a" * 50])
+    assert len(spill) == 1
+
+
+@pytest.mark.skipif(fcntl is None, reason="directories are only locked on POSIX")
+def test_directory_is_locked_while_in_use(tmp_path):
+    spill = SpillQueue(str(tmp_path))
+
+    with pytest.raises(SpillDirectoryInUseError):
+        SpillQueue(str(tmp_path))
+
+    spill.append([b"a"])
+    spill.close()
+    assert not spill.append([b"b"])
+
+    restarted = SpillQueue(str(tmp_path))
+    assert restarted.read(max_items=10, max_bytes=1_000) == [b"a"]
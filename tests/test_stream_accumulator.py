@@ -0,0 +1,52 @@
+from langfuse.decorators.stream_accumulator import StreamAccumulator
+
+
+def test_short_streams_are_kept_completely():
+    accumulator = StreamAccumulator(max_bytes=1_000)
+    for token in ["Hello", ", ", "world"]:
+        accumulator.add(token)
+
+    assert accumulator.output() == "Hello, world"
+    assert accumulator.output(lambda items: "|".join(items)) == "Hello|, |world"
+
+    accumulator = StreamAccumulator(max_bytes=1_000)
+    for item in [{"delta": "a"}, 1, None]:
+        accumulator.add(item)
+
+    assert accumulator.output() == [{"delta": "a"}, 1, None]
+    assert StreamAccumulator().output() == ""
+
+
+def test_long_streams_keep_head_and_tail():
+    accumulator = StreamAccumulator(max_bytes=20)
+    for i in range(1_000):
+        accumulator.add(f"{i % 10}")
+
+    assert accumulator.count == 1_000
+    assert accumulator.output() == "0123456789...[truncated, 980 chars]...0123456789"
+
+    accumulator = StreamAccumulator(max_bytes=200)
+    for i in range(1_000):
+        accumulator.add({"i": i})
+
+    output = accumulator.output()
+    assert output[0] == {"i": 0}
+    assert output[-1] == {"i": 999}
+    marker = next(item for item in output if isinstance(item, str))
+    assert marker == f"...[truncated, {1_000 - len(output) + 1} of 1000 items]"
+
+
+def test_large_items_are_cut_to_the_cap():
+    accumulator = StreamAccumulator(max_bytes=20)
+    accumulator.add("a" * 5)
+    accumulator.add("b" * 1_000)
+
+    assert accumulator.output() == "aaaaa...[truncated, 990 chars]..." + "b" * 10
+
+
+def test_nothing_is_retained_without_capture():
+    accumulator = StreamAccumulator(max_bytes=0)
+    accumulator.add("token")
+
+    assert accumulator.count == 1
+    assert accumulator.items() == []
@@ -1,6 +1,15 @@
+import asyncio
+import gc
+import gzip
+import json
 import logging
 import subprocess
 import threading
+import time
+import uuid
+import weakref
+from dataclasses import dataclass
+from unittest.mock import patch
 from urllib.parse import urlparse, urlunparse
 import httpx
 
@@ -8,8 +17,19 @@ import pytest
 from pytest_httpserver import HTTPServer
 from werkzeug.wrappers import Request, Response
 
-from langfuse.request import LangfuseClient
-from langfuse.task_manager import TaskManager
+from langfuse.exporter import Exporter
+from langfuse.request import APIError, APIErrors, LangfuseClient
+from langfuse.serializer import serialize_event
+from langfuse.task_manager import (
+    FIELD_SIZE_BUDGET,
+    MAX_ADAPTIVE_BATCH_SIZE,
+    MAX_MSG_SIZE,
+    BatchController,
+    QueuedEvent,
+    TaskManager,
+    async_upload_with_retries,
+    upload_with_retries,
+)
 
 logging.basicConfig()
 log = logging.getLogger("langfuse")
@@ -220,6 +240,7 @@ def test_atexit():
 import time
 import logging
 from langfuse.task_manager import TaskManager  # assuming task_manager is the module name
+from langfuse.exporter import Exporter
 from langfuse.request import LangfuseClient
 import httpx
 
@@ -423,3 +444,1262 @@ def test_large_events_i_o_dropped(httpserver: HTTPServer):
     assert tm._queue.empty()
     assert not failed
     assert count == 2
+
+
+def test_events_are_serialized_once(httpserver: HTTPServer):
+    received = []
+
+    def handler(request: Request):
+        received.append(request.json)
+        return Response(status=200)
+
+    httpserver.expect_request(
+        "/api/public/ingestion", method="POST"
+    ).respond_with_handler(handler)
+
+    langfuse_client = setup_langfuse_client(
+        get_host(httpserver.url_for("/api/public/ingestion"))
+    )
+
+    tm = TaskManager(
+        langfuse_client, 10, 0.1, 3, 1, 10_000, "test-sdk", "1.0.0", "default"
+    )
+
+    with patch(
+        "langfuse.task_manager.serialize_event", wraps=serialize_event
+    ) as serialize_mock:
+        tm.add_task({"foo": "bar"})
+        tm.add_task({"foo": "baz", "nested": {"id": uuid.uuid4()}})
+        tm.flush()
+
+    assert serialize_mock.call_count == 2
+
+    batch = [event for body in received for event in body["batch"]]
+    assert [event["foo"] for event in batch] == ["bar", "baz"]
+    assert all("timestamp" in event for event in batch)
+    assert received[0]["metadata"]["batch_size"] == len(received[0]["batch"])
+
+
+def test_large_inputs_are_truncated_while_encoding(httpserver: HTTPServer):
+    received = []
+
+    def handler(request: Request):
+        received.extend(request.json["batch"])
+        return Response(status=200)
+
+    httpserver.expect_request(
+        "/api/public/ingestion", method="POST"
+    ).respond_with_handler(handler)
+
+    langfuse_client = setup_langfuse_client(
+        get_host(httpserver.url_for("/api/public/ingestion"))
+    )
+
+    tm = TaskManager(
+        langfuse_client, 10, 0.1, 3, 1, 10_000, "test-sdk", "1.0.0", "default"
+    )
+
+    chunks = ["retrieved chunk " * 60] * 50_000
+    with patch(
+        "langfuse.task_manager.serialize_event", wraps=serialize_event
+    ) as serialize_mock:
+        tm.add_task(
+            {"type": "span-create", "body": {"input": chunks, "output": "answer"}}
+        )
+        tm.flush()
+
+    # the event is encoded once, within the size limit
+    assert serialize_mock.call_count == 1
+
+    body = received[0]["body"]
+    assert body["output"] == "answer"
+    assert body["input"][0] == chunks[0]
+    assert body["input"][-1].startswith("...[truncated, ")
+    assert body["input"][-1].endswith(" of 50000 items]")
+    assert len(json.dumps(received[0])) < MAX_MSG_SIZE
+
+
+@pytest.mark.parametrize("compression", ["gzip", "zstd"])
+def test_compressed_batch_upload(httpserver: HTTPServer, compression):
+    if compression == "zstd":
+        zstandard = pytest.importorskip("zstandard")
+
+    received = []
+
+    def handler(request: Request):
+        body = request.get_data()
+        encoding = request.headers.get("Content-Encoding")
+        if encoding == "gzip":
+            body = gzip.decompress(body)
+        elif encoding == "zstd":
+            body = zstandard.ZstdDecompressor().decompress(body)
+        received.append((encoding, json.loads(body)))
+        return Response(status=200)
+
+    httpserver.expect_request(
+        "/api/public/ingestion", method="POST"
+    ).respond_with_handler(handler)
+
+    langfuse_client = LangfuseClient(
+        "public_key",
+        "secret_key",
+        get_host(httpserver.url_for("/api/public/ingestion")),
+        "1.0.0",
+        15,
+        httpx.Client(),
+        compression=compression,
+    )
+
+    tm = TaskManager(
+        langfuse_client, 10, 0.1, 3, 1, 10_000, "test-sdk", "1.0.0", "default"
+    )
+
+    tm.add_task({"body": {"input": "a" * 10_000}})
+    tm.flush()
+
+    encoding, payload = received[0]
+    assert encoding == compression
+    assert payload["batch"][0]["body"]["input"] == "a" * 10_000
+
+
+def test_small_batches_are_not_compressed(httpserver: HTTPServer):
+    encodings = []
+
+    def handler(request: Request):
+        encodings.append(request.headers.get("Content-Encoding"))
+        assert request.json["batch"][0]["foo"] == "bar"
+        return Response(status=200)
+
+    httpserver.expect_request(
+        "/api/public/ingestion", method="POST"
+    ).respond_with_handler(handler)
+
+    langfuse_client = LangfuseClient(
+        "public_key",
+        "secret_key",
+        get_host(httpserver.url_for("/api/public/ingestion")),
+        "1.0.0",
+        15,
+        httpx.Client(),
+        compression="gzip",
+    )
+
+    tm = TaskManager(
+        langfuse_client, 10, 0.1, 3, 1, 10_000, "test-sdk", "1.0.0", "default"
+    )
+
+    tm.add_task({"foo": "bar"})
+    tm.flush()
+
+    assert encodings == [None]
+
+
+@pytest.mark.timeout(20)
+def test_failed_batches_are_spilled_and_replayed(httpserver: HTTPServer, tmp_path):
+    available = False
+    received = []
+
+    def handler(request: Request):
+        if not available:
+            return Response(status=503)
+        received.extend(request.json["batch"])
+        return Response(status=200)
+
+    httpserver.expect_request(
+        "/api/public/ingestion", method="POST"
+    ).respond_with_handler(handler)
+
+    langfuse_client = setup_langfuse_client(
+        get_host(httpserver.url_for("/api/public/ingestion"))
+    )
+
+    tm = TaskManager(
+        langfuse_client,
+        10,
+        0.1,
+        1,
+        1,
+        10_000,
+        "test-sdk",
+        "1.0.0",
+        "default",
+        spill_directory=str(tmp_path),
+    )
+
+    tm.add_task({"foo": "first"})
+    tm.add_task({"foo": "second"})
+    tm._queue.join()
+    tm.join()
+
+    assert received == []
+
+    # a new task manager replays the events spilled by the previous one
+    available = True
+    tm = TaskManager(
+        langfuse_client,
+        10,
+        0.1,
+        1,
+        1,
+        10_000,
+        "test-sdk",
+        "1.0.0",
+        "default",
+        spill_directory=str(tmp_path),
+    )
+    tm.flush()
+
+    assert [event["foo"] for event in received] == ["first", "second"]
+    assert len(tm._spill) == 0
+
+
+@pytest.mark.timeout(10)
+def test_full_queue_spills_to_disk(httpserver: HTTPServer, tmp_path):
+    langfuse_client = setup_langfuse_client(
+        get_host(httpserver.url_for("/api/public/ingestion"))
+    )
+
+    tm = TaskManager(
+        langfuse_client,
+        10,
+        0.1,
+        1,
+        0,
+        10_000,
+        "test-sdk",
+        "1.0.0",
+        "default",
+        max_task_queue_size=1,
+        spill_directory=str(tmp_path),
+    )
+
+    tm.add_task({"foo": "bar"})
+    tm.add_task({"foo": "baz"})
+
+    assert tm._queue.qsize() == 1
+    assert len(tm._spill) == 1
+    assert json.loads(tm._spill.read(10, 1_000)[0])["foo"] == "baz"
+
+
+@pytest.mark.timeout(10)
+def test_partial_success_resends_failed_events_only(httpserver: HTTPServer):
+    requests = []
+
+    def handler(request: Request):
+        batch = request.json["batch"]
+        requests.append([event["body"]["name"] for event in batch])
+
+        # the first attempt partially fails, the server rejects one event for good
+        if len(requests) > 1:
+            return Response(status=200)
+
+        errors = [
+            {"id": event["id"], "status": 500 if name == "flaky" else 400}
+            for event, name in zip(batch, requests[0])
+            if name in ("flaky", "invalid")
+        ]
+        successes = [
+            {"id": event["id"], "status": 201}
+            for event in batch
+            if event["body"]["name"] == "ok"
+        ]
+        return Response(
+            json.dumps({"successes": successes, "errors": errors}),
+            status=207,
+            content_type="application/json",
+        )
+
+    httpserver.expect_request(
+        "/api/public/ingestion", method="POST"
+    ).respond_with_handler(handler)
+
+    langfuse_client = setup_langfuse_client(
+        get_host(httpserver.url_for("/api/public/ingestion"))
+    )
+
+    dead_letters = []
+    tm = TaskManager(
+        langfuse_client,
+        10,
+        0.1,
+        3,
+        1,
+        10_000,
+        "test-sdk",
+        "1.0.0",
+        "default",
+        dead_letter_handler=lambda events, error: dead_letters.extend(events),
+    )
+
+    for name in ["ok", "flaky", "invalid"]:
+        tm.add_task({"id": str(uuid.uuid4()), "body": {"name": name}})
+
+    tm.flush()
+
+    assert requests == [["ok", "flaky", "invalid"], ["flaky"]]
+    assert [event["body"]["name"] for event in dead_letters] == ["invalid"]
+
+
+@pytest.mark.timeout(10)
+def test_rejected_batches_are_not_retried(httpserver: HTTPServer):
+    count = 0
+
+    def handler(request: Request):
+        nonlocal count
+        count += 1
+        return Response(status=400)
+
+    httpserver.expect_request(
+        "/api/public/ingestion", method="POST"
+    ).respond_with_handler(handler)
+
+    langfuse_client = setup_langfuse_client(
+        get_host(httpserver.url_for("/api/public/ingestion"))
+    )
+
+    dead_letters = []
+    tm = TaskManager(
+        langfuse_client,
+        10,
+        0.1,
+        3,
+        1,
+        10_000,
+        "test-sdk",
+        "1.0.0",
+        "default",
+        dead_letter_handler=lambda events, error: dead_letters.extend(events),
+    )
+
+    tm.add_task({"foo": "bar"})
+    tm.flush()
+
+    assert count == 1
+    assert [event["foo"] for event in dead_letters] == ["bar"]
+
+
+@pytest.mark.timeout(10)
+@pytest.mark.parametrize("coalesce_events", [True, False])
+def test_upserts_are_coalesced(httpserver: HTTPServer, coalesce_events):
+    received = []
+
+    def handler(request: Request):
+        received.extend(request.json["batch"])
+        return Response(status=200)
+
+    httpserver.expect_request(
+        "/api/public/ingestion", method="POST"
+    ).respond_with_handler(handler)
+
+    langfuse_client = setup_langfuse_client(
+        get_host(httpserver.url_for("/api/public/ingestion"))
+    )
+
+    tm = TaskManager(
+        langfuse_client,
+        10,
+        0.5,
+        3,
+        1,
+        10_000,
+        "test-sdk",
+        "1.0.0",
+        "default",
+        coalesce_events=coalesce_events,
+    )
+
+    def add(type, body):
+        tm.add_task({"id": str(uuid.uuid4()), "type": type, "body": body})
+
+    add("trace-create", {"id": "trace", "name": "trace", "tags": ["a"]})
+    add("generation-create", {"id": "gen", "traceId": "trace", "metadata": {"a": 1}})
+    add("score-create", {"id": "score", "traceId": "trace", "value": 1})
+    add("generation-update", {"id": "gen", "output": "hi", "metadata": {"b": 2}})
+    add("generation-update", {"id": "gen", "endTime": "2024-01-01T00:00:00Z"})
+    add("trace-create", {"id": "trace", "output": "hi", "tags": ["a", "b"]})
+
+    tm.flush()
+
+    if not coalesce_events:
+        assert len(received) == 6
+        return
+
+    assert [event["type"] for event in received] == [
+        "trace-create",
+        "generation-create",
+        "score-create",
+    ]
+    assert received[0]["body"] == {
+        "id": "trace",
+        "name": "trace",
+        "output": "hi",
+        "tags": ["a", "b"],
+    }
+    assert received[1]["body"] == {
+        "id": "gen",
+        "traceId": "trace",
+        "output": "hi",
+        "metadata": {"a": 1, "b": 2},
+        "endTime": "2024-01-01T00:00:00Z",
+    }
+
+
+def setup_backpressure_task_manager(**kwargs):
+    # no consumer threads, events stay in the queue
+    return TaskManager(
+        setup_langfuse_client("http://localhost:3000"),
+        10,
+        0.1,
+        1,
+        0,
+        "public_key",
+        "test-sdk",
+        "1.0.0",
+        "default",
+        **kwargs,
+    )
+
+
+def test_spilling_is_disabled_if_the_directory_is_in_use(tmp_path):
+    tm = setup_backpressure_task_manager(spill_directory=str(tmp_path))
+    other = setup_backpressure_task_manager(spill_directory=str(tmp_path))
+
+    assert tm._spill is not None
+    assert other._spill is None
+
+    tm.join()
+    restarted = setup_backpressure_task_manager(spill_directory=str(tmp_path))
+    assert restarted._spill is not None
+
+
+def queued_names(tm: TaskManager):
+    return [item.decoded()["body"]["name"] for item in tm._queue.queue]
+
+
+def test_drop_newest_policy():
+    tm = setup_backpressure_task_manager(max_task_queue_size=2)
+
+    for name in ["a", "b", "c"]:
+        tm.add_task({"type": "span-create", "body": {"name": name}})
+
+    assert queued_names(tm) == ["a", "b"]
+    assert tm.dropped_events() == {"drop_newest": 1}
+
+
+def test_drop_oldest_policy():
+    tm = setup_backpressure_task_manager(
+        max_task_queue_size=2, backpressure_policy="drop_oldest"
+    )
+
+    for name in ["a", "b", "c"]:
+        tm.add_task({"type": "span-create", "body": {"name": name}})
+
+    assert queued_names(tm) == ["b", "c"]
+    assert tm.dropped_events() == {"drop_oldest": 1}
+    assert tm._queue.unfinished_tasks == 2
+
+
+@pytest.mark.timeout(10)
+def test_block_policy():
+    tm = setup_backpressure_task_manager(
+        max_task_queue_size=1, backpressure_policy="block", queue_block_timeout=2
+    )
+
+    tm.add_task({"type": "span-create", "body": {"name": "a"}})
+
+    def consume():
+        tm._queue.get()
+        tm._queue.task_done()
+
+    threading.Timer(0.2, consume).start()
+    tm.add_task({"type": "span-create", "body": {"name": "b"}})
+
+    assert queued_names(tm) == ["b"]
+
+    tm._queue_block_timeout = 0.1
+    assert tm.add_task({"type": "span-create", "body": {"name": "c"}}) is False
+    assert tm.dropped_events() == {"block": 1}
+
+
+def test_max_queue_bytes():
+    tm = setup_backpressure_task_manager(max_queue_bytes=1_000)
+
+    for _ in range(10):
+        tm.add_task({"type": "span-create", "body": {"name": "a" * 200}})
+
+    assert 0 < tm._queue.bytes <= 1_000
+    assert tm._queue.qsize() == 3
+    assert tm.dropped_events() == {"drop_newest": 7}
+
+
+def test_shed_policy_keeps_scores_and_traces():
+    tm = setup_backpressure_task_manager(
+        max_task_queue_size=10, backpressure_policy="shed"
+    )
+
+    for i in range(100):
+        tm.add_task({"type": "span-create", "body": {"name": f"span-{i}"}})
+    tm.add_task({"type": "score-create", "body": {"name": "score"}})
+    tm.add_task({"type": "trace-create", "body": {"name": "trace"}})
+
+    names = queued_names(tm)
+    assert len(names) <= 10
+    assert names[-2:] == ["score", "trace"]
+    assert tm.dropped_events()["shed"] == 102 - len(names)
+
+
+def test_shed_policy_prefers_large_events():
+    tm = setup_backpressure_task_manager(max_task_queue_size=100)
+
+    for _ in range(90):
+        tm.add_task({"type": "span-create", "body": {"name": "x" * 1_000}})
+
+    small = QueuedEvent({"type": "span-create", "body": {"name": "x"}})
+    large = QueuedEvent({"type": "span-create", "body": {"name": "x" * 5_000}})
+
+    def shed_rate(item):
+        shed = [tm._queue._should_shed(item, len(item.data)) for _ in range(1_000)]
+        return sum(shed) / len(shed)
+
+    # the queue is 90% full, large events are shed with a probability of 50%
+    assert shed_rate(small) < 0.1
+    assert 0.4 < shed_rate(large) < 0.6
+
+
+@dataclass
+class Document:
+    text: str
+
+
+@pytest.mark.parametrize("create", [QueuedEvent, QueuedEvent.snapshot])
+def test_queued_events_do_not_keep_the_event(create):
+    document = Document(text="x" * 10_000)
+    document_ref = weakref.ref(document)
+
+    item = create(
+        {
+            "id": "event-1",
+            "type": "span-create",
+            "body": {"id": "span-1", "input": document},
+        }
+    )
+    assert len(item.data) > 10_000
+    del document
+    gc.collect()
+
+    assert document_ref() is None
+    assert item.type == "span-create"
+    assert item.body_id == "span-1"
+    assert item.id == "event-1"
+    assert item.decoded()["body"]["input"] == {"text": "x" * 10_000}
+
+
+def test_batch_controller_adapts_to_backlog():
+    controller = BatchController(15)
+    assert controller.batch_size == 15
+
+    controller.record_upload(0.2)
+    controller.record_batch(15, 3_000)
+    assert controller.batch_size == 3_000
+
+    time.sleep(0.01)
+    controller.record_batch(3_000, 50_000)
+    assert controller.batch_size == MAX_ADAPTIVE_BATCH_SIZE
+
+    # the batch size shrinks back once the backlog is gone and the load drops
+    controller._last_batch_time -= 10
+    controller.record_batch(100, 0)
+    assert controller.batch_size == 15
+
+
+@pytest.mark.timeout(10)
+def test_adaptive_batching(httpserver: HTTPServer):
+    batch_sizes = []
+
+    def handler(request: Request):
+        batch_sizes.append(len(request.json["batch"]))
+        time.sleep(0.05)
+        return Response(status=200)
+
+    httpserver.expect_request(
+        "/api/public/ingestion", method="POST"
+    ).respond_with_handler(handler)
+
+    langfuse_client = setup_langfuse_client(
+        get_host(httpserver.url_for("/api/public/ingestion"))
+    )
+
+    tm = TaskManager(
+        langfuse_client,
+        10,
+        0.1,
+        3,
+        1,
+        "public_key",
+        "test-sdk",
+        "1.0.0",
+        "default",
+        adaptive_batching=True,
+    )
+
+    for i in range(1_000):
+        tm.add_task({"foo": i})
+    tm.flush()
+
+    assert sum(batch_sizes) == 1_000
+    # batches grow with the backlog instead of staying at flush_at
+    assert len(batch_sizes) < 20
+
+    # idle consumers sleep until the next event but still stop promptly
+    time.sleep(0.3)
+    assert len(batch_sizes) <= 20
+    start = time.monotonic()
+    tm.join()
+    assert time.monotonic() - start < 1
+
+
+@pytest.mark.timeout(20)
+def test_consumers_scale_with_load(httpserver: HTTPServer):
+    received = 0
+
+    def handler(request: Request):
+        nonlocal received
+        time.sleep(0.1)
+        received += len(request.json["batch"])
+        return Response(status=200)
+
+    httpserver.expect_request(
+        "/api/public/ingestion", method="POST"
+    ).respond_with_handler(handler)
+
+    langfuse_client = setup_langfuse_client(
+        get_host(httpserver.url_for("/api/public/ingestion"))
+    )
+
+    with patch("langfuse.task_manager.SCALE_DOWN_IDLE_TIME", 0.2):
+        tm = TaskManager(
+            langfuse_client,
+            10,
+            0.05,
+            3,
+            1,
+            "public_key",
+            "test-sdk",
+            "1.0.0",
+            "default",
+            max_threads=3,
+        )
+
+        for i in range(500):
+            tm.add_task({"foo": i})
+
+        time.sleep(0.5)
+        assert len(tm._consumers) == 3
+
+        tm.flush()
+        assert received == 500
+
+        # consumers beyond `threads` are retired once idle
+        deadline = time.monotonic() + 5
+        while len(tm._consumers) > 1 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert len(tm._consumers) == 1
+
+        tm.join()
+
+
+@pytest.mark.timeout(10)
+def test_pipelined_uploads(httpserver: HTTPServer):
+    in_flight = 0
+    max_in_flight = 0
+    uploaded = []
+
+    async def batch_post(**kwargs):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.05)
+        in_flight -= 1
+        uploaded.extend(json.loads(event) for event in kwargs["batch"])
+
+    langfuse_client = setup_langfuse_client(
+        get_host(httpserver.url_for("/api/public/ingestion"))
+    )
+
+    def clone_for_event_loop():
+        client = LangfuseClient.clone_for_event_loop(langfuse_client)
+        client.async_batch_post = batch_post
+        return client
+
+    langfuse_client.clone_for_event_loop = clone_for_event_loop
+
+    tm = TaskManager(
+        langfuse_client,
+        5,
+        0.1,
+        3,
+        1,
+        "public_key",
+        "test-sdk",
+        "1.0.0",
+        "default",
+        max_inflight_uploads=4,
+        coalesce_events=False,
+    )
+
+    for i in range(100):
+        tm.add_task({"type": "span-create", "body": {"id": f"span-{i}"}})
+    for i in range(100):
+        tm.add_task({"type": "span-update", "body": {"id": f"span-{i}", "n": i}})
+    tm.flush()
+
+    assert len(uploaded) == 200
+    assert max_in_flight == 4
+
+    # the update of an observation is never uploaded before its create
+    position = {}
+    for i, event in enumerate(uploaded):
+        position[(event["type"], event["body"]["id"])] = i
+    for i in range(100):
+        assert (
+            position[("span-create", f"span-{i}")]
+            < position[("span-update", f"span-{i}")]
+        )
+
+    start = time.monotonic()
+    tm.join()
+    assert time.monotonic() - start < 1
+
+
+def pipelined_client(httpserver: HTTPServer, uploaded: list, delays: tuple = ()):
+    """Client whose async uploads take the next of `delays` seconds, 0.05 by default."""
+    delays = list(delays)
+
+    async def batch_post(**kwargs):
+        await asyncio.sleep(delays.pop(0) if delays else 0.05)
+        uploaded.extend(json.loads(event) for event in kwargs["batch"])
+
+    langfuse_client = setup_langfuse_client(
+        get_host(httpserver.url_for("/api/public/ingestion"))
+    )
+
+    def clone_for_event_loop():
+        client = LangfuseClient.clone_for_event_loop(langfuse_client)
+        client.async_batch_post = batch_post
+        return client
+
+    langfuse_client.clone_for_event_loop = clone_for_event_loop
+    return langfuse_client
+
+
+@pytest.mark.timeout(10)
+def test_pipelined_consumer_does_not_wait_for_events_while_uploading(
+    httpserver: HTTPServer,
+):
+    uploaded = []
+    tm = TaskManager(
+        # the first batch is still uploading once the queue is empty
+        pipelined_client(httpserver, uploaded, delays=(1.0,)),
+        5,
+        0.1,
+        3,
+        1,
+        "public_key",
+        "test-sdk",
+        "1.0.0",
+        "default",
+        max_inflight_uploads=2,
+        adaptive_batching=True,
+    )
+    # another consumer takes the events after the queue size was checked
+    tm._queue.qsize = lambda: 1_000
+
+    for i in range(20):
+        tm.add_task({"type": "span-create", "body": {"id": f"span-{i}"}})
+
+    start = time.monotonic()
+    tm._queue.join()
+    assert time.monotonic() - start < 3
+    assert len(uploaded) == 20
+
+    tm.join()
+
+
+@pytest.mark.timeout(20)
+def test_pipelined_consumer_replays_spill_asynchronously(
+    httpserver: HTTPServer, tmp_path
+):
+    httpserver.expect_request(
+        "/api/public/ingestion", method="POST"
+    ).respond_with_response(Response(status=503))
+
+    langfuse_client = setup_langfuse_client(
+        get_host(httpserver.url_for("/api/public/ingestion"))
+    )
+    tm = TaskManager(
+        langfuse_client,
+        10,
+        0.1,
+        1,
+        1,
+        "public_key",
+        "test-sdk",
+        "1.0.0",
+        "default",
+        spill_directory=str(tmp_path),
+    )
+    tm.add_task({"foo": "first"})
+    tm.add_task({"foo": "second"})
+    tm._queue.join()
+    tm.join()
+
+    uploaded = []
+    langfuse_client = pipelined_client(httpserver, uploaded)
+    langfuse_client.batch_post = lambda **kwargs: pytest.fail("uploaded synchronously")
+    tm = TaskManager(
+        langfuse_client,
+        10,
+        0.1,
+        1,
+        1,
+        "public_key",
+        "test-sdk",
+        "1.0.0",
+        "default",
+        spill_directory=str(tmp_path),
+        max_inflight_uploads=2,
+    )
+
+    deadline = time.monotonic() + 5
+    while len(tm._spill) > 0 and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+    assert [event["foo"] for event in uploaded] == ["first", "second"]
+    tm.join()
+
+
+@pytest.mark.asyncio
+async def test_http2_falls_back_without_h2():
+    try:
+        import h2  # noqa: F401
+
+        pytest.skip("h2 is installed")
+    except ImportError:
+        pass
+
+    client = LangfuseClient(
+        "public_key", "secret_key", "http://localhost", "1.0.0", 15, None, http2=True
+    )
+    session = client._create_async_session()
+
+    assert isinstance(session, httpx.AsyncClient)
+    assert client._http2 is False
+    await session.aclose()
+
+
+@pytest.mark.asyncio
+async def test_async_sessions_are_created_by_factory():
+    sessions = []
+
+    def factory():
+        sessions.append(httpx.AsyncClient(headers={"x-custom": "1"}))
+        return sessions[-1]
+
+    client = LangfuseClient(
+        "public_key",
+        "secret_key",
+        "http://localhost",
+        "1.0.0",
+        15,
+        None,
+        async_session_factory=factory,
+    )
+
+    # each event loop gets a client of its own
+    for session_owner in [client, client.clone_for_event_loop()]:
+        assert session_owner._create_async_session() is sessions[-1]
+
+    assert len(sessions) == 2
+    for session in sessions:
+        await session.aclose()
+
+
+@pytest.mark.timeout(10)
+def test_retry_after_is_honored(httpserver: HTTPServer):
+    request_times = []
+
+    def handler(request: Request):
+        request_times.append(time.monotonic())
+        if len(request_times) == 1:
+            return Response(status=429, headers={"Retry-After": "1"})
+        return Response(status=200)
+
+    httpserver.expect_request(
+        "/api/public/ingestion", method="POST"
+    ).respond_with_handler(handler)
+
+    langfuse_client = setup_langfuse_client(
+        get_host(httpserver.url_for("/api/public/ingestion"))
+    )
+
+    tm = TaskManager(
+        langfuse_client, 10, 0.1, 3, 1, "public_key", "test-sdk", "1.0.0", "default"
+    )
+
+    tm.add_task({"foo": "bar"})
+    tm.flush()
+
+    assert len(request_times) == 2
+    assert request_times[1] - request_times[0] >= 1
+
+
+@pytest.mark.timeout(10)
+@pytest.mark.parametrize("max_inflight_uploads", [1, 2])
+def test_flush_cuts_long_retry_after_short(
+    httpserver: HTTPServer, max_inflight_uploads
+):
+    request_times = []
+
+    def handler(request: Request):
+        request_times.append(time.monotonic())
+        if len(request_times) == 1:
+            return Response(status=429, headers={"Retry-After": "3600"})
+        return Response(status=200)
+
+    httpserver.expect_request(
+        "/api/public/ingestion", method="POST"
+    ).respond_with_handler(handler)
+
+    langfuse_client = setup_langfuse_client(
+        get_host(httpserver.url_for("/api/public/ingestion"))
+    )
+
+    tm = TaskManager(
+        langfuse_client,
+        10,
+        0.1,
+        3,
+        1,
+        "public_key",
+        "test-sdk",
+        "1.0.0",
+        "default",
+        max_inflight_uploads=max_inflight_uploads,
+    )
+
+    # the retry waits for the Retry-After of the API, at most a minute, until the
+    # queue is flushed
+    tm.add_task({"foo": "bar"})
+    time.sleep(1)
+    assert len(request_times) == 1
+
+    start = time.monotonic()
+    tm.flush()
+    tm.join()
+
+    assert time.monotonic() - start < 3
+    assert len(request_times) == 2
+
+
+@pytest.mark.timeout(10)
+def test_circuit_breaker_stops_uploads(httpserver: HTTPServer):
+    count = 0
+    available = False
+    received = []
+
+    def handler(request: Request):
+        nonlocal count
+        count += 1
+        if not available:
+            return Response(status=503)
+        received.extend(request.json["batch"])
+        return Response(status=200)
+
+    httpserver.expect_request(
+        "/api/public/ingestion", method="POST"
+    ).respond_with_handler(handler)
+
+    langfuse_client = setup_langfuse_client(
+        get_host(httpserver.url_for("/api/public/ingestion"))
+    )
+
+    tm = TaskManager(
+        langfuse_client,
+        1,
+        0.01,
+        2,
+        1,
+        "public_key",
+        "test-sdk",
+        "1.0.0",
+        "default",
+        circuit_breaker_threshold=3,
+    )
+
+    for i in range(10):
+        tm.add_task({"foo": i})
+
+    time.sleep(1)
+
+    # requests stop once the circuit opened, events wait in the queue
+    assert count == 3
+    assert tm._circuit_breaker.is_open
+    assert tm._queue.qsize() >= 8
+
+    # flushing does not wait for the circuit breaker to close, and uploads the
+    # waiting events instead of dropping them
+    available = True
+    start = time.monotonic()
+    tm.flush()
+    assert time.monotonic() - start < 1
+
+    # only the first event exhausted its retries before the circuit opened
+    assert sorted(event["foo"] for event in received) == list(range(1, 10))
+    tm.join()
+
+
+class FlakyExporter(Exporter):
+    def __init__(self, failures: int):
+        self.failures = failures
+        self.exported = []
+        self.lock = threading.Lock()
+
+    def export(self, batch, metadata):
+        with self.lock:
+            if self.failures > 0:
+                self.failures -= 1
+                raise httpx.ConnectError("unavailable")
+            self.exported.extend(json.loads(event) for event in batch)
+
+
+@pytest.mark.timeout(10)
+@pytest.mark.parametrize("threads", [1, 3])
+def test_batches_wait_while_circuit_is_open(threads):
+    exporter = FlakyExporter(failures=2)
+    tm = TaskManager(
+        None,
+        1,
+        0.01,
+        1,
+        threads,
+        "public_key",
+        "test-sdk",
+        "1.0.0",
+        "default",
+        circuit_breaker_threshold=2,
+        exporter=exporter,
+    )
+    tm._circuit_breaker._reset_timeout = tm._circuit_breaker._timeout = 0.2
+
+    tm.add_task({"id": "lost-1"})
+    tm.add_task({"id": "lost-2"})
+    time.sleep(0.1)
+    assert tm._circuit_breaker.is_open
+
+    # queued while the circuit is open, delivered by the trial request and after it
+    for i in range(5):
+        tm.add_task({"id": str(i)})
+    time.sleep(0.5)
+
+    assert sorted(event["id"] for event in exporter.exported) == [
+        str(i) for i in range(5)
+    ]
+    tm.flush()
+    tm.join()
+
+
+def test_deferred_serialization(httpserver: HTTPServer):
+    received = []
+
+    def handler(request: Request):
+        received.extend(request.json["batch"])
+        return Response(status=200)
+
+    httpserver.expect_request(
+        "/api/public/ingestion", method="POST"
+    ).respond_with_handler(handler)
+
+    langfuse_client = setup_langfuse_client(
+        get_host(httpserver.url_for("/api/public/ingestion"))
+    )
+
+    tm = TaskManager(
+        langfuse_client,
+        10,
+        0.1,
+        3,
+        1,
+        10_000,
+        "test-sdk",
+        "1.0.0",
+        "default",
+        deferred_serialization=True,
+    )
+
+    encoding_threads = []
+
+    def record_thread(*args):
+        encoding_threads.append(threading.current_thread())
+        return serialize_event(*args)
+
+    messages = [{"role": "user", "content": "hi"}]
+    event = {
+        "id": "1",
+        "type": "span-create",
+        "body": {"id": "span", "input": messages, "output": "hello"},
+    }
+
+    with patch("langfuse.task_manager.serialize_event", side_effect=record_thread):
+        tm.add_task(event)
+
+        # the event and the top-level containers of its input are copied
+        event["body"]["output"] = "changed"
+        messages.append({"role": "assistant", "content": "changed"})
+
+        tm.flush()
+
+    assert encoding_threads
+    assert threading.current_thread() not in encoding_threads
+    assert received[0]["body"]["input"] == [{"role": "user", "content": "hi"}]
+    assert received[0]["body"]["output"] == "hello"
+
+
+@pytest.mark.timeout(10)
+def test_deferred_events_that_fail_to_encode_are_dropped(httpserver: HTTPServer):
+    received = []
+
+    def handler(request: Request):
+        received.extend(request.json["batch"])
+        return Response(status=200)
+
+    httpserver.expect_request(
+        "/api/public/ingestion", method="POST"
+    ).respond_with_handler(handler)
+
+    langfuse_client = setup_langfuse_client(
+        get_host(httpserver.url_for("/api/public/ingestion"))
+    )
+
+    tm = TaskManager(
+        langfuse_client,
+        10,
+        0.1,
+        3,
+        1,
+        10_000,
+        "test-sdk",
+        "1.0.0",
+        "default",
+        deferred_serialization=True,
+    )
+
+    def failing_serialize_event(event, *args):
+        if event["body"]["name"] == "bad":
+            raise UnicodeDecodeError("utf-8", b"\xff", 0, 1, "invalid start byte")
+        return serialize_event(event, *args)
+
+    with patch(
+        "langfuse.task_manager.serialize_event", side_effect=failing_serialize_event
+    ):
+        tm.add_task({"type": "span-create", "body": {"name": "bad"}})
+        tm.flush()
+
+        tm.add_task({"type": "span-create", "body": {"name": "good"}})
+        tm.flush()
+
+    assert [event["body"]["name"] for event in received] == ["good"]
+    tm.join()
+
+
+def test_deferred_events_are_sized_by_their_input():
+    messages = [{"role": "user", "content": "x" * 100_000}] * 3
+    item = QueuedEvent.snapshot(
+        {
+            "type": "generation-create",
+            "body": {"input": messages, "metadata": {"context": ["y" * 50_000]}},
+        }
+    )
+
+    assert abs(item.size - len(item.data)) < 2_000
+
+    # sizing stops early for fields beyond the budget
+    many = QueuedEvent.snapshot(
+        {"type": "span-create", "body": {"input": [{"n": i} for i in range(10**6)]}}
+    )
+    assert FIELD_SIZE_BUDGET < many.size < 2 * FIELD_SIZE_BUDGET
+
+
+def _partially_failing_send(attempts):
+    def send(pending):
+        attempts.append([item.id for item in pending])
+        if len(attempts) == 1:
+            raise APIErrors(
+                [
+                    APIError(500, "unavailable", event_id="retry"),
+                    APIError(400, "invalid", event_id="invalid"),
+                ]
+            )
+
+    return send
+
+
+def _upload_items():
+    return [
+        QueuedEvent({"id": id, "type": "span-create", "body": {}})
+        for id in ["ok", "retry", "invalid"]
+    ]
+
+
+def test_upload_with_retries_resends_only_retryable_events():
+    attempts, rejected, outcomes = [], [], []
+
+    undelivered = upload_with_retries(
+        _partially_failing_send(attempts),
+        _upload_items(),
+        3,
+        lambda items, _: rejected.extend(item.id for item in items),
+        log,
+        after_attempt=outcomes.append,
+    )
+
+    assert undelivered == []
+    assert attempts == [["ok", "retry", "invalid"], ["retry"]]
+    assert rejected == ["invalid"]
+    assert [type(outcome) for outcome in outcomes] == [APIErrors, type(None)]
+
+
+def test_async_upload_with_retries_resends_only_retryable_events():
+    attempts, rejected = [], []
+    send = _partially_failing_send(attempts)
+
+    async def async_send(pending):
+        send(pending)
+
+    undelivered = asyncio.run(
+        async_upload_with_retries(
+            async_send,
+            _upload_items(),
+            3,
+            lambda items, _: rejected.extend(item.id for item in items),
+            log,
+        )
+    )
+
+    assert undelivered == []
+    assert attempts == [["ok", "retry", "invalid"], ["retry"]]
+    assert rejected == ["invalid"]
+
+
+def test_upload_with_retries_returns_events_after_transient_errors():
+    rejected = []
+
+    def send(pending):
+        raise APIError(503, "unavailable", retry_after=0)
+
+    items = _upload_items()
+    undelivered = upload_with_retries(
+        send, items, 2, lambda items, _: rejected.extend(items), log
+    )
+
+    assert undelivered == items
+    assert rejected == []